@@ -0,0 +1,335 @@
+"""Admission control: per-client rate limits and load shedding.
+
+Runs before routing, so a rejected request costs a few dict lookups and a
+small JSON response: no session, no bcrypt, no idempotency lookup.
+
+* Clients are identified by ``X-API-Key`` when the key is listed in
+  ``RATE_LIMIT_API_KEYS``, otherwise by IP (the first ``X-Forwarded-For``
+  hop with ``RATE_LIMIT_TRUST_FORWARDED=1``). Unlisted keys are ignored, so
+  rotating made-up keys neither buys fresh buckets nor evicts real clients.
+  Each gets a token bucket of ``RATE_LIMIT_RPS``/``RATE_LIMIT_BURST`` for
+  every route, and a second, smaller one (``EXPENSIVE_RATE_LIMIT_*``) for
+  expensive routes. An empty bucket gets 429 with a Retry-After. A key
+  listed as ``key:scale`` gets ``scale`` times both budgets, for clients
+  that front many users (the Streamlit app).
+* Requests in flight are capped relative to the DB pool
+  (``ADMISSION_INFLIGHT_PER_CONNECTION`` per pooled connection). Expensive
+  routes have a cap of their own and are refused while fewer than
+  ``ADMISSION_POOL_RESERVE`` connections are free, which keeps the pool for
+  cheap reads. Over a cap: 503.
+* Every ``ADMISSION_WINDOW`` seconds the p99 latency of cheap routes is
+  compared with ``ADMISSION_SLO_MS``. Latency is measured to the start of
+  the response, so a long streamed body (an NDJSON export) is not a slow
+  request. Over it, the in-flight cap shrinks
+  and expensive routes are refused outright; back under it, the cap grows
+  back step by step.
+
+Limits are per process: with N workers a client gets N times the budget.
+"""
+import json
+import math
+import os
+import time
+from collections import OrderedDict
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "0").lower() in ("1", "true", "yes")
+RATE_LIMIT_RPS = float(os.getenv("RATE_LIMIT_RPS", "50"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "100"))
+EXPENSIVE_RATE_LIMIT_RPS = float(os.getenv("EXPENSIVE_RATE_LIMIT_RPS", "1"))
+EXPENSIVE_RATE_LIMIT_BURST = float(os.getenv("EXPENSIVE_RATE_LIMIT_BURST", "10"))
+RATE_LIMIT_MAX_CLIENTS = int(os.getenv("RATE_LIMIT_MAX_CLIENTS", "100000"))
+# Comma-separated keys that get a bucket of their own, as key or key:scale
+RATE_LIMIT_API_KEYS = os.getenv("RATE_LIMIT_API_KEYS", "")
+RATE_LIMIT_TRUST_FORWARDED = os.getenv("RATE_LIMIT_TRUST_FORWARDED", "0").lower() in ("1", "true", "yes")
+# Many requests are cache hits, so more can be in flight than there are connections
+ADMISSION_INFLIGHT_PER_CONNECTION = float(os.getenv("ADMISSION_INFLIGHT_PER_CONNECTION", "2"))
+# 0 derives the value from the pool size
+ADMISSION_MAX_INFLIGHT = int(os.getenv("ADMISSION_MAX_INFLIGHT", "0"))
+EXPENSIVE_MAX_INFLIGHT = int(os.getenv("EXPENSIVE_MAX_INFLIGHT", "0"))
+ADMISSION_POOL_RESERVE = int(os.getenv("ADMISSION_POOL_RESERVE", "0"))
+ADMISSION_SLO_MS = float(os.getenv("ADMISSION_SLO_MS", "250"))
+ADMISSION_WINDOW = float(os.getenv("ADMISSION_WINDOW", "1"))
+
+# Pool capacity assumed when the pool has no fixed size (SQLite)
+DEFAULT_POOL_CAPACITY = 32
+MIN_INFLIGHT = 4
+DECREASE_FACTOR = 0.75
+# Fewer completions than this in a window is light traffic, not overload
+MIN_WINDOW_SAMPLES = 20
+MAX_WINDOW_SAMPLES = 10000
+
+CHEAP, EXPENSIVE, UNTRACKED, EXEMPT = "cheap", "expensive", "untracked", "exempt"
+
+
+class RouteSet:
+    """``(method, path)`` patterns matched against the raw request path. A
+    path ending in ``*`` matches by prefix; method ``*`` matches any method."""
+
+    def __init__(self, patterns=()):
+        self.exact = set()
+        prefixes = {}
+        for method, path in patterns:
+            if path.endswith("*"):
+                prefixes.setdefault(method, []).append(path[:-1])
+            else:
+                self.exact.add((method, path))
+        self.prefixes = {method: tuple(paths) for method, paths in prefixes.items()}
+
+    def __contains__(self, request):
+        method, path = request
+        if (method, path) in self.exact or ("*", path) in self.exact:
+            return True
+        for key in (method, "*"):
+            prefixes = self.prefixes.get(key)
+            if prefixes and path.startswith(prefixes):
+                return True
+        return False
+
+
+def parse_api_keys(value):
+    """``{key: scale}`` from ``"key,key:scale,..."``."""
+    keys = {}
+    for item in value.split(","):
+        key, _, scale = item.strip().partition(":")
+        if key:
+            keys[key] = float(scale) if scale else 1.0
+    return keys
+
+
+class TokenBuckets:
+    """One token bucket per client; the least recently seen client is
+    forgotten past ``max_clients`` (and starts again with a full bucket).
+    A client's ``scale`` multiplies both its rate and its burst."""
+
+    def __init__(self, rate, burst, max_clients=RATE_LIMIT_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = max(burst, 1.0)
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def take(self, client, now, scale=1.0):
+        """Spend a token: 0 if there was one, else seconds until there is."""
+        burst = self.burst * scale
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            if len(self._buckets) >= self.max_clients:
+                self._buckets.popitem(last=False)
+            bucket = self._buckets[client] = [burst, now]
+        else:
+            self._buckets.move_to_end(client)
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * self.rate * scale)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            return 0.0
+        return (1 - bucket[0]) / (self.rate * scale)
+
+    def refund(self, client, scale=1.0):
+        bucket = self._buckets.get(client)
+        if bucket is not None:
+            bucket[0] = min(self.burst * scale, bucket[0] + 1)
+
+
+def pool_capacity(engine):
+    """Connections the engine's pool can hand out, or None when unbounded
+    or not a sized pool (SQLite)."""
+    pool = engine.pool
+    if not hasattr(pool, "size") or pool._max_overflow < 0:
+        return None
+    return pool.size() + pool._max_overflow
+
+
+class AdmissionController:
+    """Limits, counters and the latency window behind AdmissionMiddleware."""
+
+    def __init__(self, engine=None, expensive=(), untracked=(), exempt=(), enabled=ADMISSION_CONTROL,
+                 rate=RATE_LIMIT_RPS, burst=RATE_LIMIT_BURST, expensive_rate=EXPENSIVE_RATE_LIMIT_RPS,
+                 expensive_burst=EXPENSIVE_RATE_LIMIT_BURST, max_inflight=ADMISSION_MAX_INFLIGHT,
+                 expensive_max_inflight=EXPENSIVE_MAX_INFLIGHT, pool_reserve=ADMISSION_POOL_RESERVE,
+                 slo_ms=ADMISSION_SLO_MS, window=ADMISSION_WINDOW, api_keys=RATE_LIMIT_API_KEYS):
+        self.enabled = enabled
+        self.expensive = RouteSet(expensive)
+        self.untracked = RouteSet(untracked)
+        self.exempt = RouteSet(exempt)
+        self.buckets = TokenBuckets(rate, burst)
+        self.expensive_buckets = TokenBuckets(expensive_rate, expensive_burst)
+        self.api_keys = parse_api_keys(api_keys)
+        self.trust_forwarded = RATE_LIMIT_TRUST_FORWARDED
+
+        capacity = pool_capacity(engine) if engine is not None else None
+        self.pool = engine.pool if capacity is not None else None
+        capacity = capacity or DEFAULT_POOL_CAPACITY
+        self.max_inflight = max_inflight or max(MIN_INFLIGHT, int(capacity * ADMISSION_INFLIGHT_PER_CONNECTION))
+        self.expensive_max_inflight = expensive_max_inflight or max(1, capacity // 4)
+        self.pool_capacity = capacity
+        self.pool_reserve = pool_reserve or max(1, capacity // 4)
+        self.limit = self.max_inflight
+        self.slo_ms = slo_ms
+        self.window = window
+
+        self.inflight = 0
+        self.expensive_inflight = 0
+        self.overloaded = False
+        self.last_p99_ms = 0.0
+        self._samples = []
+        self._window_end = 0.0
+        self.admitted = 0
+        self.rate_limited = 0
+        self.shed_inflight = 0
+        self.shed_pool = 0
+        self.shed_slo = 0
+
+    def classify(self, scope):
+        request = (scope["method"], scope["path"])
+        if request in self.exempt:
+            return EXEMPT
+        if request in self.expensive:
+            return EXPENSIVE
+        if request in self.untracked:
+            return UNTRACKED
+        return CHEAP
+
+    def client_id(self, scope):
+        """``(client, budget scale)`` for the request."""
+        forwarded = None
+        for key, value in scope["headers"]:
+            if key == b"x-api-key":
+                api_key = value.decode("latin-1")
+                scale = self.api_keys.get(api_key)
+                if scale is not None:
+                    return "key:" + api_key, scale
+            if key == b"x-forwarded-for" and self.trust_forwarded:
+                forwarded = value.split(b",")[0].strip().decode("latin-1")
+        if forwarded:
+            return forwarded, 1.0
+        client = scope.get("client")
+        return (client[0] if client else "unknown"), 1.0
+
+    def admit(self, scope, kind):
+        """None when the request may proceed, else ``(status, detail,
+        retry_after)`` for the rejection."""
+        now = time.monotonic()
+        client, scale = self.client_id(scope)
+        wait = self.buckets.take(client, now, scale) if self.buckets.rate > 0 else 0.0
+        if not wait and kind == EXPENSIVE and self.expensive_buckets.rate > 0:
+            wait = self.expensive_buckets.take(client, now, scale)
+            if wait:
+                # Turned away by the expensive budget: don't charge the general one
+                self.buckets.refund(client, scale)
+        if wait:
+            self.rate_limited += 1
+            return 429, "Rate limit exceeded", math.ceil(wait)
+
+        if kind != UNTRACKED:
+            if self.inflight >= self.limit:
+                self.shed_inflight += 1
+                return 503, "Server is at capacity", 1
+            if kind == EXPENSIVE:
+                if self.overloaded:
+                    self.shed_slo += 1
+                    return 503, "Server is over its latency objective", math.ceil(self.window)
+                if self.expensive_inflight >= self.expensive_max_inflight:
+                    self.shed_inflight += 1
+                    return 503, "Too many expensive requests in flight", 1
+                if self.pool is not None and self.pool_capacity - self.pool.checkedout() < self.pool_reserve:
+                    self.shed_pool += 1
+                    return 503, "Database pool is near capacity", 1
+                self.expensive_inflight += 1
+            self.inflight += 1
+        self.admitted += 1
+        return None
+
+    def release(self, kind, seconds):
+        if kind == UNTRACKED:
+            return
+        self.inflight -= 1
+        if kind == EXPENSIVE:
+            self.expensive_inflight -= 1
+            return
+        if len(self._samples) < MAX_WINDOW_SAMPLES:
+            self._samples.append(seconds)
+        now = time.monotonic()
+        if now >= self._window_end:
+            self._adjust(now)
+
+    def _adjust(self, now):
+        # AIMD on the in-flight cap, driven by the cheap routes' p99
+        samples, self._samples = self._samples, []
+        self._window_end = now + self.window
+        if len(samples) >= MIN_WINDOW_SAMPLES:
+            samples.sort()
+            self.last_p99_ms = samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000
+            if self.last_p99_ms > self.slo_ms:
+                self.overloaded = True
+                self.limit = max(MIN_INFLIGHT, int(self.limit * DECREASE_FACTOR))
+                return
+        self.overloaded = False
+        self.limit = min(self.max_inflight, self.limit + max(1, self.max_inflight // 10))
+
+    def stats(self):
+        return {
+            "enabled": self.enabled,
+            "limit": self.limit,
+            "max_inflight": self.max_inflight,
+            "inflight": self.inflight,
+            "expensive_inflight": self.expensive_inflight,
+            "overloaded": int(self.overloaded),
+            "p99_ms": round(self.last_p99_ms, 2),
+            "clients": len(self.buckets),
+            "admitted": self.admitted,
+            "rate_limited": self.rate_limited,
+            "shed_inflight": self.shed_inflight,
+            "shed_pool": self.shed_pool,
+            "shed_slo": self.shed_slo,
+        }
+
+
+async def _reject(send, status, detail, retry_after):
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(retry_after).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """Pure ASGI middleware; runs inside PrometheusMiddleware so rejections
+    are counted, and outside everything else so they stay cheap."""
+
+    def __init__(self, app, controller):
+        self.app = app
+        self.controller = controller
+
+    async def __call__(self, scope, receive, send):
+        controller = self.controller
+        if scope["type"] != "http" or not controller.enabled:
+            await self.app(scope, receive, send)
+            return
+        kind = controller.classify(scope)
+        if kind == EXEMPT:
+            await self.app(scope, receive, send)
+            return
+        rejection = controller.admit(scope, kind)
+        if rejection is not None:
+            await _reject(send, *rejection)
+            return
+
+        start = time.perf_counter()
+        started = None
+
+        async def send_wrapper(message):
+            nonlocal started
+            if started is None and message["type"] == "http.response.start":
+                started = time.perf_counter()
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            controller.release(kind, (started or time.perf_counter()) - start)
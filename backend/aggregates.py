@@ -0,0 +1,286 @@
+"""Incrementally maintained platform and lender aggregates.
+
+Every write that changes a loan's status or a lender's funds also applies
+a ``StatsDelta`` in the same transaction:
+- a platform metric goes into one of ``STATS_STRIPES`` rows of
+  ``platform_stats``;
+- a lender total goes into that lender's ``lender_stats`` row.
+
+Both are upserts of the form ``value = value + :delta``. Dashboard reads
+sum a fixed number of rows, whatever the size of the book.
+
+``reconcile`` recomputes everything from ``loans``, ``lenders`` and
+``loan_fundings``, plus the loans moved to the archive (see archive.py), in
+one snapshot and reports (and optionally corrects) any drift. The
+correction is applied as a delta too, so writes that land while it runs
+are not lost.
+"""
+import os
+import random
+import sys
+from collections import defaultdict
+from datetime import datetime
+
+from sqlalchemy import case, func, insert, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+
+import archive
+from models import Lender, LenderStat, Loan, LoanFunding, LoanStatus, PlatformStat
+
+STATS_STRIPES = int(os.getenv("STATS_STRIPES", "16"))
+LENDER_FIELDS = ("funded_loans", "funded_amount", "outstanding")
+# Differences below this are float noise, not drift
+DRIFT_TOLERANCE = 0.005
+
+
+def _status(status):
+    return LoanStatus(status).value
+
+
+class StatsDelta:
+    """Changes to apply to the aggregates, accumulated over one transaction."""
+
+    def __init__(self):
+        self.platform = defaultdict(float)
+        self.lenders = defaultdict(lambda: [0, 0.0, 0.0])
+
+    def __bool__(self):
+        return bool(self.platform or self.lenders)
+
+    def lender_created(self, available_funds):
+        self.platform["lenders"] += 1
+        self.platform["available_funds"] += available_funds or 0.0
+
+    def loan_created(self, status, amount):
+        self.platform[f"loans.{_status(status)}"] += 1
+        self.platform[f"amount.{_status(status)}"] += amount or 0.0
+
+    def loan_removed(self, status, amount):
+        self.platform[f"loans.{_status(status)}"] -= 1
+        self.platform[f"amount.{_status(status)}"] -= amount or 0.0
+
+    def loan_status_changed(self, old, new, amount):
+        self.loan_removed(old, amount)
+        self.loan_created(new, amount)
+
+    def loan_funded(self, lender_id, amount):
+        """``amount`` of ``lender_id``'s funds now fund a loan."""
+        totals = self.lenders[lender_id]
+        totals[0] += 1
+        totals[1] += amount
+        totals[2] += amount
+        self.platform["available_funds"] -= amount
+
+    def funding_repaid(self, lender_id, amount):
+        self.lenders[lender_id][2] -= amount
+
+
+def inserted_delta(table, rows):
+    """Delta for rows just inserted into ``loans`` or ``lenders``."""
+    delta = StatsDelta()
+    if table.name == Loan.__tablename__:
+        for row in rows:
+            delta.loan_created(row.get("status") or LoanStatus.pending, row.get("amount"))
+    elif table.name == Lender.__tablename__:
+        for row in rows:
+            delta.lender_created(row.get("available_funds"))
+    return delta
+
+
+def _upsert(dialect_name, table, keys, fields):
+    stmt = (sqlite_insert if dialect_name == "sqlite" else pg_insert)(table)
+    return stmt.on_conflict_do_update(index_elements=keys, set_={f: table.c[f] + stmt.excluded[f] for f in fields})
+
+
+def delta_statements(delta, dialect_name, stripe=None):
+    """(statement, parameters) pairs applying ``delta``. Rows are touched in
+    key order, so concurrent transactions lock them in the same order."""
+    statements = []
+    if delta.lenders:
+        statements.append((
+            _upsert(dialect_name, LenderStat.__table__, ["lender_id"], LENDER_FIELDS),
+            [dict(zip(("lender_id",) + LENDER_FIELDS, (lender_id, *delta.lenders[lender_id])))
+             for lender_id in sorted(delta.lenders)],
+        ))
+    if delta.platform:
+        stripe = random.randrange(STATS_STRIPES) if stripe is None else stripe
+        statements.append((
+            _upsert(dialect_name, PlatformStat.__table__, ["stripe", "metric"], ["value"]),
+            [{"stripe": stripe, "metric": metric, "value": delta.platform[metric]}
+             for metric in sorted(delta.platform)],
+        ))
+    return statements
+
+
+def apply_delta(db, delta):
+    for stmt, params in delta_statements(delta, db.get_bind().dialect.name):
+        db.execute(stmt, params)
+
+
+async def apply_delta_async(db, delta):
+    for stmt, params in delta_statements(delta, db.get_bind().dialect.name):
+        await db.execute(stmt, params)
+
+
+def record_inserts(db, table, rows):
+    apply_delta(db, inserted_delta(table, rows))
+
+
+async def record_inserts_async(db, table, rows):
+    await apply_delta_async(db, inserted_delta(table, rows))
+
+
+def platform_summary(totals):
+    by_status = {
+        status.value: {"count": int(totals.get(f"loans.{status.value}", 0)),
+                       "amount": totals.get(f"amount.{status.value}", 0.0)}
+        for status in LoanStatus
+    }
+    return {
+        "lenders": int(totals.get("lenders", 0)),
+        "available_funds": totals.get("available_funds", 0.0),
+        "loans": {
+            "total": sum(entry["count"] for entry in by_status.values()),
+            "amount": sum(entry["amount"] for entry in by_status.values()),
+            "by_status": by_status,
+        },
+    }
+
+
+async def read_platform_stats(db):
+    rows = await db.execute(select(PlatformStat.metric, func.sum(PlatformStat.value)).group_by(PlatformStat.metric))
+    return platform_summary(dict(rows.all()))
+
+
+async def read_lender_stats(db, lender_id):
+    row = (await db.execute(
+        select(LenderStat.funded_loans, LenderStat.funded_amount, LenderStat.outstanding)
+        .where(LenderStat.lender_id == lender_id)
+    )).first()
+    totals = tuple(row) if row is not None else (0, 0.0, 0.0)
+    return {"lender_id": lender_id, **dict(zip(LENDER_FIELDS, totals))}
+
+
+def compute_platform(db):
+    totals = {}
+    lenders, funds = db.execute(
+        select(func.count(), func.coalesce(func.sum(Lender.available_funds), 0.0)).select_from(Lender)
+    ).one()
+    totals["lenders"] = float(lenders)
+    totals["available_funds"] = float(funds)
+    for status, count, amount in db.execute(
+        select(Loan.status, func.count(), func.coalesce(func.sum(Loan.amount), 0.0)).group_by(Loan.status)
+    ):
+        if status is None:
+            continue
+        totals[f"loans.{_status(status)}"] = float(count)
+        totals[f"amount.{_status(status)}"] = float(amount)
+    # Archived loans still count; the manifest is read in the same snapshot
+    for metric, value in archive.archived_platform(db).items():
+        totals[metric] = totals.get(metric, 0.0) + value
+    return totals
+
+
+def compute_lenders(db):
+    outstanding = case((Loan.status == LoanStatus.approved, LoanFunding.amount), else_=0.0)
+    rows = db.execute(
+        select(LoanFunding.lender_id, func.count(), func.sum(LoanFunding.amount), func.sum(outstanding))
+        .join(Loan, Loan.loan_id == LoanFunding.loan_id)
+        .group_by(LoanFunding.lender_id)
+    )
+    totals = {lender_id: [count, float(amount), float(owed)] for lender_id, count, amount, owed in rows}
+    # Archived loans are closed: their fundings count, but nothing is outstanding
+    for lender_id, (count, amount) in archive.archived_fundings(db).items():
+        lender = totals.setdefault(lender_id, [0, 0.0, 0.0])
+        lender[0] += count
+        lender[1] += amount
+    return totals
+
+
+def stored_platform(db):
+    return dict(db.execute(select(PlatformStat.metric, func.sum(PlatformStat.value)).group_by(PlatformStat.metric)).all())
+
+
+def stored_lenders(db):
+    rows = db.execute(select(LenderStat.lender_id, *(LenderStat.__table__.c[f] for f in LENDER_FIELDS)))
+    return {lender_id: [count or 0, amount or 0.0, owed or 0.0] for lender_id, count, amount, owed in rows}
+
+
+def _drifted(expected, actual):
+    return abs((expected or 0.0) - (actual or 0.0)) > DRIFT_TOLERANCE
+
+
+def reconcile(session_factory, fix=False):
+    """Recompute the aggregates from the base tables and compare. With
+    ``fix``, the difference is applied as a delta."""
+    with session_factory() as db:
+        if db.get_bind().dialect.name == "postgresql":
+            # Base tables and aggregates must come from the same snapshot
+            db.connection(execution_options={"isolation_level": "REPEATABLE READ"})
+        expected_platform, actual_platform = compute_platform(db), stored_platform(db)
+        expected_lenders, actual_lenders = compute_lenders(db), stored_lenders(db)
+
+    correction = StatsDelta()
+    drift = {"platform": {}, "lenders": {}}
+    for metric in sorted(set(expected_platform) | set(actual_platform)):
+        expected, actual = expected_platform.get(metric, 0.0), actual_platform.get(metric, 0.0)
+        if _drifted(expected, actual):
+            drift["platform"][metric] = {"expected": expected, "stored": actual}
+            correction.platform[metric] = expected - actual
+    for lender_id in sorted(set(expected_lenders) | set(actual_lenders)):
+        expected = expected_lenders.get(lender_id, [0, 0.0, 0.0])
+        actual = actual_lenders.get(lender_id, [0, 0.0, 0.0])
+        if any(_drifted(e, a) for e, a in zip(expected, actual)):
+            drift["lenders"][lender_id] = {"expected": dict(zip(LENDER_FIELDS, expected)),
+                                           "stored": dict(zip(LENDER_FIELDS, actual))}
+            correction.lenders[lender_id] = [e - a for e, a in zip(expected, actual)]
+
+    if fix and correction:
+        with session_factory() as db:
+            apply_delta(db, correction)
+            db.commit()
+    return {
+        "checked_at": datetime.utcnow().isoformat(),
+        "lenders_checked": len(set(expected_lenders) | set(actual_lenders)),
+        "drifted": len(drift["platform"]) + len(drift["lenders"]),
+        "fixed": bool(fix and correction),
+        "drift": drift,
+    }
+
+
+def backfill(connection):
+    """Seed empty aggregate tables from the base tables (first start on an
+    existing database). Plain inserts, so a second worker racing to do the
+    same fails on the primary key instead of counting everything twice."""
+    if connection.execute(select(func.count()).select_from(PlatformStat)).scalar():
+        return False
+    platform = compute_platform(connection)
+    if not any(platform.values()):
+        return False
+    lenders = compute_lenders(connection)
+    try:
+        with connection.begin_nested():
+            connection.execute(insert(PlatformStat.__table__), [
+                {"stripe": 0, "metric": metric, "value": value} for metric, value in sorted(platform.items())
+            ])
+            if lenders:
+                connection.execute(insert(LenderStat.__table__), [
+                    dict(zip(("lender_id",) + LENDER_FIELDS, (lender_id, *lenders[lender_id])))
+                    for lender_id in sorted(lenders)
+                ])
+    except IntegrityError:
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    import json
+
+    from database import SessionLocal
+
+    report = reconcile(SessionLocal, fix="--fix" in sys.argv)
+    print(json.dumps(report, indent=2))
+    if report["drifted"] and "--fix" not in sys.argv:
+        sys.exit(1)
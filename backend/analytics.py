@@ -0,0 +1,290 @@
+"""Vectorized loan book analytics.
+
+The active book (approved loans, one row per lender funding) is pulled into
+NumPy column arrays and every metric is computed with array operations:
+level-payment amortization, outstanding principal as of a date, expected
+interest, and lender/borrower concentration via ``bincount`` group-bys.
+"""
+import os
+import threading
+import time
+from datetime import date
+
+import numpy as np
+from sqlalchemy import Date, Integer, cast, func, literal, select
+
+from models import Loan, LoanFunding, LoanStatus
+
+ANALYTICS_SNAPSHOT_TTL = float(os.getenv("ANALYTICS_SNAPSHOT_TTL", "60"))
+LOAD_CHUNK_SIZE = 50_000
+DAYS_PER_MONTH = 365.25 / 12
+EPOCH = date(1970, 1, 1)
+
+
+class Book:
+    """Column arrays for a set of fundings. ``principal`` is the lender's
+    share of the loan; rates are annual percentages; dates are epoch days."""
+
+    __slots__ = ("lender_id", "loan_id", "borrower_id", "principal", "rate", "term", "start_day")
+
+    def __init__(self, lender_id, loan_id, borrower_id, principal, rate, term, start_day):
+        self.lender_id = np.asarray(lender_id, dtype=np.int64)
+        self.loan_id = np.asarray(loan_id, dtype=np.int64)
+        self.borrower_id = np.asarray(borrower_id, dtype=np.int64)
+        self.principal = np.asarray(principal, dtype=np.float64)
+        self.rate = np.asarray(rate, dtype=np.float64)
+        self.term = np.asarray(term, dtype=np.int64)
+        self.start_day = np.asarray(start_day, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.principal)
+
+    def select(self, mask):
+        return Book(*(getattr(self, name)[mask] for name in self.__slots__))
+
+    @classmethod
+    def concat(cls, books):
+        books = list(books)
+        if not books:
+            return cls(*([] for _ in cls.__slots__))
+        return cls(*(np.concatenate([getattr(b, name) for b in books]) for name in cls.__slots__))
+
+
+def _epoch_days(column, dialect_name):
+    # Integer days since 1970-01-01, computed by the database
+    if dialect_name == "sqlite":
+        return cast(func.julianday(column) - 2440587.5, Integer)
+    return column - cast(literal(EPOCH.isoformat()), Date)
+
+
+def load_book(db, lender_id=None):
+    """Load approved fundings (optionally for one lender) in chunks from a
+    server-side cursor straight into column arrays."""
+    start_day = _epoch_days(func.coalesce(Loan.approval_date, Loan.creation_date), db.get_bind().dialect.name)
+    stmt = (
+        select(LoanFunding.lender_id, Loan.loan_id, Loan.borrower_id, LoanFunding.amount,
+               Loan.interest_rate, Loan.term_months, start_day)
+        .join(Loan, Loan.loan_id == LoanFunding.loan_id)
+        .where(Loan.status == LoanStatus.approved)
+        .execution_options(yield_per=LOAD_CHUNK_SIZE)
+    )
+    if lender_id is not None:
+        stmt = stmt.where(LoanFunding.lender_id == lender_id)
+
+    chunks = []
+    for partition in db.execute(stmt).partitions():
+        columns = list(zip(*partition))
+        chunks.append(Book(*columns))
+    return Book.concat(chunks)
+
+
+def payment_terms(book):
+    """Monthly rate and level monthly payment per funding."""
+    r = book.rate / 1200.0
+    n = book.term.astype(np.float64)
+    growth = np.power(1.0 + r, n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        payment = np.where(r > 0, book.principal * r * growth / (growth - 1.0), book.principal / n)
+    return r, payment
+
+
+def balance_after(principal, r, payment, k):
+    """Outstanding principal after ``k`` payments (closed form, vectorized)."""
+    growth = np.power(1.0 + r, k)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        amortized = np.where(r > 0, payment * (growth - 1.0) / r, payment * k)
+    return np.maximum(principal * growth - amortized, 0.0)
+
+
+def payments_made(book, as_of_day):
+    elapsed = np.floor((as_of_day - book.start_day) / DAYS_PER_MONTH)
+    return np.clip(elapsed, 0, book.term).astype(np.float64)
+
+
+def compute_book(book, as_of):
+    """Per-funding amortization metrics as of ``as_of``."""
+    as_of_day = (as_of - EPOCH).days
+    r, payment = payment_terms(book)
+    k = payments_made(book, as_of_day)
+    outstanding = balance_after(book.principal, r, payment, k)
+    total_interest = payment * book.term - book.principal
+    interest_earned = payment * k - (book.principal - outstanding)
+    return {
+        "payment": payment,
+        "outstanding": outstanding,
+        "total_interest": total_interest,
+        "interest_earned": interest_earned,
+        "interest_remaining": total_interest - interest_earned,
+    }
+
+
+def amortization_schedule(principal, rate, term):
+    """Full level-payment schedules for many loans at once. Returns
+    ``(payment, interest, principal_paid, balance)`` arrays shaped
+    ``(loans, max_term)``; months past a loan's term are zero."""
+    principal = np.asarray(principal, dtype=np.float64)
+    rate = np.asarray(rate, dtype=np.float64)
+    term = np.asarray(term, dtype=np.int64)
+    book = Book(np.zeros_like(term), np.zeros_like(term), np.zeros_like(term), principal, rate, term,
+                np.zeros_like(term))
+    r, payment = payment_terms(book)
+    months = np.arange(1, int(term.max(initial=0)) + 1, dtype=np.float64)
+    active = months[None, :] <= term[:, None]
+    opening = balance_after(principal[:, None], r[:, None], payment[:, None], months[None, :] - 1)
+    interest = np.where(active, opening * r[:, None], 0.0)
+    principal_paid = np.where(active, np.minimum(payment[:, None] - interest, opening), 0.0)
+    balance = np.where(active, opening - principal_paid, 0.0)
+    return np.where(active, payment[:, None], 0.0), interest, principal_paid, balance
+
+
+def cash_flow_projection(book, as_of, horizon=12):
+    """Expected principal and interest receipts for each of the next
+    ``horizon`` months, summed over the book."""
+    r, payment = payment_terms(book)
+    k = payments_made(book, (as_of - EPOCH).days)
+    months = np.arange(horizon, dtype=np.float64)
+    paid_before = k[:, None] + months[None, :]
+    active = paid_before < book.term[:, None]
+    opening = balance_after(book.principal[:, None], r[:, None], payment[:, None], paid_before)
+    interest = np.where(active, opening * r[:, None], 0.0)
+    principal = np.where(active, np.minimum(payment[:, None] - interest, opening), 0.0)
+    return [
+        {"month": int(m) + 1, "principal": float(p), "interest": float(i)}
+        for m, p, i in zip(months, principal.sum(axis=0), interest.sum(axis=0))
+    ]
+
+
+def factorize(values):
+    """Sorted distinct values and each element's index into them.
+
+    Sort-based, like ``np.unique(..., return_inverse=True)`` but without its
+    overhead on large integer arrays."""
+    order = np.argsort(values)
+    ordered = values[order]
+    starts = np.empty(len(ordered), dtype=bool)
+    starts[:1] = True
+    np.not_equal(ordered[1:], ordered[:-1], out=starts[1:])
+    index = np.empty(len(values), dtype=np.int64)
+    index[order] = np.cumsum(starts) - 1
+    return ordered[starts], index
+
+
+def distinct_count(values):
+    if not len(values):
+        return 0
+    ordered = np.sort(values)
+    return int(np.count_nonzero(ordered[1:] != ordered[:-1])) + 1
+
+
+def herfindahl(group_index, weights, groups):
+    """Herfindahl index of ``weights`` within each group (0..1)."""
+    totals = np.bincount(group_index, weights=weights, minlength=groups)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        shares = np.where(totals[group_index] > 0, weights / totals[group_index], 0.0)
+    return np.bincount(group_index, weights=shares * shares, minlength=groups)
+
+
+def borrower_concentration(book, outstanding, lender_groups=None):
+    """Per-lender borrower concentration: (lender ids, HHI, top borrower share).
+    ``lender_groups`` is ``factorize(book.lender_id)`` if already computed."""
+    lenders, lender_index = lender_groups or factorize(book.lender_id)
+    # Encode (lender, borrower) as one int64 key so the group-by is a 1-D unique
+    stride = int(book.borrower_id.max(initial=0)) + 1
+    pairs, pair_index = factorize(lender_index * stride + book.borrower_id)
+    pair_exposure = np.bincount(pair_index, weights=outstanding)
+    pair_lender = pairs // stride
+    hhi = herfindahl(pair_lender, pair_exposure, len(lenders))
+    top = np.zeros(len(lenders))
+    np.maximum.at(top, pair_lender, pair_exposure)
+    lender_total = np.bincount(pair_lender, weights=pair_exposure, minlength=len(lenders))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        top_share = np.where(lender_total > 0, top / lender_total, 0.0)
+    return lenders, hhi, top_share
+
+
+def portfolio_summary(book, as_of, top=10):
+    metrics = compute_book(book, as_of)
+    outstanding = metrics["outstanding"]
+    total_outstanding = float(outstanding.sum())
+    summary = {
+        "as_of": as_of.isoformat(),
+        "fundings": len(book),
+        "loans": distinct_count(book.loan_id),
+        "principal_funded": float(book.principal.sum()),
+        "outstanding_principal": total_outstanding,
+        "expected_interest_total": float(metrics["total_interest"].sum()),
+        "interest_earned": float(metrics["interest_earned"].sum()),
+        "interest_remaining": float(metrics["interest_remaining"].sum()),
+        "weighted_avg_rate": float(np.average(book.rate, weights=outstanding)) if total_outstanding else 0.0,
+        "lender_hhi": 0.0,
+        "top_lenders": [],
+    }
+    if not len(book):
+        return summary
+
+    lenders, lender_index = lender_groups = factorize(book.lender_id)
+    exposure = np.bincount(lender_index, weights=outstanding, minlength=len(lenders))
+    interest_remaining = np.bincount(lender_index, weights=metrics["interest_remaining"], minlength=len(lenders))
+    _, borrower_hhi, top_borrower_share = borrower_concentration(book, outstanding, lender_groups)
+    if total_outstanding:
+        shares = exposure / total_outstanding
+        summary["lender_hhi"] = float(np.sum(shares * shares))
+    order = np.argsort(-exposure)[:top]
+    summary["top_lenders"] = [
+        {
+            "lender_id": int(lenders[i]),
+            "outstanding_principal": float(exposure[i]),
+            "share_of_book": float(exposure[i] / total_outstanding) if total_outstanding else 0.0,
+            "expected_interest_remaining": float(interest_remaining[i]),
+            "borrower_hhi": float(borrower_hhi[i]),
+            "top_borrower_share": float(top_borrower_share[i]),
+        }
+        for i in order
+    ]
+    return summary
+
+
+def lender_summary(book, lender_id, as_of, platform_outstanding, horizon=12):
+    metrics = compute_book(book, as_of)
+    outstanding = metrics["outstanding"]
+    total_outstanding = float(outstanding.sum())
+    summary = {
+        "lender_id": lender_id,
+        "as_of": as_of.isoformat(),
+        "loans": distinct_count(book.loan_id),
+        "principal_funded": float(book.principal.sum()),
+        "outstanding_principal": total_outstanding,
+        "expected_interest_total": float(metrics["total_interest"].sum()),
+        "interest_earned": float(metrics["interest_earned"].sum()),
+        "interest_remaining": float(metrics["interest_remaining"].sum()),
+        "monthly_payment_total": float(metrics["payment"].sum()),
+        "weighted_avg_rate": float(np.average(book.rate, weights=outstanding)) if total_outstanding else 0.0,
+        "share_of_platform": total_outstanding / platform_outstanding if platform_outstanding else 0.0,
+        "borrower_hhi": 0.0,
+        "top_borrower_share": 0.0,
+        "cash_flow_projection": cash_flow_projection(book, as_of, horizon) if len(book) else [],
+    }
+    if len(book):
+        _, hhi, top_share = borrower_concentration(book, outstanding)
+        summary["borrower_hhi"] = float(hhi[0])
+        summary["top_borrower_share"] = float(top_share[0])
+    return summary
+
+
+class BookSnapshot:
+    """The whole active book, reloaded at most every ``ttl`` seconds."""
+
+    def __init__(self, session_factory, ttl=ANALYTICS_SNAPSHOT_TTL):
+        self.session_factory = session_factory
+        self.ttl = ttl
+        self._book = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self):
+        with self._lock:
+            if self._book is None or time.monotonic() - self._loaded_at > self.ttl:
+                with self.session_factory() as db:
+                    self._book = load_book(db)
+                self._loaded_at = time.monotonic()
+            return self._book
@@ -0,0 +1,186 @@
+"""Loan approval with fund reservation.
+
+Approvals for the same lender are collected for up to
+``APPROVAL_BATCH_WINDOW_MS`` (or ``APPROVAL_BATCH_SIZE`` requests) and then
+settled in one transaction: the lender row is locked once, loans are
+approved in arrival order while funds last, and the lender is debited with
+a single ``UPDATE ... WHERE available_funds >= :total``. The guarded update
+is what keeps concurrent workers (and databases without row locks, such as
+SQLite) from overdrawing a lender; if it matches no row the whole batch is
+retried against fresh balances. Within one process a lender's batches are
+settled one after another, and the next batch stays open while the previous
+one commits.
+"""
+import asyncio
+import os
+from datetime import date
+
+from sqlalchemy import insert, select, update
+
+from aggregates import StatsDelta, apply_delta_async
+from models import Lender, Loan, LoanFunding, LoanStatus
+
+APPROVAL_BATCH_WINDOW_MS = float(os.getenv("APPROVAL_BATCH_WINDOW_MS", "2"))
+APPROVAL_BATCH_SIZE = int(os.getenv("APPROVAL_BATCH_SIZE", "200"))
+APPROVAL_MAX_RETRIES = 5
+
+
+class ApprovalError(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class _LenderBatch:
+    def __init__(self):
+        self.items = []
+        self.full = asyncio.Event()
+
+
+class ApprovalBatcher:
+    def __init__(self, session_factory, window_ms=APPROVAL_BATCH_WINDOW_MS, max_batch=APPROVAL_BATCH_SIZE):
+        self.session_factory = session_factory
+        self.window = window_ms / 1000
+        self.max_batch = max_batch
+        self._open = {}
+        self._tails = {}
+        self.batches = 0
+        self.approved = 0
+        self.rejected = 0
+        self.retries = 0
+
+    async def approve(self, lender_id, loan_id):
+        """Approve ``loan_id`` against ``lender_id``'s funds; raises
+        ApprovalError when the loan or the funds do not allow it."""
+        future = asyncio.get_running_loop().create_future()
+        batch = self._open.get(lender_id)
+        if batch is None or len(batch.items) >= self.max_batch:
+            batch = self._open[lender_id] = _LenderBatch()
+            previous = self._tails.get(lender_id)
+            self._tails[lender_id] = asyncio.ensure_future(self._run(lender_id, batch, previous))
+        batch.items.append((loan_id, future))
+        if len(batch.items) >= self.max_batch:
+            batch.full.set()
+        return await asyncio.shield(future)
+
+    async def _run(self, lender_id, batch, previous):
+        if previous is not None:
+            await asyncio.wait([previous])
+        if self.window > 0 and not batch.full.is_set():
+            try:
+                await asyncio.wait_for(batch.full.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+        # Close the batch; later arrivals start a new one
+        if self._open.get(lender_id) is batch:
+            del self._open[lender_id]
+
+        try:
+            outcomes = await self._settle(lender_id, list(dict.fromkeys(loan_id for loan_id, _ in batch.items)))
+        except Exception as e:
+            for _, future in batch.items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            if self._tails.get(lender_id) is asyncio.current_task():
+                del self._tails[lender_id]
+
+        self.batches += 1
+        seen = set()
+        for loan_id, future in batch.items:
+            outcome = outcomes[loan_id]
+            if loan_id in seen:
+                outcome = ApprovalError(409, "Duplicate approval request")
+            seen.add(loan_id)
+            if isinstance(outcome, ApprovalError):
+                self.rejected += 1
+                future.set_exception(outcome)
+            else:
+                self.approved += 1
+                future.set_result(outcome)
+
+    async def _settle(self, lender_id, loan_ids):
+        for _ in range(APPROVAL_MAX_RETRIES):
+            async with self.session_factory() as db:
+                outcomes, total = await self._plan(db, lender_id, loan_ids)
+                approved = [loan_id for loan_id, outcome in outcomes.items() if not isinstance(outcome, ApprovalError)]
+                if not approved:
+                    return outcomes
+
+                debit = await db.execute(
+                    update(Lender)
+                    .where(Lender.lender_id == lender_id)
+                    .where(Lender.available_funds >= total)
+                    .values(available_funds=Lender.available_funds - total)
+                )
+                if debit.rowcount != 1:
+                    await db.rollback()
+                    self.retries += 1
+                    continue
+
+                today = date.today()
+                claimed = await db.execute(
+                    update(Loan)
+                    .where(Loan.loan_id.in_(approved))
+                    .where(Loan.status == LoanStatus.pending)
+                    .values(status=LoanStatus.approved, approval_date=today)
+                )
+                if claimed.rowcount != len(approved):
+                    await db.rollback()
+                    self.retries += 1
+                    continue
+
+                await db.execute(insert(LoanFunding), [
+                    {"loan_id": loan_id, "lender_id": lender_id, "amount": outcomes[loan_id]["amount"],
+                     "funded_date": today}
+                    for loan_id in approved
+                ])
+                delta = StatsDelta()
+                for loan_id in approved:
+                    amount = outcomes[loan_id]["amount"]
+                    delta.loan_status_changed(LoanStatus.pending, LoanStatus.approved, amount)
+                    delta.loan_funded(lender_id, amount)
+                await apply_delta_async(db, delta)
+                await db.commit()
+                return outcomes
+        raise ApprovalError(503, "Approval contention too high, retry later")
+
+    async def _plan(self, db, lender_id, loan_ids):
+        funds = await db.scalar(
+            select(Lender.available_funds).where(Lender.lender_id == lender_id).with_for_update()
+        )
+        rows = {
+            row.loan_id: row
+            for row in await db.execute(
+                select(Loan.loan_id, Loan.lender_id, Loan.amount, Loan.status)
+                .where(Loan.loan_id.in_(loan_ids))
+                .with_for_update()
+            )
+        }
+        outcomes = {}
+        total = 0.0
+        for loan_id in loan_ids:
+            row = rows.get(loan_id)
+            if row is None:
+                outcomes[loan_id] = ApprovalError(404, "Loan not found")
+            elif row.lender_id != lender_id:
+                outcomes[loan_id] = ApprovalError(409, "Loan lender changed")
+            elif row.status != LoanStatus.pending:
+                outcomes[loan_id] = ApprovalError(409, f"Loan is already {row.status.value}")
+            elif funds is None or funds - total < row.amount:
+                outcomes[loan_id] = ApprovalError(409, "Lender has insufficient funds")
+            else:
+                total += row.amount
+                outcomes[loan_id] = {"loan_id": loan_id, "lender_id": lender_id, "amount": row.amount}
+        return outcomes, total
+
+    def stats(self):
+        return {
+            "batches": self.batches,
+            "approved": self.approved,
+            "rejected": self.rejected,
+            "retries": self.retries,
+            "open_batches": len(self._open),
+        }
@@ -0,0 +1,512 @@
+"""Columnar archive of settled loans.
+
+Paid and rejected loans created before a cutoff are moved out of ``loans``
+(with their ``loan_fundings``) into immutable column files. Search,
+single-loan lookups, lender analytics and reconcile read them from there.
+
+Layout under ``ARCHIVE_DIR``::
+
+    loans/2023-04/part-00000012/loan_id.npy, amount.npy, ..., purposes.json,
+                                funding.loan_id.npy, ...
+
+Each batch writes one part per creation month. Every column is a plain
+``.npy`` file in a compact dtype: int32 ids, int16 terms, uint8 status
+codes, int32 epoch days, and ``purpose`` dictionary-encoded into uint16
+codes. Readers ``np.load`` the columns with ``mmap_mode="r"``, so a query
+only pages in what it touches. General-purpose compression would rule out
+memory mapping. The encodings bring a loan down to 41 bytes.
+
+The ``archive_parts`` table is the manifest. A batch first writes its parts
+into temporary directories. One transaction then deletes the loans and
+inserts the part rows. Only after that are the directories renamed into
+place. A crash therefore leaves one of two things: an unreferenced
+temporary directory, which the next run removes, or a committed one not yet
+renamed, which the next run finishes and readers can already read. Reconcile
+reads the manifest in the same snapshot as the base tables, so every loan
+is counted exactly once.
+
+Ledger entries and balances of archived loans stay where they are.
+"""
+import fcntl
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+
+import numpy as np
+from sqlalchemy import delete, select
+
+from models import ArchivePart, Loan, LoanFunding, LoanStatus
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", "archive")
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "10000"))
+# How long a reader trusts its copy of the manifest
+ARCHIVE_MANIFEST_TTL = float(os.getenv("ARCHIVE_MANIFEST_TTL", "30"))
+BATCH_ATTEMPTS = 3
+
+CLOSED_STATUSES = (LoanStatus.paid, LoanStatus.rejected)
+STATUSES = list(LoanStatus)
+STATUS_CODES = {status: code for code, status in enumerate(STATUSES)}
+EPOCH = date(1970, 1, 1)
+NULL_ID = -1
+NULL_DAY = int(np.iinfo(np.int32).min)
+
+LOAN_FIELDS = (Loan.loan_id, Loan.borrower_id, Loan.lender_id, Loan.amount, Loan.interest_rate, Loan.term_months,
+               Loan.purpose, Loan.status, Loan.creation_date, Loan.approval_date)
+FUNDING_FIELDS = (LoanFunding.funding_id, LoanFunding.loan_id, LoanFunding.lender_id, LoanFunding.amount,
+                  LoanFunding.funded_date)
+LOAN_DTYPES = {
+    "loan_id": np.int32, "borrower_id": np.int32, "lender_id": np.int32, "amount": np.float64,
+    "interest_rate": np.float64, "term_months": np.int16, "status": np.uint8, "creation_day": np.int32,
+    "approval_day": np.int32,
+}
+FUNDING_DTYPES = {
+    "funding_id": np.int32, "loan_id": np.int32, "lender_id": np.int32, "amount": np.float64,
+    "funded_day": np.int32,
+}
+# Search sort keys (see search.py) -> archive column
+SORT_COLUMNS = {"created": "creation_day", "amount": "amount", "interest_rate": "interest_rate",
+                "loan_id": "loan_id"}
+
+
+class ArchiveBusy(Exception):
+    pass
+
+
+class ArchiveConflict(Exception):
+    """A loan in the batch changed between reading and deleting it."""
+
+
+def _day(value):
+    return NULL_DAY if value is None else (value - EPOCH).days
+
+
+def _date(day):
+    return None if day == NULL_DAY else EPOCH + timedelta(days=int(day))
+
+
+def _id(value):
+    return NULL_ID if value is None else value
+
+
+def part_path(root, partition, part_id):
+    return os.path.join(root, "loans", partition, f"part-{part_id:08d}")
+
+
+def _temp_path(root, partition, part_id):
+    return os.path.join(root, "loans", partition, f".part-{part_id:08d}.tmp")
+
+
+def encode_loans(rows):
+    """Column arrays for loan rows (LOAN_FIELDS order), plus the purpose
+    dictionary the ``purpose`` codes index into."""
+    purposes = {}
+    codes = [purposes.setdefault(row.purpose, len(purposes)) for row in rows]
+    columns = {
+        "loan_id": [row.loan_id for row in rows],
+        "borrower_id": [_id(row.borrower_id) for row in rows],
+        "lender_id": [_id(row.lender_id) for row in rows],
+        "amount": [np.nan if row.amount is None else row.amount for row in rows],
+        "interest_rate": [np.nan if row.interest_rate is None else row.interest_rate for row in rows],
+        "term_months": [_id(row.term_months) for row in rows],
+        "status": [STATUS_CODES[LoanStatus(row.status)] for row in rows],
+        "creation_day": [_day(row.creation_date) for row in rows],
+        "approval_day": [_day(row.approval_date) for row in rows],
+    }
+    arrays = {name: np.array(values, dtype=LOAN_DTYPES[name]) for name, values in columns.items()}
+    arrays["purpose"] = np.array(codes, dtype=np.uint16 if len(purposes) <= 1 << 16 else np.uint32)
+    return arrays, list(purposes)
+
+
+def encode_fundings(rows):
+    columns = {
+        "funding_id": [row.funding_id for row in rows],
+        "loan_id": [row.loan_id for row in rows],
+        "lender_id": [_id(row.lender_id) for row in rows],
+        "amount": [0.0 if row.amount is None else row.amount for row in rows],
+        "funded_day": [_day(row.funded_date) for row in rows],
+    }
+    return {name: np.array(values, dtype=FUNDING_DTYPES[name]) for name, values in columns.items()}
+
+
+def write_part(path, loans, fundings):
+    """Write one part directory; returns its size in bytes."""
+    os.makedirs(path)
+    arrays, purposes = encode_loans(loans)
+    files = dict(arrays)
+    files.update({f"funding.{name}": array for name, array in encode_fundings(fundings).items()})
+    size = 0
+    for name, array in files.items():
+        np.save(os.path.join(path, f"{name}.npy"), array)
+        size += os.path.getsize(os.path.join(path, f"{name}.npy"))
+    with open(os.path.join(path, "purposes.json"), "w") as f:
+        json.dump(purposes, f)
+    return size + os.path.getsize(os.path.join(path, "purposes.json"))
+
+
+class Part:
+    """Column files of one archived part, memory-mapped on first use."""
+
+    def __init__(self, root, row):
+        self.part_id = row.part_id
+        self.partition = row.partition
+        self.loans = row.loans
+        self.fundings = row.fundings
+        self.min_loan_id = row.min_loan_id
+        self.max_loan_id = row.max_loan_id
+        path = part_path(root, row.partition, row.part_id)
+        # Committed but not renamed yet (the archiving run is just finishing or died)
+        self.path = path if os.path.isdir(path) else _temp_path(root, row.partition, row.part_id)
+        year, month = map(int, row.partition.split("-"))
+        self.first_day = _day(date(year, month, 1))
+        self.last_day = _day(date(year + month // 12, month % 12 + 1, 1)) - 1
+        self._columns = {}
+        self._purposes = None
+
+    def column(self, name):
+        array = self._columns.get(name)
+        if array is None:
+            rows = self.fundings if name.startswith("funding.") else self.loans
+            # An empty file can't be mapped
+            array = np.load(os.path.join(self.path, f"{name}.npy"), mmap_mode="r" if rows else None)
+            self._columns[name] = array
+        return array
+
+    def purposes(self):
+        if self._purposes is None:
+            with open(os.path.join(self.path, "purposes.json")) as f:
+                self._purposes = json.load(f)
+        return self._purposes
+
+    def loan(self, i):
+        def nullable(name, null=NULL_ID):
+            value = int(self.column(name)[i])
+            return None if value == null else value
+
+        amount, rate = float(self.column("amount")[i]), float(self.column("interest_rate")[i])
+        return {
+            "loan_id": int(self.column("loan_id")[i]),
+            "borrower_id": nullable("borrower_id"),
+            "lender_id": nullable("lender_id"),
+            "amount": None if np.isnan(amount) else amount,
+            "interest_rate": None if np.isnan(rate) else rate,
+            "term_months": nullable("term_months"),
+            "purpose": self.purposes()[int(self.column("purpose")[i])],
+            "status": STATUSES[int(self.column("status")[i])],
+            "creation_date": _date(self.column("creation_day")[i]),
+            "approval_date": _date(self.column("approval_day")[i]),
+        }
+
+
+def committed_parts(db, root=ARCHIVE_DIR):
+    rows = db.execute(
+        select(ArchivePart.part_id, ArchivePart.partition, ArchivePart.loans, ArchivePart.fundings,
+               ArchivePart.min_loan_id, ArchivePart.max_loan_id)
+        .order_by(ArchivePart.partition, ArchivePart.part_id)
+    )
+    return [Part(root, row) for row in rows]
+
+
+def archived_platform(db, root=ARCHIVE_DIR):
+    """Loan counts and amounts by status in the archive, keyed like the
+    platform aggregates (see aggregates.py)."""
+    counts = np.zeros(len(STATUSES))
+    amounts = np.zeros(len(STATUSES))
+    for part in committed_parts(db, root):
+        status = part.column("status")
+        counts += np.bincount(status, minlength=len(STATUSES))
+        amounts += np.bincount(status, weights=np.nan_to_num(part.column("amount")), minlength=len(STATUSES))
+    totals = {}
+    for status, count, amount in zip(STATUSES, counts, amounts):
+        if count:
+            totals[f"loans.{status.value}"] = float(count)
+            totals[f"amount.{status.value}"] = float(amount)
+    return totals
+
+
+def archived_fundings(db, root=ARCHIVE_DIR):
+    """Per-lender ``[fundings, amount]`` in the archive."""
+    totals = defaultdict(lambda: [0, 0.0])
+    for part in committed_parts(db, root):
+        if not part.fundings:
+            continue
+        lenders, index = np.unique(part.column("funding.lender_id"), return_inverse=True)
+        counts = np.bincount(index)
+        amounts = np.bincount(index, weights=part.column("funding.amount"))
+        for lender_id, count, amount in zip(lenders.tolist(), counts.tolist(), amounts.tolist()):
+            if lender_id != NULL_ID:
+                totals[lender_id][0] += count
+                totals[lender_id][1] += amount
+    return totals
+
+
+class ArchiveResult:
+    def __init__(self, before):
+        self.before = before
+        self.loans = 0
+        self.fundings = 0
+        self.parts = 0
+        self.size_bytes = 0
+        self.recovered = 0
+
+    def as_dict(self):
+        return {
+            "before": self.before.isoformat(),
+            "loans_archived": self.loans,
+            "fundings_archived": self.fundings,
+            "parts_written": self.parts,
+            "bytes_written": self.size_bytes,
+            "parts_recovered": self.recovered,
+        }
+
+
+@contextmanager
+def archive_lock(root):
+    # One archiving run per archive directory; readers never take it
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, ".lock"), "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            raise ArchiveBusy()
+        yield
+
+
+def recover(session_factory, root):
+    """Rename committed temporary directories into place and remove the
+    ones whose transaction never committed. Call with the lock held."""
+    loans_dir = os.path.join(root, "loans")
+    if not os.path.isdir(loans_dir):
+        return 0
+    with session_factory() as db:
+        committed = set(db.scalars(select(ArchivePart.part_id)))
+    recovered = 0
+    for partition in os.listdir(loans_dir):
+        for name in os.listdir(os.path.join(loans_dir, partition)):
+            if not (name.startswith(".part-") and name.endswith(".tmp")):
+                continue
+            part_id = int(name[len(".part-"):-len(".tmp")])
+            temp = os.path.join(loans_dir, partition, name)
+            if part_id in committed:
+                os.replace(temp, part_path(root, partition, part_id))
+                recovered += 1
+            else:
+                shutil.rmtree(temp)
+    return recovered
+
+
+def archive_batch(db, root, before, after_id, batch_size, result):
+    """Move the next batch of closed loans after ``after_id`` into the
+    archive. Returns the last loan id moved, or None when there are none."""
+    loans = db.execute(
+        select(*LOAN_FIELDS)
+        .where(Loan.status.in_(CLOSED_STATUSES))
+        .where(Loan.creation_date < before)
+        .where(Loan.loan_id > after_id)
+        .order_by(Loan.loan_id)
+        .limit(batch_size)
+        .with_for_update()
+    ).all()
+    if not loans:
+        return None
+    loan_ids = [row.loan_id for row in loans]
+    fundings = defaultdict(list)
+    for row in db.execute(select(*FUNDING_FIELDS).where(LoanFunding.loan_id.in_(loan_ids))
+                          .order_by(LoanFunding.funding_id)):
+        fundings[row.loan_id].append(row)
+    months = defaultdict(list)
+    for row in loans:
+        months[row.creation_date.strftime("%Y-%m")].append(row)
+
+    written = []
+    try:
+        for partition, rows in sorted(months.items()):
+            part_fundings = [funding for row in rows for funding in fundings.get(row.loan_id, ())]
+            part = ArchivePart(partition=partition, loans=len(rows), fundings=len(part_fundings),
+                               min_loan_id=rows[0].loan_id, max_loan_id=rows[-1].loan_id)
+            db.add(part)
+            db.flush()
+            temp = _temp_path(root, partition, part.part_id)
+            written.append((temp, part_path(root, partition, part.part_id)))
+            part.size_bytes = write_part(temp, rows, part_fundings)
+            result.size_bytes += part.size_bytes
+        if fundings:
+            db.execute(delete(LoanFunding).where(LoanFunding.loan_id.in_(loan_ids)))
+        deleted = db.execute(
+            delete(Loan).where(Loan.loan_id.in_(loan_ids)).where(Loan.status.in_(CLOSED_STATUSES))
+        ).rowcount
+        if deleted != len(loan_ids):
+            # Without row locks (SQLite) another writer may have got there first
+            raise ArchiveConflict()
+        db.commit()
+    except BaseException:
+        db.rollback()
+        for temp, _ in written:
+            shutil.rmtree(temp, ignore_errors=True)
+        raise
+    for temp, final in written:
+        os.replace(temp, final)
+    result.loans += len(loans)
+    result.fundings += sum(len(rows) for rows in fundings.values())
+    result.parts += len(written)
+    return loan_ids[-1]
+
+
+def run_archive(session_factory, before=None, batch_size=ARCHIVE_BATCH_SIZE, root=ARCHIVE_DIR):
+    """Archive every paid or rejected loan created before ``before``
+    (default: ``ARCHIVE_AFTER_DAYS`` ago), one transaction per batch."""
+    before = before or date.today() - timedelta(days=ARCHIVE_AFTER_DAYS)
+    result = ArchiveResult(before)
+    with archive_lock(root):
+        result.recovered = recover(session_factory, root)
+        after_id, attempts = 0, 0
+        while True:
+            try:
+                with session_factory() as db:
+                    last_id = archive_batch(db, root, before, after_id, batch_size, result)
+            except ArchiveConflict:
+                attempts += 1
+                if attempts == BATCH_ATTEMPTS:
+                    raise
+                continue
+            if last_id is None:
+                return result
+            after_id, attempts = last_id, 0
+
+
+class ArchiveReader:
+    """Read side of the archive. The manifest is reloaded at most every
+    ``ttl`` seconds (or after ``invalidate``); parts already open keep
+    their mappings."""
+
+    def __init__(self, session_factory, root=ARCHIVE_DIR, ttl=ARCHIVE_MANIFEST_TTL):
+        self.session_factory = session_factory
+        self.root = root
+        self.ttl = ttl
+        self._parts = []
+        self._loaded_at = None
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        self._loaded_at = None
+
+    def parts(self):
+        with self._lock:
+            if self._loaded_at is None or time.monotonic() - self._loaded_at > self.ttl:
+                with self.session_factory() as db:
+                    parts = committed_parts(db, self.root)
+                opened = {part.part_id: part for part in self._parts}
+                self._parts = [opened.get(part.part_id, part) for part in parts]
+                self._loaded_at = time.monotonic()
+            return self._parts
+
+    def find_loan(self, loan_id):
+        for part in self.parts():
+            if part.min_loan_id <= loan_id <= part.max_loan_id:
+                # Parts are written in loan_id order
+                ids = part.column("loan_id")
+                i = int(np.searchsorted(ids, loan_id))
+                if i < len(ids) and ids[i] == loan_id:
+                    return part.loan(i)
+        return None
+
+    def search(self, filters, sort, descending=False, after=None, limit=100):
+        """Up to ``limit + 1`` archived loans matching the search filters
+        (see search.py), ordered by ``(sort, loan_id)`` and starting after
+        the ``(sort value, loan_id)`` pair ``after``."""
+        status = filters.get("status")
+        if status is not None and LoanStatus(status) not in CLOSED_STATUSES:
+            return []
+        first = _day(filters["created_from"]) if filters.get("created_from") else NULL_DAY
+        last = _day(filters["created_to"]) if filters.get("created_to") else sys.maxsize
+        parts = [part for part in self.parts() if part.last_day >= first and part.first_day <= last]
+        if descending:
+            parts.reverse()
+        column = SORT_COLUMNS[sort]
+        if after is not None and column == "creation_day":
+            after = (_day(after[0]), after[1])
+
+        found = []
+        partition = None
+        for part in parts:
+            # Months are disjoint, so in creation order a full page ends the search
+            if column == "creation_day" and part.partition != partition and len(found) > limit:
+                break
+            partition = part.partition
+            found.extend(self._search_part(part, filters, column, descending, after, limit))
+        found.sort(key=lambda match: (match[0], match[1]), reverse=descending)
+        return [part.loan(i) for _, _, part, i in found[:limit + 1]]
+
+    def _search_part(self, part, filters, column, descending, after, limit):
+        conditions = []
+        if filters.get("status") is not None:
+            conditions.append(part.column("status") == STATUS_CODES[LoanStatus(filters["status"])])
+        for name, field in (("borrower_id", "borrower_id"), ("lender_id", "lender_id")):
+            if filters.get(name) is not None:
+                conditions.append(part.column(field) == filters[name])
+        for name, field, low in (("min_amount", "amount", True), ("max_amount", "amount", False),
+                                 ("min_rate", "interest_rate", True), ("max_rate", "interest_rate", False)):
+            if filters.get(name) is not None:
+                values = part.column(field)
+                conditions.append(values >= filters[name] if low else values <= filters[name])
+        if filters.get("created_from") is not None and part.first_day < _day(filters["created_from"]):
+            conditions.append(part.column("creation_day") >= _day(filters["created_from"]))
+        if filters.get("created_to") is not None and part.last_day > _day(filters["created_to"]):
+            conditions.append(part.column("creation_day") <= _day(filters["created_to"]))
+        values, keys = part.column(column), part.column("loan_id")
+        if after is not None:
+            value, key = after
+            if descending:
+                conditions.append((values < value) | ((values == value) & (keys < key)))
+            else:
+                conditions.append((values > value) | ((values == value) & (keys > key)))
+
+        if conditions:
+            index = np.flatnonzero(np.logical_and.reduce(conditions))
+        else:
+            index = np.arange(part.loans)
+        if len(index) > limit + 1:
+            order = np.lexsort((keys[index], values[index]))
+            index = index[order[::-1] if descending else order][:limit + 1]
+        return [(values[i].item(), int(keys[i]), part, i) for i in index]
+
+    def lender_history(self, lender_id):
+        """Archived loans a lender funded and the principal they put in."""
+        loans, principal = 0, 0.0
+        for part in self.parts():
+            if not part.fundings:
+                continue
+            mask = part.column("funding.lender_id") == lender_id
+            loans += int(np.count_nonzero(mask))
+            principal += float(part.column("funding.amount")[mask].sum())
+        return {"loans": loans, "principal": principal}
+
+    def stats(self):
+        parts = self._parts
+        return {
+            "parts": len(parts),
+            "loans": sum(part.loans for part in parts),
+            "fundings": sum(part.fundings for part in parts),
+            "partitions": len({part.partition for part in parts}),
+        }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Archive paid and rejected loans")
+    parser.add_argument("--before", type=date.fromisoformat,
+                        help=f"creation date cutoff (default: {ARCHIVE_AFTER_DAYS} days ago)")
+    parser.add_argument("--batch-size", type=int, default=ARCHIVE_BATCH_SIZE)
+    args = parser.parse_args()
+    started = datetime.utcnow()
+    outcome = run_archive(SessionLocal, args.before, args.batch_size)
+    print(json.dumps({**outcome.as_dict(), "seconds": (datetime.utcnow() - started).total_seconds()}, indent=2))
@@ -0,0 +1,159 @@
+"""Nightly accrual throughput and checkpoint resume.
+
+Seeds N approved loans, then:
+
+* runs the accrual job for one day and reports loans/s and the time
+  spent reading, computing and writing;
+* runs the next day, stopping it with an error halfway through its chunks
+  (with a smaller chunk size if --loans fits in one), then reruns it and
+  checks every loan got exactly one entry for that day;
+* checks the aggregates with reconcile.
+
+Run from backend/:
+
+    python -m benchmarks.bench_accrual --loans 1000000
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+
+from sqlalchemy import func, insert, select  # noqa: E402
+
+import aggregates  # noqa: E402
+import ledger  # noqa: E402
+from database import Base, SessionLocal, engine  # noqa: E402
+from models import LedgerEntry, LedgerKind, Loan, LoanStatus, User  # noqa: E402
+
+SEED_CHUNK = 50_000
+
+
+class Interrupted(Exception):
+    pass
+
+
+def seed(loans, start):
+    rng = random.Random(11)
+    with SessionLocal() as db:
+        db.add(User(username="benchborrower", password="x", email="b@example.com", phone_number="1234567890"))
+        db.commit()
+    for first in range(0, loans, SEED_CHUNK):
+        with SessionLocal() as db:
+            db.execute(insert(Loan.__table__), [
+                {"borrower_id": 1, "amount": float(rng.randrange(1_000, 50_000)),
+                 "interest_rate": rng.uniform(3, 25), "term_months": 36, "purpose": "benchmark",
+                 "status": LoanStatus.approved, "creation_date": start, "approval_date": start}
+                for _ in range(min(SEED_CHUNK, loans - first))
+            ])
+            db.commit()
+    with engine.begin() as conn:
+        aggregates.backfill(conn)
+
+
+def timed_run(as_of, chunk_size):
+    phases = {"read": 0.0, "write": 0.0}
+    write_chunk = ledger.write_chunk
+    chunks = ledger.iter_active_chunks
+
+    def timed_chunks(*args):
+        iterator = chunks(*args)
+        while True:
+            start = time.perf_counter()
+            try:
+                rows = next(iterator)
+            except StopIteration:
+                return
+            phases["read"] += time.perf_counter() - start
+            yield rows
+
+    def timed_write(*args):
+        start = time.perf_counter()
+        try:
+            return write_chunk(*args)
+        finally:
+            phases["write"] += time.perf_counter() - start
+
+    ledger.iter_active_chunks, ledger.write_chunk = timed_chunks, timed_write
+    try:
+        start = time.perf_counter()
+        result = ledger.run_accrual(SessionLocal, as_of, chunk_size)
+        return result, time.perf_counter() - start, phases
+    finally:
+        ledger.iter_active_chunks, ledger.write_chunk = chunks, write_chunk
+
+
+def interrupted_run(as_of, chunk_size, after_chunks):
+    write_chunk = ledger.write_chunk
+    calls = [0]
+
+    def failing_write(*args):
+        calls[0] += 1
+        if calls[0] > after_chunks:
+            raise Interrupted()
+        return write_chunk(*args)
+
+    ledger.write_chunk = failing_write
+    try:
+        ledger.run_accrual(SessionLocal, as_of, chunk_size)
+    except Interrupted:
+        pass
+    finally:
+        ledger.write_chunk = write_chunk
+
+
+def entries_for(day):
+    with SessionLocal() as db:
+        return db.execute(
+            select(func.count(), func.count(func.distinct(LedgerEntry.loan_id)))
+            .where(LedgerEntry.entry_date == day).where(LedgerEntry.kind == LedgerKind.interest)
+        ).one()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--loans", type=int, default=200_000)
+    parser.add_argument("--chunk-size", type=int, default=ledger.ACCRUAL_CHUNK_SIZE)
+    args = parser.parse_args()
+    if args.loans < 2:
+        parser.error("--loans must be at least 2 to interrupt a run between chunks")
+
+    day1 = date.today()
+    start = day1 - timedelta(days=1)
+    Base.metadata.create_all(bind=engine)
+    print(f"seeding {args.loans:,} approved loans ...")
+    seed(args.loans, start)
+
+    result, elapsed, phases = timed_run(day1, args.chunk_size)
+    print(f"\naccrual for {day1}: {result.loans:,} loans, {result.entries:,} entries in {elapsed:.1f}s "
+          f"({result.loans / elapsed:,.0f} loans/s)")
+    print(f"  read {phases['read']:.1f}s, compute + write {phases['write']:.1f}s, "
+          f"1M loans would take ~{1_000_000 / (result.loans / elapsed) / 60:.1f} min")
+
+    day2 = day1 + timedelta(days=1)
+    # The resume check needs at least two chunks to stop between
+    chunk_size = args.chunk_size if args.loans > args.chunk_size else max(1, -(-args.loans // 4))
+    chunks = -(-args.loans // chunk_size)
+    interrupted_run(day2, chunk_size, after_chunks=chunks // 2)
+    partial = entries_for(day2)[0]
+    result = ledger.run_accrual(SessionLocal, day2, chunk_size)
+    total, distinct = entries_for(day2)
+    resumed_ok = result.resumed_from > 0 and total == distinct == args.loans
+    print(f"\ninterrupted run for {day2}: {partial:,} loans done before the failure")
+    print(f"rerun resumed after loan {result.resumed_from:,}: {total:,} entries for {distinct:,} loans "
+          f"-> {'OK' if resumed_ok else 'FAILED'}")
+
+    report = aggregates.reconcile(SessionLocal)
+    print(f"reconcile: {report['drifted']} drifted")
+    if not resumed_ok or report["drifted"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""Recompute portfolio metrics for N loans: NumPy vs a per-loan Python loop.
+
+Run from backend/:
+
+    python -m benchmarks.bench_analytics --loans 1000000
+
+The book is synthetic and held in memory; this measures compute only, not
+loading from the database.
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+
+import numpy as np  # noqa: E402
+
+import analytics  # noqa: E402
+
+
+def make_book(n, lenders, borrowers, seed=11):
+    rng = np.random.default_rng(seed)
+    start = (date.today() - timedelta(days=730) - analytics.EPOCH).days
+    return analytics.Book(
+        lender_id=rng.integers(1, lenders + 1, n),
+        loan_id=np.arange(1, n + 1),
+        borrower_id=rng.integers(1, borrowers + 1, n),
+        principal=rng.uniform(500, 50_000, n).round(2),
+        rate=rng.uniform(1, 30, n).round(2),
+        term=rng.choice([6, 12, 24, 36, 60], n),
+        start_day=start + rng.integers(0, 730, n),
+    )
+
+
+def python_loop(book, as_of):
+    """Reference implementation: one loan at a time."""
+    as_of_day = (as_of - analytics.EPOCH).days
+    exposure = {}
+    interest_remaining = {}
+    for lender, principal, rate, term, start in zip(
+        book.lender_id.tolist(), book.principal.tolist(), book.rate.tolist(), book.term.tolist(),
+        book.start_day.tolist(),
+    ):
+        r = rate / 1200.0
+        growth = (1 + r) ** term
+        payment = principal * r * growth / (growth - 1) if r > 0 else principal / term
+        k = min(max((as_of_day - start) // analytics.DAYS_PER_MONTH, 0), term)
+        g = (1 + r) ** k
+        balance = max(principal * g - (payment * (g - 1) / r if r > 0 else payment * k), 0.0)
+        total_interest = payment * term - principal
+        earned = payment * k - (principal - balance)
+        exposure[lender] = exposure.get(lender, 0.0) + balance
+        interest_remaining[lender] = interest_remaining.get(lender, 0.0) + total_interest - earned
+    total = sum(exposure.values())
+    hhi = sum((v / total) ** 2 for v in exposure.values()) if total else 0.0
+    return total, hhi
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--loans", type=int, default=1_000_000)
+    parser.add_argument("--lenders", type=int, default=10_000)
+    parser.add_argument("--borrowers", type=int, default=200_000)
+    args = parser.parse_args()
+
+    book = make_book(args.loans, args.lenders, args.borrowers)
+    as_of = date.today()
+
+    start = time.perf_counter()
+    metrics = analytics.compute_book(book, as_of)
+    core = time.perf_counter() - start
+
+    start = time.perf_counter()
+    summary = analytics.portfolio_summary(book, as_of)
+    full = time.perf_counter() - start
+
+    start = time.perf_counter()
+    loop_total, loop_hhi = python_loop(book, as_of)
+    loop = time.perf_counter() - start
+
+    assert abs(metrics["outstanding"].sum() - loop_total) < 1e-6 * max(1.0, loop_total)
+    assert abs(summary["lender_hhi"] - loop_hhi) < 1e-9
+    print(f"loans:                    {args.loans:,}")
+    print(f"numpy amortization:       {core:8.3f}s")
+    print(f"numpy full summary:       {full:8.3f}s  (incl. lender/borrower concentration)")
+    print(f"python loop:              {loop:8.3f}s")
+    print(f"speedup (summary vs loop): {loop / full:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Archiving settled loans: throughput, footprint and read latency.
+
+Seeds N loans created over four years, in id order like real traffic.
+Older loans are mostly paid or rejected; recent ones mostly active. Then:
+
+* times the same searches and lookups before and after archiving
+  everything settled and older than a year. Hot queries hit the now
+  smaller table; historical ones are served from the memory-mapped
+  archive;
+* reports archiving throughput, loans left in the table and archive bytes
+  per loan;
+* checks the aggregates with reconcile (which counts archived loans from
+  the manifest).
+
+Run from backend/:
+
+    python -m benchmarks.bench_archive --loans 1000000
+
+Uses DATABASE_URL and ARCHIVE_DIR when set, otherwise throwaway ones.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import date, timedelta
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+if "ARCHIVE_DIR" not in os.environ:
+    os.environ["ARCHIVE_DIR"] = tempfile.mkdtemp()
+
+import httpx  # noqa: E402
+from sqlalchemy import func, insert, select  # noqa: E402
+
+import aggregates  # noqa: E402
+import archive  # noqa: E402
+import main  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from models import Lender, Loan, LoanFunding, LoanStatus, User  # noqa: E402
+
+SEED_CHUNK = 50_000
+LENDERS = 1000
+YEARS = 4
+STATUSES = (LoanStatus.pending, LoanStatus.approved, LoanStatus.rejected, LoanStatus.paid)
+
+
+def seed(loans):
+    rng = random.Random(5)
+    today = date.today()
+    first = today - timedelta(days=365 * YEARS)
+    purposes = ["car", "home", "education", "business", "medical", "travel"]
+    with SessionLocal() as db:
+        db.add(User(username="benchborrower", password="x", email="b@example.com", phone_number="1234567890"))
+        db.execute(insert(Lender.__table__), [
+            {"name": f"lender {i}", "email": f"lender{i}@example.com", "credit_score": 700,
+             "available_funds": 50_000.0, "registration_date": first}
+            for i in range(LENDERS)
+        ])
+        db.commit()
+    for start in range(0, loans, SEED_CHUNK):
+        rows = []
+        for n in range(start, min(start + SEED_CHUNK, loans)):
+            created = first + timedelta(days=n * 365 * YEARS // loans)
+            settled = (today - created).days / (365 * YEARS)
+            status = rng.choices(STATUSES, weights=(1, 2, 1 + settled, 8 * settled))[0]
+            rows.append({
+                "borrower_id": 1, "lender_id": None if status == LoanStatus.pending else rng.randrange(LENDERS) + 1,
+                "amount": float(rng.randrange(500, 50_000)), "interest_rate": round(rng.uniform(3, 25), 2),
+                "term_months": 36, "purpose": rng.choice(purposes), "status": status, "creation_date": created,
+                "approval_date": created if status in (LoanStatus.approved, LoanStatus.paid) else None,
+            })
+        with SessionLocal() as db:
+            db.execute(insert(Loan.__table__), rows)
+            funded = db.execute(
+                select(Loan.loan_id, Loan.lender_id, Loan.amount, Loan.approval_date)
+                .where(Loan.loan_id > start).where(Loan.loan_id <= start + len(rows))
+                .where(Loan.status.in_([LoanStatus.approved, LoanStatus.paid]))
+            ).all()
+            db.execute(insert(LoanFunding.__table__), [
+                {"loan_id": loan_id, "lender_id": lender_id, "amount": amount, "funded_date": day}
+                for loan_id, lender_id, amount, day in funded
+            ])
+            db.commit()
+    with engine.begin() as conn:
+        aggregates.backfill(conn)
+
+
+def count_loans():
+    with SessionLocal() as db:
+        return db.scalar(select(func.count()).select_from(Loan))
+
+
+async def timed(client, path, params, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        response = await client.get(path, params=params)
+        times.append(time.perf_counter() - start)
+        response.raise_for_status()
+    return min(times), response.json()
+
+
+def queries():
+    year_ago = date.today() - timedelta(days=365)
+    old = year_ago - timedelta(days=365 * 2)
+    return [
+        ("hot: pending, newest", "/loans/search", {"status": "pending", "limit": 100}),
+        ("hot: approved, newest", "/loans/search", {"status": "approved", "limit": 100}),
+        ("historical: paid in one quarter", "/loans/search",
+         {"status": "paid", "created_from": old.isoformat(),
+          "created_to": (old + timedelta(days=90)).isoformat(), "order": "asc", "limit": 100}),
+        ("historical: rejected by amount", "/loans/search",
+         {"status": "rejected", "sort": "amount", "order": "desc", "limit": 100}),
+    ]
+
+
+async def timed_lookup(load, loan_id, repeat):
+    # Bypasses the entity cache: table read before archiving, archive after
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        loan = await load(loan_id)
+        times.append(time.perf_counter() - start)
+    return min(times), loan
+
+
+def reconcile_seconds():
+    start = time.perf_counter()
+    report = aggregates.reconcile(SessionLocal)
+    return time.perf_counter() - start, report
+
+
+async def run(args):
+    print(f"seeding {args.loans:,} loans over {YEARS} years ...")
+    async with main.app.router.lifespan_context(main.app):
+        seed(args.loans)
+        with SessionLocal() as db:
+            sample_id = db.scalar(select(func.min(Loan.loan_id)).where(Loan.status == LoanStatus.paid))
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=600) as client:
+            checks = queries()
+            before = [await timed(client, path, params, args.repeat) for _, path, params in checks]
+            before_reconcile, _ = reconcile_seconds()
+            before_lookup = await timed_lookup(main.load_loan, sample_id, args.repeat)
+            rows_before = count_loans()
+
+            start = time.perf_counter()
+            result = archive.run_archive(SessionLocal, batch_size=args.batch_size)
+            elapsed = time.perf_counter() - start
+            main.loan_archive.invalidate()
+            rows_after = count_loans()
+            print(f"\narchived {result.loans:,} loans and {result.fundings:,} fundings in {elapsed:.1f}s "
+                  f"({result.loans / elapsed:,.0f} loans/s), {result.parts} parts, "
+                  f"{result.size_bytes / max(result.loans, 1):.0f} bytes/loan with its fundings")
+            print(f"loans table: {rows_before:,} -> {rows_after:,} rows")
+
+            after = [await timed(client, path, params, args.repeat) for _, path, params in checks]
+            after_reconcile, report = reconcile_seconds()
+            after_lookup = await timed_lookup(main.load_loan, sample_id, args.repeat)
+
+    print(f"\n{'query':<34} {'before':>10} {'after':>10}  same result")
+    for (label, _, _), (t0, body0), (t1, body1) in zip(checks, before, after):
+        print(f"{label:<34} {t0 * 1000:8.2f}ms {t1 * 1000:8.2f}ms  {body0 == body1}")
+    print(f"{'lookup: one old paid loan':<34} {before_lookup[0] * 1000:8.2f}ms {after_lookup[0] * 1000:8.2f}ms  "
+          f"{before_lookup[1] == after_lookup[1]}")
+    print(f"{'reconcile (full recompute)':<34} {before_reconcile * 1000:8.0f}ms {after_reconcile * 1000:8.0f}ms")
+    print(f"\nreconcile after archiving: {report['drifted']} drifted -> {'OK' if not report['drifted'] else 'FAILED'}")
+    if report["drifted"] or any(b[1] != a[1] for b, a in zip(before + [before_lookup], after + [after_lookup])):
+        raise SystemExit(1)
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--loans", type=int, default=300_000)
+    parser.add_argument("--batch-size", type=int, default=archive.ARCHIVE_BATCH_SIZE)
+    parser.add_argument("--repeat", type=int, default=20)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_()
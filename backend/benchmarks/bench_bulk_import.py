@@ -0,0 +1,76 @@
+"""Compare per-row POST /loans/ against one streamed POST /loans/bulk.
+
+Run from backend/:
+
+    python -m benchmarks.bench_bulk_import --rows 20000
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+
+from fastapi.testclient import TestClient  # noqa: E402
+
+import main  # noqa: E402
+
+
+def seed_parties(db):
+    user = main.User(username="benchuser", password="x", email="bench@example.com", phone_number="1234567890")
+    lender = main.Lender(name="Bench Lender", email="bench-lender@example.com", credit_score=750,
+                         available_funds=1e12)
+    db.add_all([user, lender])
+    db.commit()
+    return user.user_id, lender.lender_id
+
+
+def make_loans(n, borrower_id, lender_id):
+    rng = random.Random(42)
+    return [
+        {
+            "borrower_id": borrower_id,
+            "lender_id": lender_id,
+            "amount": round(rng.uniform(500, 50000), 2),
+            "interest_rate": round(rng.uniform(1, 30), 2),
+            "term_months": rng.choice([6, 12, 24, 36, 60]),
+            "purpose": "benchmark",
+        }
+        for _ in range(n)
+    ]
+
+
+def run(rows):
+    main.Base.metadata.create_all(bind=main.engine)
+    with main.SessionLocal() as db:
+        borrower_id, lender_id = seed_parties(db)
+    loans = make_loans(rows, borrower_id, lender_id)
+
+    with TestClient(main.app) as client:
+        start = time.perf_counter()
+        for loan in loans:
+            client.post("/loans/", json=loan).raise_for_status()
+        per_row = time.perf_counter() - start
+
+        body = "\n".join(json.dumps(loan) for loan in loans).encode()
+        start = time.perf_counter()
+        response = client.post("/loans/bulk", content=body, headers={"Content-Type": "application/x-ndjson"})
+        bulk = time.perf_counter() - start
+        report = response.json()
+
+    print(f"rows:          {rows}")
+    print(f"per-row POST:  {per_row:8.2f}s  {rows / per_row:10.0f} rows/s")
+    print(f"bulk NDJSON:   {bulk:8.2f}s  {rows / bulk:10.0f} rows/s  (inserted={report['inserted']}, "
+          f"failed={report['failed']})")
+    print(f"speedup:       {per_row / bulk:8.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=5000)
+    run(parser.parse_args().rows)
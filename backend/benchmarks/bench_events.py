@@ -0,0 +1,113 @@
+"""Event broker cost: idle subscribers, fan-out latency, slow consumers.
+
+Drives ``EventBroker.stream`` directly (no HTTP) with N subscribers:
+
+* CPU time used by the process while every subscriber sits idle;
+* time from ``publish`` until every subscriber has the event, per event
+  and for a burst;
+* a consumer that stops reading is disconnected once it is
+  ``EVENTS_QUEUE_SIZE`` events behind, while the others keep up.
+
+Run from backend/:
+
+    python -m benchmarks.bench_events --subscribers 5000 --idle 10
+"""
+import argparse
+import asyncio
+import time
+
+from events import EventBroker
+
+
+class Tally:
+    """Events delivered across all consumers; wakes the driver at a target."""
+
+    def __init__(self):
+        self.delivered = 0
+        self.target = None
+        self.reached = asyncio.Event()
+
+    def add(self, n):
+        self.delivered += n
+        if self.target is not None and self.delivered >= self.target:
+            self.reached.set()
+
+    async def wait_for(self, target):
+        self.target = target
+        self.reached.clear()
+        if self.delivered < target:
+            await self.reached.wait()
+
+
+async def consume(stream, tally):
+    async for chunk in stream:
+        tally.add(chunk.count(b"\nevent: "))
+
+
+async def stall(stream):
+    # Read the preamble, then stop reading without closing, like a client
+    # whose socket buffer is full
+    await stream.__anext__()
+    await asyncio.Event().wait()
+
+
+async def run(args):
+    broker = EventBroker(max_queue=args.queue)
+    broker.keepalive = args.keepalive
+    tally = Tally()
+    tasks = [asyncio.ensure_future(consume(broker.stream(), tally))
+             for _ in range(args.subscribers)]
+    stalled = asyncio.ensure_future(stall(broker.stream()))
+    while len(broker.subscribers) < args.subscribers + 1:
+        await asyncio.sleep(0.01)
+
+    cpu = time.process_time()
+    await asyncio.sleep(args.idle)
+    idle_cpu = time.process_time() - cpu
+    print(f"{args.subscribers:,} idle subscribers for {args.idle:g}s: "
+          f"{idle_cpu * 1000:.1f} ms CPU ({idle_cpu / args.idle * 100:.2f}% of one core)")
+
+    latencies = []
+    for i in range(args.events):
+        start = time.perf_counter()
+        broker.publish("loan", "approved", {"loan_id": i, "amount": 1000.0})
+        await tally.wait_for((i + 1) * args.subscribers)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+    print(f"one event to all subscribers: p50 {latencies[len(latencies) // 2] * 1000:.2f} ms, "
+          f"max {latencies[-1] * 1000:.2f} ms")
+
+    # Published in rounds that fit the queues, so only the stalled consumer falls behind
+    round_size = max(args.queue // 2, 1)
+    start = time.perf_counter()
+    for first in range(0, args.burst, round_size):
+        for i in range(first, min(first + round_size, args.burst)):
+            broker.publish("loan", "created", {"loan_id": i})
+        await tally.wait_for((args.events + min(first + round_size, args.burst)) * args.subscribers)
+    elapsed = time.perf_counter() - start
+    deliveries = args.burst * args.subscribers
+    print(f"burst of {args.burst:,} events: {elapsed * 1000:.0f} ms, {deliveries / elapsed:,.0f} deliveries/s")
+
+    stalled_gone = len(broker.subscribers) == args.subscribers
+    print(f"stalled consumer dropped: {stalled_gone} (overflows: {broker.overflows})")
+
+    broker.close()
+    stalled.cancel()
+    await asyncio.gather(stalled, *tasks, return_exceptions=True)
+    if not stalled_gone:
+        raise SystemExit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--subscribers", type=int, default=2000)
+    parser.add_argument("--idle", type=float, default=5.0)
+    parser.add_argument("--keepalive", type=float, default=15.0)
+    parser.add_argument("--events", type=int, default=50)
+    parser.add_argument("--burst", type=int, default=2000)
+    parser.add_argument("--queue", type=int, default=1000)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
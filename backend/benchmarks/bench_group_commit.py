@@ -0,0 +1,119 @@
+"""Create-endpoint throughput with and without group commit.
+
+Sends N POST /loans/ requests from C concurrent clients through the ASGI
+app, once with every insert committing on its own and once per
+group-commit window. A lender run with duplicate emails mixed in checks
+that only the duplicates fail.
+
+Run from backend/:
+
+    python -m benchmarks.bench_group_commit --requests 5000 --concurrency 200 --windows 1 2 5
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+
+import httpx  # noqa: E402
+from sqlalchemy import func, select  # noqa: E402
+
+import main  # noqa: E402
+from database import Base, SessionLocal, engine  # noqa: E402
+from models import Lender, User  # noqa: E402
+
+
+async def drive(client, requests, concurrency):
+    latencies = []
+    codes = {}
+    queue = iter(requests)
+
+    async def worker():
+        for path, body in queue:
+            start = time.perf_counter()
+            response = await client.post(path, json=body)
+            latencies.append(time.perf_counter() - start)
+            codes[response.status_code] = codes.get(response.status_code, 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return {
+        "per_second": len(requests) / elapsed,
+        "p50_ms": statistics.median(latencies) * 1000,
+        "p99_ms": latencies[int(len(latencies) * 0.99) - 1] * 1000,
+        "codes": codes,
+    }
+
+
+def loan_requests(n, borrower_id):
+    return [
+        ("/loans/", {"borrower_id": borrower_id, "amount": 1000 + i, "interest_rate": 8.5, "term_months": 12,
+                     "purpose": "benchmark"})
+        for i in range(n)
+    ]
+
+
+def lender_requests(n, tag):
+    # Every tenth request reuses an earlier email and must fail on its own
+    return [
+        ("/lenders/", {"name": f"lender {i}", "email": f"{tag}-{i - i % 10 if i % 10 == 9 else i}@example.com",
+                       "credit_score": 700, "available_funds": 10_000})
+        for i in range(n)
+    ]
+
+
+async def run(args):
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        db.add(User(username="benchborrower", password="x", email="b@example.com", phone_number="1234567890"))
+        db.commit()
+        borrower_id = db.scalar(select(User.user_id).where(User.username == "benchborrower"))
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+        print(f"{'window':>10} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8}  rows/commit  status codes")
+        baseline = None
+        for window in [0] + args.windows:
+            main.row_writer.window = window / 1000
+            before = dict(main.row_writer.stats())
+            result = await drive(client, loan_requests(args.requests, borrower_id), args.concurrency)
+            after = main.row_writer.stats()
+            commits = after["commits"] - before["commits"]
+            rows = after["rows"] - before["rows"]
+            baseline = baseline or result["per_second"]
+            label = "off" if window == 0 else f"{window:g} ms"
+            print(f"{label:>10} {result['per_second']:9,.0f} {result['p50_ms']:8.1f} {result['p99_ms']:8.1f}"
+                  f"  {rows / max(commits, 1):11.1f}  {result['codes']}"
+                  f"  ({result['per_second'] / baseline:.1f}x)")
+
+        main.row_writer.window = max(args.windows) / 1000
+        requests = lender_requests(args.requests // 5, "dup")
+        result = await drive(client, requests, args.concurrency)
+    with SessionLocal() as db:
+        stored = db.scalar(select(func.count()).select_from(Lender).where(Lender.email.like("dup-%")))
+    expected_dupes = sum(1 for i in range(len(requests)) if i % 10 == 9)
+    ok = result["codes"].get(400, 0) == expected_dupes and stored == len(requests) - expected_dupes
+    print(f"\nlenders with duplicates: {result['codes']}, stored {stored}, "
+          f"expected {expected_dupes} rejections -> {'OK' if ok else 'FAILED'}")
+    if not ok:
+        raise SystemExit(1)
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--windows", type=float, nargs="+", default=[2.0, 5.0])
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_()
@@ -0,0 +1,202 @@
+"""Loan search: index usage and latency on a large seeded table.
+
+Seeds N loans (default 1M), runs ANALYZE, then for each query case:
+
+* runs the exact statement the API issues and EXPLAINs it, failing if the
+  plan does not use the expected index (or falls back to a full scan);
+* times repeated executions and reports p50/p95 in milliseconds.
+
+Run from backend/:
+
+    python -m benchmarks.bench_loan_search --rows 2000000 --save search.json
+    python -m benchmarks.bench_loan_search --baseline search.json   # regression check
+
+Uses DATABASE_URL when set (e.g. a local Postgres), otherwise a SQLite file
+that is kept between runs with --db so seeding happens once.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+from datetime import date, timedelta
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument("--rows", type=int, default=1_000_000)
+parser.add_argument("--lenders", type=int, default=2_000)
+parser.add_argument("--borrowers", type=int, default=50_000)
+parser.add_argument("--repeat", type=int, default=50)
+parser.add_argument("--db", help="SQLite file to reuse when DATABASE_URL is not set")
+parser.add_argument("--save", help="write results to this JSON file")
+parser.add_argument("--baseline", help="compare against results saved with --save")
+parser.add_argument("--tolerance", type=float, default=1.5, help="allowed p95 slowdown vs baseline")
+args = parser.parse_args()
+
+if "DATABASE_URL" not in os.environ:
+    path = args.db or os.path.join(tempfile.mkdtemp(), "bench.db")
+    os.environ["DATABASE_URL"] = "sqlite:///" + path
+
+from sqlalchemy import event, func, insert, select, text  # noqa: E402
+
+from database import AsyncSessionLocal, Base, SessionLocal, async_engine, engine, is_sqlite  # noqa: E402
+from matching import pending_loans_statement  # noqa: E402
+from models import Lender, Loan, LoanStatus, User  # noqa: E402
+from search import LoanSort, SortOrder, search_loans  # noqa: E402
+
+COLUMNS = tuple(Loan.__table__.columns)
+SEED_CHUNK = 50_000
+STATUSES = [LoanStatus.pending] * 3 + [LoanStatus.approved] * 5 + [LoanStatus.rejected, LoanStatus.paid]
+
+
+def seed(rows, lenders, borrowers):
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        existing = db.scalar(select(func.count()).select_from(Loan))
+        if existing >= rows:
+            print(f"reusing {existing:,} seeded loans")
+            return
+        rng = random.Random(5)
+        if not db.scalar(select(func.count()).select_from(User)):
+            db.execute(insert(User.__table__), [
+                {"user_id": i, "username": f"u{i}", "password": "x", "email": f"u{i}@example.com",
+                 "phone_number": "1234567890"}
+                for i in range(1, borrowers + 1)
+            ])
+            db.execute(insert(Lender.__table__), [
+                {"lender_id": i, "name": f"lender{i}", "email": f"lender{i}@example.com",
+                 "credit_score": rng.uniform(300, 850), "available_funds": 1e6, "min_interest_rate": 0.0}
+                for i in range(1, lenders + 1)
+            ])
+        first_day = date.today() - timedelta(days=3 * 365)
+        start = time.perf_counter()
+        for offset in range(existing, rows, SEED_CHUNK):
+            chunk = []
+            for loan_id in range(offset + 1, min(offset + SEED_CHUNK, rows) + 1):
+                status = rng.choice(STATUSES)
+                unassigned = status == LoanStatus.pending and rng.random() < 0.5
+                chunk.append({
+                    "loan_id": loan_id, "borrower_id": rng.randint(1, borrowers),
+                    "lender_id": None if unassigned else rng.randint(1, lenders),
+                    "amount": round(rng.uniform(500, 50_000), 2), "interest_rate": round(rng.uniform(1, 30), 2),
+                    "term_months": rng.choice([6, 12, 24, 36, 60]), "purpose": "benchmark", "status": status,
+                    "creation_date": first_day + timedelta(days=rng.randrange(3 * 365)),
+                })
+            db.execute(insert(Loan.__table__), chunk)
+            db.commit()
+        db.execute(text("ANALYZE"))
+        db.commit()
+        print(f"seeded {rows - existing:,} loans in {time.perf_counter() - start:.1f}s")
+
+
+def search(filters, sort=LoanSort.created, order=SortOrder.desc, pages=1):
+    async def run(db):
+        cursor = None
+        for _ in range(pages):
+            page = await search_loans(db, COLUMNS, filters, sort, order, cursor, 100)
+            cursor = page["next_cursor"]
+    return run
+
+
+def matching_scan(db):
+    return db.execute(pending_loans_statement(0, 5000))
+
+
+recent = date.today() - timedelta(days=30)
+# name -> (query, index the plan must use)
+CASES = {
+    "lender_pending_newest": (search({"lender_id": 17, "status": LoanStatus.pending}),
+                              "ix_loans_lender_status_created"),
+    "lender_approved_amount_range": (search({"lender_id": 17, "status": LoanStatus.approved,
+                                             "min_amount": 1000, "max_amount": 5000}),
+                                     "ix_loans_lender_status_created"),
+    "borrower_history": (search({"borrower_id": 4242}), "ix_loans_borrower_created"),
+    "pending_last_30_days": (search({"status": LoanStatus.pending, "created_from": recent}),
+                             "ix_loans_status_created"),
+    "pending_oldest_deep_pages": (search({"status": LoanStatus.pending}, order=SortOrder.asc, pages=20),
+                                  "ix_loans_status_created"),
+    "matching_pending_scan": (matching_scan, "ix_loans_pending_unassigned"),
+}
+
+
+class StatementRecorder:
+    """Keeps the SQL and parameters of the last statement sent to the driver."""
+
+    def __init__(self, sync_engine):
+        self.last = None
+        event.listen(sync_engine, "before_cursor_execute", self._record)
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        self.last = (statement, parameters)
+
+
+async def explain(statement, parameters):
+    prefix = "EXPLAIN QUERY PLAN " if is_sqlite(os.environ["DATABASE_URL"]) else "EXPLAIN "
+    async with async_engine.connect() as conn:
+        rows = (await conn.exec_driver_sql(prefix + statement, parameters)).all()
+    return "\n".join(str(row[-1]) for row in rows)
+
+
+def full_scan(plan):
+    return "SCAN loans" in plan.replace("SCAN loans USING", "") or "Seq Scan on loans" in plan
+
+
+async def run_case(name, query, expected_index, repeat, recorder):
+    async with AsyncSessionLocal() as db:
+        await query(db)
+    plan = await explain(*recorder.last)
+    timings = []
+    for _ in range(repeat):
+        async with AsyncSessionLocal() as db:
+            start = time.perf_counter()
+            await query(db)
+            timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return {
+        "p50_ms": statistics.median(timings),
+        "p95_ms": timings[int(len(timings) * 0.95) - 1] if len(timings) > 1 else timings[0],
+        "index_used": expected_index in plan and not full_scan(plan),
+        "plan": plan,
+    }
+
+
+async def run_all(repeat):
+    recorder = StatementRecorder(async_engine.sync_engine)
+    results = {}
+    for name, (query, expected_index) in CASES.items():
+        results[name] = await run_case(name, query, expected_index, repeat, recorder)
+    await async_engine.dispose()
+    return results
+
+
+def main():
+    seed(args.rows, args.lenders, args.borrowers)
+    results = asyncio.run(run_all(args.repeat))
+    baseline = json.load(open(args.baseline)) if args.baseline else {}
+
+    failures = []
+    print(f"{'case':32} {'p50 ms':>9} {'p95 ms':>9}  index")
+    for name, result in results.items():
+        line = f"{name:32} {result['p50_ms']:9.2f} {result['p95_ms']:9.2f}  {'ok' if result['index_used'] else 'MISSING'}"
+        if not result["index_used"]:
+            failures.append(f"{name}: expected {CASES[name][1]}, plan was:\n{result['plan']}")
+        previous = baseline.get(name)
+        if previous:
+            ratio = result["p95_ms"] / previous["p95_ms"]
+            line += f"  p95 x{ratio:.2f} vs baseline"
+            if ratio > args.tolerance:
+                failures.append(f"{name}: p95 {result['p95_ms']:.2f}ms vs baseline {previous['p95_ms']:.2f}ms")
+        print(line)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if failures:
+        print("\nFAILED:\n" + "\n".join(failures))
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""Match N pending loans against M lenders.
+
+Run from backend/:
+
+    python -m benchmarks.bench_matching --loans 100000 --lenders 10000
+    python -m benchmarks.bench_matching --persist   # include DB writes
+
+With --persist the book is seeded into DATABASE_URL (default: a throwaway
+SQLite file) and run_matching is timed end to end.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+
+from sqlalchemy import insert  # noqa: E402
+
+from database import Base, SessionLocal, engine  # noqa: E402
+from matching import LenderBook, match_batch, run_matching  # noqa: E402
+from models import Lender, Loan, LoanStatus, User  # noqa: E402
+
+
+def make_lenders(n, rng):
+    return [
+        (i + 1, rng.uniform(300, 850), rng.uniform(10_000, 500_000), rng.choice([0.0, 0.0, 3.0, 5.0, 8.0, 12.0]))
+        for i in range(n)
+    ]
+
+
+def make_loans(n, rng):
+    return [(i + 1, round(rng.uniform(500, 50_000), 2), round(rng.uniform(1, 30), 2)) for i in range(n)]
+
+
+def bench_in_memory(lenders, loans):
+    start = time.perf_counter()
+    book = LenderBook(lenders)
+    built = time.perf_counter()
+    matches = match_batch(book, loans)
+    done = time.perf_counter()
+    split = sum(1 for _, allocation in matches if len(allocation) > 1)
+    print(f"book build:    {built - start:8.3f}s")
+    print(f"matching:      {done - built:8.3f}s  ({len(matches)} matched, {split} split, "
+          f"{len(loans) / (done - built):,.0f} loans/s)")
+
+
+def bench_persist(lenders, loans, batch_size):
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        db.add(User(username="benchborrower", password="x", email="borrower@example.com", phone_number="1234567890"))
+        db.flush()
+        db.execute(insert(Lender.__table__), [
+            {"lender_id": i, "name": f"lender{i}", "email": f"lender{i}@example.com", "credit_score": score,
+             "available_funds": funds, "min_interest_rate": min_rate}
+            for i, score, funds, min_rate in lenders
+        ])
+        db.execute(insert(Loan.__table__), [
+            {"loan_id": i, "borrower_id": 1, "amount": amount, "interest_rate": rate, "term_months": 12,
+             "purpose": "benchmark", "status": LoanStatus.pending}
+            for i, amount, rate in loans
+        ])
+        db.commit()
+
+    start = time.perf_counter()
+    result = run_matching(SessionLocal, batch_size)
+    elapsed = time.perf_counter() - start
+    print(f"run_matching:  {elapsed:8.3f}s  {result.as_dict()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--loans", type=int, default=100_000)
+    parser.add_argument("--lenders", type=int, default=10_000)
+    parser.add_argument("--batch-size", type=int, default=5000)
+    parser.add_argument("--persist", action="store_true")
+    args = parser.parse_args()
+
+    rng = random.Random(7)
+    lenders = make_lenders(args.lenders, rng)
+    loans = make_loans(args.loans, rng)
+    bench_in_memory(lenders, loans)
+    if args.persist:
+        bench_persist(lenders, loans, args.batch_size)
+
+
+if __name__ == "__main__":
+    main()
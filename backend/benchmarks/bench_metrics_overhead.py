@@ -0,0 +1,53 @@
+"""Per-request cost of PrometheusMiddleware, measured without any HTTP stack.
+
+Run from backend/:
+
+    python -m benchmarks.bench_metrics_overhead --iterations 200000
+"""
+import argparse
+import asyncio
+import time
+
+from metrics import PrometheusMiddleware
+
+
+class _Route:
+    path = "/users/{user_id}"
+
+
+async def bare_app(scope, receive, send):
+    scope["route"] = _Route
+    await send({"type": "http.response.start", "status": 200, "headers": []})
+    await send({"type": "http.response.body", "body": b"{}"})
+
+
+async def receive():
+    return {"type": "http.request", "body": b""}
+
+
+async def send(message):
+    pass
+
+
+async def drive(app, iterations):
+    scope = {"type": "http", "method": "GET", "path": "/users/1"}
+    start = time.perf_counter()
+    for _ in range(iterations):
+        await app(dict(scope), receive, send)
+    return (time.perf_counter() - start) / iterations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=100000)
+    iterations = parser.parse_args().iterations
+
+    bare = asyncio.run(drive(bare_app, iterations))
+    instrumented = asyncio.run(drive(PrometheusMiddleware(bare_app), iterations))
+    print(f"bare app:      {bare * 1e6:6.2f} us/request")
+    print(f"instrumented:  {instrumented * 1e6:6.2f} us/request")
+    print(f"overhead:      {(instrumented - bare) * 1e6:6.2f} us/request")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Per-request overhead of profiling and query insights.
+
+Each configuration runs in a fresh interpreter, because the settings are
+read at import. Requests go through the ASGI app against a throwaway SQLite
+file:
+
+* everything off (QUERY_INSIGHTS=0, no sampling): the baseline;
+* query insights on (the default);
+* insights plus cProfile on 1% and on 100% of requests.
+
+Run from backend/:
+
+    python -m benchmarks.bench_profiling --requests 3000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CONFIGS = [
+    ("off", {"QUERY_INSIGHTS": "0", "PROFILE_SAMPLE_RATE": "0"}),
+    ("insights", {"QUERY_INSIGHTS": "1", "PROFILE_SAMPLE_RATE": "0"}),
+    ("insights + 1% profiled", {"QUERY_INSIGHTS": "1", "PROFILE_SAMPLE_RATE": "0.01"}),
+    ("insights + 100% profiled", {"QUERY_INSIGHTS": "1", "PROFILE_SAMPLE_RATE": "1"}),
+]
+
+DRIVER = """
+import asyncio, contextlib, io, sys, time
+import httpx
+import main
+
+async def run(n):
+    transport = httpx.ASGITransport(app=main.app)
+    async with main.app.router.lifespan_context(main.app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for i in range(20):
+                await client.post("/lenders/", json={"name": "L", "email": f"l{i}@example.com",
+                                                     "credit_score": 700, "available_funds": 1000})
+            paths = ["/lenders/%d" % (i % 20 + 1) if i % 2 else "/lenders/?limit=20" for i in range(n)]
+            for path in paths[:200]:
+                await client.get(path)
+            # Profiled requests print a summary line; keep it out of the timing
+            with contextlib.redirect_stdout(io.StringIO()):
+                start = time.perf_counter()
+                for path in paths:
+                    await client.get(path)
+                elapsed = time.perf_counter() - start
+    print(elapsed / n * 1e6)
+
+asyncio.run(run(int(sys.argv[1])))
+"""
+
+
+def measure(requests, overrides):
+    url = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    env = dict(os.environ, DATABASE_URL=url, **overrides)
+    result = subprocess.run([sys.executable, "-W", "ignore", "-c", DRIVER, str(requests)], cwd=BACKEND_DIR,
+                            env=env, capture_output=True, text=True, check=True)
+    return float(result.stdout.split()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=3000)
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    baseline = None
+    print(f"{'configuration':<26} {'µs/request':>11}  overhead")
+    for label, overrides in CONFIGS:
+        micros = min(measure(args.requests, overrides) for _ in range(args.runs))
+        baseline = baseline or micros
+        print(f"{label:<26} {micros:11.0f}  {(micros / baseline - 1) * 100:+7.1f}%")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Per-response serialization cost: previous path vs the orjson fast path.
+
+Compares, for a single entity and for list pages:
+
+* ``jsonable_encoder`` + stdlib ``JSONResponse`` (what the routes did before);
+* validating every row through the Pydantic response model;
+* plain column dicts encoded by ``FastJSONResponse`` (what the routes do now);
+
+and, against a seeded SQLite table, loading a page as ORM objects versus as
+column tuples.
+
+Run from backend/:
+
+    python -m benchmarks.bench_serialization
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import date, timedelta
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+from sqlalchemy import insert, select  # noqa: E402
+
+import main  # noqa: E402
+from database import Base, SessionLocal, engine  # noqa: E402
+from models import Loan, LoanStatus, User  # noqa: E402
+from serialization import FastJSONResponse, orjson  # noqa: E402
+
+
+def make_rows(n):
+    today = date.today()
+    return [
+        {"loan_id": i, "borrower_id": 1, "lender_id": i % 50 + 1, "amount": 1000.0 + i, "interest_rate": 7.5,
+         "term_months": 36, "purpose": "home improvement", "status": LoanStatus.pending,
+         "creation_date": today - timedelta(days=i % 365), "approval_date": None}
+        for i in range(1, n + 1)
+    ]
+
+
+def validated(content):
+    # Every row through the response model, then encoded by Pydantic
+    if isinstance(content, list):
+        page = main.LoanPage(items=content)
+    else:
+        page = main.LoanOut(**content)
+    dump_json = getattr(page, "model_dump_json", None) or page.json
+    return dump_json()
+
+
+def per_call(fn, content, budget=0.5):
+    calls = 0
+    start = time.perf_counter()
+    while True:
+        fn(content)
+        calls += 1
+        elapsed = time.perf_counter() - start
+        if elapsed > budget:
+            return elapsed / calls * 1e6
+
+
+def bench_encoding(sizes):
+    paths = {
+        "jsonable_encoder + json": lambda content: JSONResponse(jsonable_encoder(content)).body,
+        "pydantic model validate": validated,
+        "FastJSONResponse": lambda content: FastJSONResponse(content).body,
+    }
+    print(f"encoder: {'orjson' if orjson is not None else 'stdlib json (orjson not installed)'}")
+    print(f"{'rows':>6}  " + "".join(f"{name:>26}" for name in paths) + "   speedup")
+    for size in sizes:
+        rows = make_rows(size)
+        content = rows[0] if size == 1 else rows
+        timings = [per_call(fn, content) for fn in paths.values()]
+        print(f"{size:>6}  " + "".join(f"{t:>24.1f}µs" for t in timings) + f"   {timings[0] / timings[-1]:6.1f}x")
+
+
+def bench_loading(rows, page):
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        db.add(User(username="benchborrower", password="x", email="b@example.com", phone_number="1234567890"))
+        db.flush()
+        db.execute(insert(Loan.__table__), make_rows(rows))
+        db.commit()
+
+    def orm_page():
+        with SessionLocal() as db:
+            loans = db.scalars(select(Loan).order_by(Loan.loan_id).limit(page)).all()
+            return JSONResponse(jsonable_encoder(loans)).body
+
+    def column_page():
+        with SessionLocal() as db:
+            result = db.execute(select(*main.LOAN_COLUMNS).order_by(Loan.loan_id).limit(page))
+            return FastJSONResponse([dict(row._mapping) for row in result]).body
+
+    orm = per_call(lambda _: orm_page(), None, 1.0)
+    columns = per_call(lambda _: column_page(), None, 1.0)
+    print(f"\nload + encode {page}-row page from SQLite")
+    print(f"  ORM objects + jsonable_encoder: {orm:10.1f}µs")
+    print(f"  column tuples + orjson:         {columns:10.1f}µs   ({orm / columns:.1f}x)")
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 100, 1000])
+    parser.add_argument("--page", type=int, default=100)
+    args = parser.parse_args()
+    bench_encoding(args.sizes)
+    bench_loading(max(args.page, 1000), args.page)
+
+
+if __name__ == "__main__":
+    main_()
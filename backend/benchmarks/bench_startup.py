@@ -0,0 +1,124 @@
+"""Cold-start cost: ``import main`` and lifespan startup to readiness.
+
+Each measurement runs in a fresh interpreter:
+
+* ``import main`` with DATABASE_URL pointing at a database that cannot be
+  opened, which also proves that importing never connects;
+* ``-X importtime`` for the slowest top-level imports;
+* the app's lifespan (connect, create_all, schema check, pool warm-up)
+  against a throwaway SQLite file, until /health/ready returns 200.
+
+Run from backend/:
+
+    python -m benchmarks.bench_startup --runs 5 --save startup.json
+    python -m benchmarks.bench_startup --baseline startup.json   # regression check
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+UNREACHABLE_DB = "sqlite:////nonexistent-dir/never-created.db"
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import main
+print(time.perf_counter() - start)
+"""
+
+READY_SCRIPT = """
+import asyncio, time
+start = time.perf_counter()
+import main
+import httpx
+
+async def ready():
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            response = await client.get("/health/ready")
+        assert response.status_code == 200, response.text
+        return time.perf_counter()
+
+print(asyncio.run(ready()) - start)
+"""
+
+
+def run_python(code, database_url, *flags):
+    env = dict(os.environ, DATABASE_URL=database_url, PYTHONDONTWRITEBYTECODE="1")
+    result = subprocess.run([sys.executable, *flags, "-c", code], cwd=BACKEND_DIR, env=env,
+                            capture_output=True, text=True, check=True)
+    return result
+
+
+def import_times(runs):
+    return [float(run_python(IMPORT_SCRIPT, UNREACHABLE_DB).stdout.split()[-1]) for _ in range(runs)]
+
+
+def ready_times(runs):
+    times = []
+    for _ in range(runs):
+        url = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "startup.db")
+        times.append(float(run_python(READY_SCRIPT, url).stdout.split()[-1]))
+    return times
+
+
+def slowest_imports(top):
+    """Modules imported directly by main, by cumulative import time. Lines
+    look like "import time: self [us] | cumulative | <indented name>", with
+    two more spaces of indent per nesting level."""
+    stderr = run_python("import main", UNREACHABLE_DB, "-X", "importtime").stderr
+    entries = []
+    for line in stderr.splitlines():
+        parts = line.split("|")
+        if len(parts) != 3 or not parts[1].strip().isdigit():
+            continue
+        name = parts[2].rstrip()
+        if len(name) - len(name.lstrip()) == 3:
+            entries.append((int(parts[1]), name.strip()))
+    return sorted(entries, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--save", help="write results to this JSON file")
+    parser.add_argument("--baseline", help="compare against results saved with --save")
+    parser.add_argument("--tolerance", type=float, default=1.3, help="allowed slowdown vs baseline")
+    args = parser.parse_args()
+
+    results = {
+        "import_s": statistics.median(import_times(args.runs)),
+        "ready_s": statistics.median(ready_times(args.runs)),
+    }
+    print(f"import main:                    {results['import_s'] * 1000:8.0f} ms  (median of {args.runs})")
+    print(f"import + startup until ready:   {results['ready_s'] * 1000:8.0f} ms")
+    print("\nslowest imports made by main (cumulative):")
+    for micros, name in slowest_imports(args.top):
+        print(f"  {micros / 1000:8.1f} ms  {name}")
+
+    failures = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        for key, value in results.items():
+            ratio = value / baseline[key]
+            print(f"{key}: x{ratio:.2f} vs baseline")
+            if ratio > args.tolerance:
+                failures.append(f"{key}: {value:.3f}s vs baseline {baseline[key]:.3f}s")
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(results, f, indent=2)
+    if failures:
+        print("\nFAILED:\n" + "\n".join(failures))
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
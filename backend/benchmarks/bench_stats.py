@@ -0,0 +1,128 @@
+"""Dashboard totals: aggregate tables vs a full scan, and the write cost.
+
+Seeds N loans over M lenders, then compares:
+
+* GET /stats, which sums the striped ``platform_stats`` rows;
+* the same totals computed with GROUP BY over ``loans`` and ``lenders``
+  (what reconcile does, and what a dashboard would do without aggregates);
+
+and the per-request cost of POST /loans/ with and without the aggregate
+upsert in the insert transaction. Finishes with a reconcile that must
+report no drift.
+
+Run from backend/:
+
+    python -m benchmarks.bench_stats --loans 1000000 --lenders 5000
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+from datetime import date
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+
+import httpx  # noqa: E402
+from sqlalchemy import insert  # noqa: E402
+
+import aggregates  # noqa: E402
+import main  # noqa: E402
+from database import SessionLocal, engine  # noqa: E402
+from models import Lender, Loan, LoanStatus, User  # noqa: E402
+
+SEED_CHUNK = 50_000
+
+
+def seed(loans, lenders):
+    rng = random.Random(7)
+    today = date.today()
+    statuses = [LoanStatus.pending, LoanStatus.approved, LoanStatus.paid, LoanStatus.rejected]
+    with SessionLocal() as db:
+        db.add(User(username="benchborrower", password="x", email="b@example.com", phone_number="1234567890"))
+        db.execute(insert(Lender.__table__), [
+            {"name": f"lender {i}", "email": f"lender{i}@example.com", "credit_score": 700,
+             "available_funds": 50_000.0, "registration_date": today}
+            for i in range(lenders)
+        ])
+        db.commit()
+    for start in range(0, loans, SEED_CHUNK):
+        with SessionLocal() as db:
+            db.execute(insert(Loan.__table__), [
+                {"borrower_id": 1, "lender_id": rng.randrange(lenders) + 1, "amount": float(rng.randrange(500, 50_000)),
+                 "interest_rate": 8.0, "term_months": 36, "purpose": "benchmark", "status": rng.choice(statuses),
+                 "creation_date": today}
+                for _ in range(min(SEED_CHUNK, loans - start))
+            ])
+            db.commit()
+
+
+def best_of(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+async def timed_async(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await fn()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def full_scan():
+    with engine.connect() as conn:
+        return aggregates.compute_platform(conn)
+
+
+async def run(args):
+    print(f"seeding {args.loans:,} loans over {args.lenders:,} lenders ...")
+    async with main.app.router.lifespan_context(main.app):
+        seed(args.loans, args.lenders)
+        with engine.begin() as conn:
+            aggregates.backfill(conn)
+
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            stats = await timed_async(lambda: client.get("/stats"), args.repeat)
+            scan = best_of(full_scan, max(args.repeat // 10, 1))
+            print(f"\nGET /stats (aggregate rows):  {stats * 1000:9.2f} ms")
+            print(f"GROUP BY over loans/lenders:  {scan * 1000:9.2f} ms   ({scan / stats:,.0f}x)")
+
+            loan = {"borrower_id": 1, "amount": 1000, "interest_rate": 8.5, "term_months": 12, "purpose": "bench"}
+            print(f"\nPOST /loans/ ({args.writes} sequential requests)")
+            for label, hook in (("without aggregates", None), ("with aggregates", aggregates.record_inserts_async)):
+                main.row_writer.on_insert = hook
+                start = time.perf_counter()
+                for _ in range(args.writes):
+                    await client.post("/loans/", json=loan)
+                print(f"  {label:<20} {(time.perf_counter() - start) / args.writes * 1000:8.2f} ms/request")
+
+            # The unhooked writes above are drift by construction; fix them, then check
+            await client.post("/stats/reconcile", params={"fix": "true"})
+            report = (await client.post("/stats/reconcile")).json()
+    print(f"\nreconcile after fix: {report['drifted']} drifted -> {'OK' if not report['drifted'] else 'FAILED'}")
+    if report["drifted"]:
+        raise SystemExit(1)
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--loans", type=int, default=200_000)
+    parser.add_argument("--lenders", type=int, default=2_000)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--writes", type=int, default=500)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main_()
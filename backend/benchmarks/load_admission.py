@@ -0,0 +1,195 @@
+"""Overload test for admission control (rate limits and load shedding).
+
+Starts uvicorn in a subprocess and drives it over HTTP with two clients:
+
+* a well-behaved integration sending cheap reads (single lenders, loan
+  pages) at a fixed rate, open loop, so a slow server can't slow it down;
+* a misbehaving one with many connections in a closed loop, creating users
+  (bcrypt), bulk-importing loans, running portfolio analytics and
+  flooding single-lender reads.
+
+Three runs, each against a fresh server: the well-behaved client alone,
+both clients with ADMISSION_CONTROL=0, then both with ADMISSION_CONTROL=1.
+The well-behaved client's p99 should stay close to the baseline in the
+last run, while the misbehaving one gets 429/503.
+
+Run from backend/:
+
+    python -m benchmarks.load_admission --duration 20 --rate 40 --noisy 64
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import asyncio
+import collections
+import itertools
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LENDERS = 50
+LOANS = 20_000
+PASSWORD = "Noisy-Pass-123"
+BULK_BATCH = "".join(
+    '{"borrower_id": 1, "amount": 5000, "interest_rate": 9.5, "term_months": 24, "purpose": "noise"}\n'
+    for _ in range(500)
+)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, admission, database_url):
+    env = dict(os.environ, DATABASE_URL=database_url, ADMISSION_CONTROL="1" if admission else "0",
+               RATE_LIMIT_API_KEYS="seed,steady,noisy")
+    env.setdefault("BCRYPT_ROUNDS", "10")
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning",
+         "--no-access-log"],
+        cwd=BACKEND_DIR, env=env,
+    )
+
+
+async def wait_ready(base_url, timeout=60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            try:
+                if (await client.get("/health/ready")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+
+async def seed(base_url):
+    async with httpx.AsyncClient(base_url=base_url, headers={"X-API-Key": "seed"}, timeout=120) as client:
+        await client.post("/users/", json={"username": "borrower", "password": PASSWORD,
+                                           "email": "borrower@example.com", "phone_number": "1234567890"})
+        for i in range(LENDERS):
+            await client.post("/lenders/", json={"name": f"Lender {i}", "email": f"lender{i}@example.com",
+                                                 "credit_score": 700, "available_funds": 50_000})
+        rows = "".join(
+            f'{{"borrower_id": 1, "lender_id": {i % LENDERS + 1}, "amount": {1000 + i % 9000}, '
+            f'"interest_rate": 7.5, "term_months": 36, "purpose": "seed"}}\n'
+            for i in range(LOANS)
+        )
+        response = await client.post("/loans/bulk", content=rows, headers={"Content-Type": "application/x-ndjson"})
+        response.raise_for_status()
+
+
+async def steady_client(base_url, rate, duration, latencies, statuses):
+    """Cheap reads at a fixed rate; latency is measured from the scheduled
+    send time, so time spent queued behind a slow server counts."""
+    paths = itertools.cycle([f"/lenders/{i % LENDERS + 1}" if i % 2 else "/loans/?limit=20" for i in range(200)])
+    limits = httpx.Limits(max_connections=1000, max_keepalive_connections=100)
+    async with httpx.AsyncClient(base_url=base_url, headers={"X-API-Key": "steady"}, limits=limits,
+                                 timeout=60) as client:
+
+        async def one(path, scheduled):
+            try:
+                response = await client.get(path)
+                statuses[response.status_code] += 1
+            except httpx.HTTPError:
+                statuses["error"] += 1
+            latencies.append(time.perf_counter() - scheduled)
+
+        tasks = []
+        start = time.perf_counter()
+        for n in itertools.count():
+            scheduled = start + n / rate
+            if scheduled - start >= duration:
+                break
+            await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+            tasks.append(asyncio.ensure_future(one(next(paths), scheduled)))
+        await asyncio.gather(*tasks)
+
+
+async def noisy_client(base_url, connections, duration, statuses):
+    counter = itertools.count()
+    deadline = time.perf_counter() + duration
+    limits = httpx.Limits(max_connections=connections)
+    async with httpx.AsyncClient(base_url=base_url, headers={"X-API-Key": "noisy"}, limits=limits,
+                                 timeout=60) as client:
+
+        async def worker():
+            while time.perf_counter() < deadline:
+                n = next(counter)
+                try:
+                    if n % 4 == 0:
+                        response = await client.post("/users/", json={
+                            "username": f"noisy{n}", "password": PASSWORD, "email": f"noisy{n}@example.com",
+                            "phone_number": "1234567890"})
+                    elif n % 4 == 1:
+                        response = await client.post("/loans/bulk", content=BULK_BATCH,
+                                                     headers={"Content-Type": "application/x-ndjson"})
+                    elif n % 4 == 2:
+                        response = await client.get("/analytics/portfolio")
+                    else:
+                        response = await client.get(f"/lenders/{n % LENDERS + 1}")
+                    statuses[response.status_code] += 1
+                    if response.status_code in (429, 503):
+                        # Ignores Retry-After, like a misbehaving client, and
+                        # retries after a short fixed pause
+                        await asyncio.sleep(0.05)
+                except httpx.HTTPError:
+                    statuses["error"] += 1
+
+        await asyncio.gather(*(worker() for _ in range(connections)))
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * q))] * 1000 if values else float("nan")
+
+
+async def run(label, admission, noisy, args):
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    database_url = os.environ.get("DATABASE_URL") or "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+    server = start_server(port, admission, database_url)
+    try:
+        await wait_ready(base_url)
+        await seed(base_url)
+        latencies, steady, noisy_statuses = [], collections.Counter(), collections.Counter()
+        jobs = [steady_client(base_url, args.rate, args.duration, latencies, steady)]
+        if noisy:
+            jobs.append(noisy_client(base_url, args.noisy, args.duration, noisy_statuses))
+        await asyncio.gather(*jobs)
+    finally:
+        server.terminate()
+        server.wait()
+
+    print(f"{label:<24} p50 {percentile(latencies, 0.5):7.1f}  p99 {percentile(latencies, 0.99):7.1f}  "
+          f"max {percentile(latencies, 1.0):7.1f} ms  steady {dict(steady)}  noisy {dict(noisy_statuses)}")
+    return percentile(latencies, 0.99)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--rate", type=float, default=40.0, help="steady client requests/s")
+    parser.add_argument("--noisy", type=int, default=64, help="misbehaving client connections")
+    args = parser.parse_args()
+
+    print(f"steady client: {args.rate:g} req/s of cheap reads for {args.duration:g}s; "
+          f"noisy client: {args.noisy} connections\n")
+    baseline = asyncio.run(run("baseline (no noise)", True, False, args))
+    unprotected = asyncio.run(run("overload, admission off", False, True, args))
+    protected = asyncio.run(run("overload, admission on", True, True, args))
+    print(f"\nsteady p99 vs baseline: {unprotected / baseline:.1f}x without admission control, "
+          f"{protected / baseline:.1f}x with it")
+
+
+if __name__ == "__main__":
+    main()
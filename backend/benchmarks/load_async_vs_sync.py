@@ -0,0 +1,145 @@
+"""Load test: async routes (main:app) against the old sync-route style.
+
+Both servers run under uvicorn in their own process against the same
+database and are hit with the same GET /users/{id} mix at high concurrency.
+main:app runs with the entity cache off (ENTITY_CACHE_SIZE=0), so both
+sides read every user from the database.
+Run from backend/:
+
+    python -m benchmarks.load_async_vs_sync --concurrency 1000 --requests 50000
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file. Numbers are
+only meaningful against PostgreSQL; SQLite serialises on its file lock.
+"""
+import argparse
+import asyncio
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+
+import httpx  # noqa: E402
+from fastapi import Depends, FastAPI, HTTPException  # noqa: E402
+from sqlalchemy.orm import Session  # noqa: E402
+
+from database import Base, SessionLocal, engine, get_db  # noqa: E402
+from models import User  # noqa: E402
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The pre-async route, served from Starlette's threadpool
+sync_app = FastAPI()
+
+
+@sync_app.get("/users/{user_id}")
+def get_user(user_id: int, db: Session = Depends(get_db)):
+    db_user = db.query(User).filter(User.user_id == user_id).first()
+    if db_user is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return db_user
+
+
+@sync_app.get("/health")
+def health_check():
+    return {"status": "healthy"}
+
+
+def seed_users(count):
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        existing = db.query(User).count()
+        db.add_all(
+            User(username=f"loaduser{i:07d}", password="x", email=f"load{i}@example.com",
+                 phone_number="1234567890")
+            for i in range(existing, count)
+        )
+        db.commit()
+
+
+def start_server(app_path, port):
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", app_path, "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=dict(os.environ, ENTITY_CACHE_SIZE="0", ENTITY_CACHE_URL=""),
+    )
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{port}/health").status_code == 200:
+                return proc
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    proc.kill()
+    raise RuntimeError(f"{app_path} did not start")
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def hammer(base_url, total, concurrency, user_count):
+    latencies = []
+    errors = 0
+    remaining = total
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60) as client:
+        async def worker():
+            nonlocal remaining, errors
+            rng = random.Random()
+            while remaining > 0:
+                remaining -= 1
+                start = time.perf_counter()
+                try:
+                    response = await client.get(f"/users/{rng.randint(1, user_count)}")
+                    if response.status_code != 200:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "rps": total / elapsed,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "errors": errors,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, default=1000)
+    parser.add_argument("--requests", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    seed_users(args.users)
+    targets = [("async", "main:app", 8101), ("sync", "benchmarks.load_async_vs_sync:sync_app", 8102)]
+    print(f"{'mode':6} {'req/s':>10} {'p50 ms':>10} {'p99 ms':>10} {'errors':>8}")
+    for name, app_path, port in targets:
+        proc = start_server(app_path, port)
+        try:
+            # Warm up connections and pools before measuring
+            asyncio.run(hammer(f"http://127.0.0.1:{port}", min(args.requests, 2000), 50, args.users))
+            result = asyncio.run(hammer(f"http://127.0.0.1:{port}", args.requests, args.concurrency, args.users))
+        finally:
+            proc.terminate()
+            proc.wait()
+        print(f"{name:6} {result['rps']:10.0f} {result['p50_ms']:10.1f} {result['p99_ms']:10.1f} "
+              f"{result['errors']:8d}")
+
+
+if __name__ == "__main__":
+    main()
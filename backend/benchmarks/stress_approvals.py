@@ -0,0 +1,104 @@
+"""Fire thousands of concurrent approvals at a single lender.
+
+Seeds one lender and more pending loans than its funds can cover, then
+sends every PUT /loans/{id}/approve at once through the ASGI app. Checks
+that the lender never goes negative and that funds + approved amounts add
+up to the starting balance, and reports approvals per second.
+
+Run from backend/:
+
+    python -m benchmarks.stress_approvals --loans 5000
+    APPROVAL_BATCH_WINDOW_MS=0 python -m benchmarks.stress_approvals   # unbatched
+
+Uses DATABASE_URL when set, otherwise a throwaway SQLite file.
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "bench.db")
+
+import httpx  # noqa: E402
+from sqlalchemy import func, insert, select  # noqa: E402
+
+import main  # noqa: E402
+from database import Base, SessionLocal, engine  # noqa: E402
+from models import Lender, Loan, LoanFunding, LoanStatus, User  # noqa: E402
+
+
+def seed(loan_count, coverage):
+    rng = random.Random(3)
+    amounts = [round(rng.uniform(100, 5000), 2) for _ in range(loan_count)]
+    funds = round(sum(amounts) * coverage, 2)
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        borrower = User(username="stressborrower", password="x", email="stress@example.com",
+                        phone_number="1234567890")
+        lender = Lender(name="Stress Lender", email="stress-lender@example.com", credit_score=800,
+                        available_funds=funds)
+        db.add_all([borrower, lender])
+        db.flush()
+        first_id = (db.scalar(select(func.max(Loan.loan_id))) or 0) + 1
+        db.execute(insert(Loan.__table__), [
+            {"loan_id": first_id + i, "borrower_id": borrower.user_id, "lender_id": lender.lender_id,
+             "amount": amount, "interest_rate": 10.0, "term_months": 12, "purpose": "stress",
+             "status": LoanStatus.pending}
+            for i, amount in enumerate(amounts)
+        ])
+        db.commit()
+        return lender.lender_id, funds, list(range(first_id, first_id + loan_count))
+
+
+async def fire(loan_ids):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://stress") as client:
+        start = time.perf_counter()
+        responses = await asyncio.gather(*(client.put(f"/loans/{loan_id}/approve") for loan_id in loan_ids))
+        elapsed = time.perf_counter() - start
+    return responses, elapsed
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--loans", type=int, default=3000)
+    parser.add_argument("--coverage", type=float, default=0.6,
+                        help="lender funds as a fraction of the total requested")
+    args = parser.parse_args()
+
+    lender_id, initial_funds, loan_ids = seed(args.loans, args.coverage)
+    responses, elapsed = asyncio.run(fire(loan_ids))
+
+    codes = {}
+    for response in responses:
+        codes[response.status_code] = codes.get(response.status_code, 0) + 1
+    with SessionLocal() as db:
+        funds = db.scalar(select(Lender.available_funds).where(Lender.lender_id == lender_id))
+        approved_total = db.scalar(
+            select(func.coalesce(func.sum(Loan.amount), 0.0))
+            .where(Loan.lender_id == lender_id, Loan.status == LoanStatus.approved)
+        )
+        funded_total = db.scalar(
+            select(func.coalesce(func.sum(LoanFunding.amount), 0.0)).where(LoanFunding.lender_id == lender_id)
+        )
+
+    approved = codes.get(200, 0)
+    print(f"requests:        {len(loan_ids)} in {elapsed:.2f}s")
+    print(f"status codes:    {codes}")
+    print(f"approvals/s:     {approved / elapsed:,.0f}  (requests/s {len(loan_ids) / elapsed:,.0f})")
+    print(f"batcher:         {main.approval_batcher.stats()}")
+    print(f"initial funds:   {initial_funds:,.2f}")
+    print(f"approved total:  {approved_total:,.2f}  (fundings {funded_total:,.2f})")
+    print(f"final funds:     {funds:,.2f}")
+    balanced = abs(initial_funds - approved_total - funds) < 0.01 * max(1, len(loan_ids))
+    ok = funds >= 0 and balanced and abs(approved_total - funded_total) < 0.01
+    print("OK: no overdraft, ledger balances" if ok else "FAILED: funds do not reconcile")
+    if not ok:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main_()
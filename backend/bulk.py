@@ -0,0 +1,209 @@
+import csv
+import io
+import json
+import os
+
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from pydantic import ValidationError
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError
+
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "5000"))
+BULK_MAX_ERRORS = int(os.getenv("BULK_MAX_ERRORS", "1000"))
+
+CSV_TYPES = ("text/csv", "application/csv")
+NDJSON_TYPES = ("application/x-ndjson", "application/ndjson", "application/jsonl")
+
+
+async def iter_lines(request):
+    # Yield complete lines (undecoded) from the streamed body without
+    # buffering all of it
+    pending = b""
+    async for chunk in request.stream():
+        pending += chunk
+        *lines, pending = pending.split(b"\n")
+        for line in lines:
+            yield line.rstrip(b"\r")
+    if pending:
+        yield pending.rstrip(b"\r")
+
+
+async def iter_records(request):
+    """Yield ``(row_number, record)`` from a CSV (header row first) or NDJSON
+    body. Unparseable rows yield an error string instead of a dict. CSV
+    fields may not contain embedded newlines; empty ones are left out, so
+    the schema's default applies."""
+    content_type = request.headers.get("content-type", "").split(";")[0].strip()
+    if content_type not in CSV_TYPES + NDJSON_TYPES:
+        raise HTTPException(status_code=415, detail="Body must be text/csv or application/x-ndjson")
+
+    header = None
+    row_number = 0
+    async for raw in iter_lines(request):
+        if not raw.strip():
+            continue
+        try:
+            line = raw.decode("utf-8")
+        except UnicodeDecodeError as e:
+            if content_type in CSV_TYPES and header is None:
+                raise HTTPException(status_code=400, detail=f"CSV header is not valid UTF-8: {e}")
+            row_number += 1
+            yield row_number, f"Invalid UTF-8: {e}"
+            continue
+        if content_type in CSV_TYPES:
+            values = next(csv.reader([line]))
+            if header is None:
+                header = [name.strip() for name in values]
+                continue
+            row_number += 1
+            if len(values) != len(header):
+                yield row_number, f"Expected {len(header)} fields, got {len(values)}"
+            else:
+                yield row_number, {name: value for name, value in zip(header, values) if value.strip()}
+        else:
+            row_number += 1
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield row_number, f"Invalid JSON: {e}"
+                continue
+            if isinstance(record, dict):
+                yield row_number, record
+            else:
+                yield row_number, "Each line must be a JSON object"
+
+
+def _format_validation_error(error):
+    return "; ".join(
+        f"{'.'.join(str(part) for part in err['loc'])}: {err['msg']}" for err in error.errors()
+    )
+
+
+class BulkReport:
+    def __init__(self):
+        self.received = 0
+        self.inserted = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, row_number, message):
+        self.failed += 1
+        if len(self.errors) < BULK_MAX_ERRORS:
+            self.errors.append({"row": row_number, "error": message})
+
+    def as_dict(self):
+        return {
+            "received": self.received,
+            "inserted": self.inserted,
+            "failed": self.failed,
+            "errors": sorted(self.errors, key=lambda e: e["row"]),
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+def _copy_rows(db, table, rows):
+    # PostgreSQL COPY ... FROM STDIN: one round trip for the whole chunk
+    columns = list(rows[0].keys())
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in rows:
+        writer.writerow([r"\N" if row[c] is None else getattr(row[c], "value", row[c]) for c in columns])
+    buffer.seek(0)
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(
+            f"COPY {table.name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')",
+            buffer,
+        )
+    finally:
+        cursor.close()
+
+
+def insert_rows(db, table, rows):
+    """Insert a chunk of complete row dicts: COPY on PostgreSQL, a batched
+    executemany INSERT everywhere else."""
+    if db.get_bind().dialect.name == "postgresql":
+        _copy_rows(db, table, rows)
+    else:
+        db.execute(insert(table), rows)
+
+
+def write_chunk(session_factory, table, chunk, report, on_insert=None):
+    """Insert one validated chunk in a single transaction. If the chunk is
+    rejected by the database, retry it row by row under savepoints so only
+    the offending rows are reported. ``on_insert(db, table, rows)`` runs in
+    the same transaction with the rows that were inserted."""
+    if not chunk:
+        return
+    rows = [row for _, row in chunk]
+    with session_factory() as db:
+        try:
+            insert_rows(db, table, rows)
+            if on_insert is not None:
+                on_insert(db, table, rows)
+            db.commit()
+            report.inserted += len(rows)
+            return
+        except DBAPIError:
+            db.rollback()
+
+        inserted = []
+        for row_number, row in chunk:
+            try:
+                with db.begin_nested():
+                    db.execute(insert(table), [row])
+                inserted.append(row)
+            except DBAPIError as e:
+                report.add_error(row_number, str(e.orig))
+        if inserted and on_insert is not None:
+            on_insert(db, table, inserted)
+        db.commit()
+        report.inserted += len(inserted)
+
+
+def validate_record(schema, record, check=None, defaults=None):
+    item = schema(**record)
+    if check is not None:
+        check(item)
+    row = item.dict()
+    if defaults:
+        for key, value in defaults.items():
+            row.setdefault(key, value)
+    return row
+
+
+def validate_chunk(schema, records, report, check=None, defaults=None):
+    chunk = []
+    for row_number, record in records:
+        if isinstance(record, str):
+            report.add_error(row_number, record)
+            continue
+        try:
+            chunk.append((row_number, validate_record(schema, record, check, defaults)))
+        except ValidationError as e:
+            report.add_error(row_number, _format_validation_error(e))
+        except (ValueError, TypeError) as e:
+            report.add_error(row_number, str(e))
+    return chunk
+
+
+async def bulk_import(request, session_factory, schema, table, check=None, defaults=None,
+                      chunk_size=BULK_CHUNK_SIZE, on_insert=None):
+    """Validate and insert a streamed CSV/NDJSON body in chunks of
+    ``chunk_size`` rows, committing once per chunk."""
+    report = BulkReport()
+    records = []
+
+    def flush(batch):
+        write_chunk(session_factory, table, validate_chunk(schema, batch, report, check, defaults), report, on_insert)
+
+    async for row_number, record in iter_records(request):
+        report.received += 1
+        records.append((row_number, record))
+        if len(records) >= chunk_size:
+            await run_in_threadpool(flush, records)
+            records = []
+    if records:
+        await run_in_threadpool(flush, records)
+    return report.as_dict()
@@ -0,0 +1,152 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict
+
+from serialization import dumps, loads
+
+# Entity cache settings; a size of 0 (and no URL) turns the cache off
+ENTITY_CACHE_SIZE = int(os.getenv("ENTITY_CACHE_SIZE", "10000"))
+ENTITY_CACHE_TTL = float(os.getenv("ENTITY_CACHE_TTL", "30"))
+# e.g. redis://redis:6379/0 to share the cache between workers
+ENTITY_CACHE_URL = os.getenv("ENTITY_CACHE_URL", "")
+
+_MISSING = object()
+
+
+class LRUCache:
+    """In-process LRU with a per-entry TTL. Bounded by ``max_entries``;
+    expired entries are dropped lazily on access or eviction."""
+
+    def __init__(self, max_entries=ENTITY_CACHE_SIZE, ttl=ENTITY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    async def get(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return _MISSING
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._data[key]
+            return _MISSING
+        self._data.move_to_end(key)
+        return value
+
+    async def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    async def delete(self, key):
+        self._data.pop(key, None)
+
+
+class RedisCache:
+    """Shared cache backend; values are stored as JSON with a TTL."""
+
+    def __init__(self, url, ttl=ENTITY_CACHE_TTL, prefix="entity:"):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("ENTITY_CACHE_URL is set but the redis package (>= 4.2) is not installed")
+
+        self._client = redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def __len__(self):
+        return 0
+
+    async def get(self, key):
+        raw = await self._client.get(self.prefix + key)
+        return _MISSING if raw is None else loads(raw)
+
+    async def set(self, key, value):
+        await self._client.set(self.prefix + key, dumps(value), ex=int(self.ttl))
+
+    async def delete(self, key):
+        await self._client.delete(self.prefix + key)
+
+
+class EntityCache:
+    """Read-through cache for single-entity lookups.
+
+    Concurrent misses on the same key share one loader task (single-flight),
+    so a hot record that expires costs one query, not one per request.
+    ``None`` results (not found) are never cached. With no backend every
+    lookup runs its loader.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.invalidations = 0
+        self._inflight = {}
+
+    @staticmethod
+    def key(kind, entity_id):
+        return f"{kind}:{entity_id}"
+
+    async def get_or_load(self, kind, entity_id, loader):
+        if self.backend is None:
+            return await loader()
+        key = self.key(kind, entity_id)
+        value = await self.backend.get(key)
+        if value is not _MISSING:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        task = self._inflight.get(key)
+        if task is not None:
+            self.coalesced += 1
+        else:
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._inflight[key] = task
+        # shield: a cancelled caller must not cancel the load for the others
+        return await asyncio.shield(task)
+
+    async def _load(self, key, loader):
+        task = asyncio.current_task()
+        try:
+            value = await loader()
+            # Skip caching if the key was invalidated while we were loading
+            if value is not None and self._inflight.get(key) is task:
+                await self.backend.set(key, value)
+            return value
+        finally:
+            if self._inflight.get(key) is task:
+                del self._inflight[key]
+
+    async def invalidate(self, kind, entity_id):
+        key = self.key(kind, entity_id)
+        self.invalidations += 1
+        self._inflight.pop(key, None)
+        if self.backend is not None:
+            await self.backend.delete(key)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "backend": type(self.backend).__name__ if self.backend is not None else "none",
+            "entries": len(self.backend) if self.backend is not None else 0,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "invalidations": self.invalidations,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+def create_entity_cache():
+    if ENTITY_CACHE_URL:
+        return EntityCache(RedisCache(ENTITY_CACHE_URL))
+    return EntityCache(LRUCache() if ENTITY_CACHE_SIZE > 0 else None)
@@ -0,0 +1,201 @@
+import asyncio
+import os
+import random
+
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+DATABASE_URL = os.getenv("DATABASE_URL", "postgresql://postgres:postgres@db:5432/lending")
+
+# Connection pool settings (ignored for SQLite, which manages its own pool)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "20"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+# asyncpg prepared statement cache per connection; set to 0 behind pgbouncer
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+
+# Startup: connection attempts with exponential backoff, then pool warm-up
+DB_CONNECT_ATTEMPTS = int(os.getenv("DB_CONNECT_ATTEMPTS", "8"))
+DB_CONNECT_BACKOFF = float(os.getenv("DB_CONNECT_BACKOFF", "0.5"))
+DB_CONNECT_MAX_BACKOFF = float(os.getenv("DB_CONNECT_MAX_BACKOFF", "10"))
+DB_POOL_WARMUP = int(os.getenv("DB_POOL_WARMUP", "5"))
+
+# Columns added to tables that existed before them, as (table, column, DDL
+# type and default). create_all never alters an existing table, so startup
+# adds these (see add_missing_columns).
+ADDED_COLUMNS = (
+    ("lenders", "min_interest_rate", "FLOAT DEFAULT 0"),
+)
+
+
+def is_sqlite(url):
+    return url.startswith("sqlite")
+
+
+def to_sync_url(url):
+    # Pin psycopg2: bulk imports use its COPY support, and SQLAlchemy 2.1
+    # maps a bare postgresql:// URL to psycopg 3
+    scheme, rest = url.split("://", 1)
+    if scheme in ("postgresql", "postgres"):
+        return f"postgresql+psycopg2://{rest}"
+    return url
+
+
+def to_async_url(url):
+    scheme, rest = url.split("://", 1)
+    if scheme in ("postgresql", "postgres", "postgresql+psycopg2"):
+        return f"postgresql+asyncpg://{rest}"
+    if scheme == "sqlite":
+        return f"sqlite+aiosqlite://{rest}"
+    return url
+
+
+def pool_options(url):
+    if is_sqlite(url):
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+
+# Engines are created lazily: nothing connects until the app's lifespan
+# (or a job) first uses them
+def create_db_engine():
+    connect_args = {"check_same_thread": False} if is_sqlite(DATABASE_URL) else {}
+    return create_engine(to_sync_url(DATABASE_URL), connect_args=connect_args, **pool_options(DATABASE_URL))
+
+
+def create_async_db_engine():
+    url = to_async_url(DATABASE_URL)
+    connect_args = {}
+    if url.startswith("postgresql+asyncpg"):
+        connect_args["prepared_statement_cache_size"] = DB_STATEMENT_CACHE_SIZE
+    return create_async_engine(url, connect_args=connect_args, **pool_options(url))
+
+
+# The sync engine serves bulk COPY imports and offline jobs; request
+# handlers use the async engine.
+engine = create_db_engine()
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+async_engine = create_async_db_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False,
+                                       expire_on_commit=False)
+
+Base = declarative_base()
+
+
+async def wait_for_database(engine, attempts=DB_CONNECT_ATTEMPTS, backoff=DB_CONNECT_BACKOFF,
+                            max_backoff=DB_CONNECT_MAX_BACKOFF):
+    """Run ``SELECT 1`` until it succeeds, sleeping with exponential backoff
+    (and jitter, so restarted workers don't reconnect in lockstep)."""
+    for attempt in range(1, attempts + 1):
+        try:
+            async with engine.connect() as conn:
+                await conn.execute(text("SELECT 1"))
+            return attempt
+        except (DBAPIError, OSError) as e:
+            if attempt == attempts:
+                raise
+            delay = min(max_backoff, backoff * 2 ** (attempt - 1))
+            delay = random.uniform(delay / 2, delay)
+            print(f"Database connection failed ({type(e).__name__}), retrying in {delay:.1f}s "
+                  f"({attempts - attempt} attempts left)")
+            await asyncio.sleep(delay)
+
+
+async def warm_pool(engine, connections=DB_POOL_WARMUP):
+    """Open ``connections`` pooled connections up front so the first requests
+    after boot don't each pay for a connection handshake."""
+    size = getattr(engine.pool, "size", None)
+    if size is not None:
+        connections = min(connections, size())
+    opened = await asyncio.gather(*(engine.connect() for _ in range(connections)))
+    for conn in opened:
+        await conn.close()
+    return len(opened)
+
+
+def add_missing_columns(connection, columns=ADDED_COLUMNS):
+    """Run ``ALTER TABLE ... ADD COLUMN`` for each of ``columns`` the database
+    lacks. Returns the ``table.column`` names added; safe to rerun."""
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    # Workers starting together may race; PostgreSQL can skip an existing column
+    if_not_exists = "IF NOT EXISTS " if connection.dialect.name == "postgresql" else ""
+    added = []
+    for table, column, ddl in columns:
+        if table not in tables or column in {c["name"] for c in inspector.get_columns(table)}:
+            continue
+        connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {if_not_exists}{column} {ddl}"))
+        added.append(f"{table}.{column}")
+    return added
+
+
+def _missing_columns(inspector, table):
+    present = {column["name"] for column in inspector.get_columns(table.name)}
+    return [f"{table.name}.{column.name}" for column in table.columns if column.name not in present]
+
+
+def missing_columns(connection, metadata):
+    """Columns of existing tables that the database lacks. Queries on those
+    tables fail, unlike with a missing index, so readiness checks this."""
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    return [name for table in metadata.sorted_tables if table.name in tables
+            for name in _missing_columns(inspector, table)]
+
+
+def missing_schema(connection, metadata):
+    """Tables, columns and indexes declared on the models but absent from
+    the database. ``create_all`` adds missing tables, but never columns or
+    indexes on tables that already exist."""
+    inspector = inspect(connection)
+    tables = set(inspector.get_table_names())
+    missing = []
+    for table in metadata.sorted_tables:
+        if table.name not in tables:
+            missing.append(table.name)
+            continue
+        missing.extend(_missing_columns(inspector, table))
+        present = {index["name"] for index in inspector.get_indexes(table.name)}
+        missing.extend(f"{table.name}.{index.name}" for index in table.indexes if index.name not in present)
+    return missing
+
+
+def pool_status(engine):
+    """Pool occupancy; ``saturated`` means a new checkout would have to wait."""
+    pool = engine.pool
+    if not hasattr(pool, "size"):
+        return {"saturated": False}
+    status = {
+        "size": pool.size(),
+        "checked_out": pool.checkedout(),
+        "overflow": pool.overflow(),
+        "max_overflow": pool._max_overflow,
+    }
+    # max_overflow -1 means unbounded
+    status["saturated"] = 0 <= status["max_overflow"] <= status["checked_out"] - status["size"]
+    return status
+
+
+# Dependencies
+def get_db():
+    db = SessionLocal()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
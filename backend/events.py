@@ -0,0 +1,312 @@
+"""Change events for live dashboards, served as Server-Sent Events.
+
+Routes publish an event after each committed mutation. The ``EventBroker``
+does three things with it:
+- numbers it;
+- keeps it in a ring buffer of the last ``EVENTS_BUFFER`` events;
+- hands it to every subscriber whose topics match.
+
+A subscriber is a bounded deque plus an ``asyncio.Event``, so an idle
+connection costs one parked coroutine. A single broker task nudges idle
+streams to send a keepalive comment every ``EVENTS_KEEPALIVE`` seconds.
+
+Clients resume with ``Last-Event-ID``, and missed events are replayed from
+the buffer. The client is told to ``reset`` (refetch what it shows) when:
+- the events it missed have already left the buffer;
+- its id comes from another worker or an earlier process.
+
+A subscriber more than ``EVENTS_QUEUE_SIZE`` events behind (a slow or
+stalled client whose sends are blocked) stops receiving events and its
+response is ended, instead of buffering without bound. EventSource
+reconnects by itself and catches up from the ring buffer, at its own pace.
+
+Open streams would keep the server from shutting down: uvicorn waits for
+connections to finish before it runs the lifespan shutdown. So
+``close_on_exit_signals`` chains onto the server's SIGINT/SIGTERM handlers
+and closes the broker as soon as the server starts exiting. The streams
+end, and clients reconnect to the next server with ``Last-Event-ID``.
+Run uvicorn with ``--timeout-graceful-shutdown`` as a backstop for
+streams stuck in a blocked send, or when it runs off the main thread
+(no signal handlers).
+
+With ``EVENTS_FANOUT=postgres``, each event is also sent with NOTIFY, and
+every worker LISTENs and republishes what the others send. Subscribers then
+see changes made through any worker.
+"""
+import asyncio
+import json
+import os
+import signal
+import threading
+import uuid
+from collections import deque
+
+from serialization import dumps
+
+EVENTS_BUFFER = int(os.getenv("EVENTS_BUFFER", "10000"))
+EVENTS_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "1000"))
+EVENTS_MAX_SUBSCRIBERS = int(os.getenv("EVENTS_MAX_SUBSCRIBERS", "10000"))
+EVENTS_KEEPALIVE = float(os.getenv("EVENTS_KEEPALIVE", "15"))
+EVENTS_FANOUT = os.getenv("EVENTS_FANOUT", "none")
+EVENTS_CHANNEL = os.getenv("EVENTS_CHANNEL", "lending_events")
+# NOTIFY payloads are limited to 8000 bytes
+MAX_NOTIFY_BYTES = 7900
+KEEPALIVE = b": keepalive\n\n"
+
+
+def format_event(event_id, name, data):
+    return b"id: " + event_id.encode() + b"\nevent: " + name.encode() + b"\ndata: " + data + b"\n\n"
+
+
+class Subscriber:
+    def __init__(self, topics, max_queue):
+        self.topics = topics
+        self.queue = deque()
+        self.max_queue = max_queue
+        self.wakeup = asyncio.Event()
+        self.overflowed = False
+        self.keepalive_due = False
+
+    def wants(self, topic):
+        return self.topics is None or topic in self.topics
+
+    def push(self, message):
+        """Queue ``message``; False once the subscriber is too far behind."""
+        if len(self.queue) >= self.max_queue:
+            self.overflowed = True
+            self.queue.clear()
+        else:
+            self.queue.append(message)
+        self.wakeup.set()
+        return not self.overflowed
+
+
+class EventBroker:
+    def __init__(self, buffer_size=EVENTS_BUFFER, max_queue=EVENTS_QUEUE_SIZE,
+                 max_subscribers=EVENTS_MAX_SUBSCRIBERS):
+        # Event ids are "<epoch>-<seq>"; the epoch tells ids from this
+        # process apart from another worker's or a previous run's
+        self.epoch = uuid.uuid4().hex[:12]
+        self.seq = 0
+        self.buffer = deque(maxlen=buffer_size)
+        self.max_queue = max_queue
+        self.max_subscribers = max_subscribers
+        self.subscribers = set()
+        self.fanout = None
+        self.keepalive = EVENTS_KEEPALIVE
+        self._ticker = None
+        self.closed = False
+        self.published = 0
+        self.received = 0
+        self.overflows = 0
+
+    def publish(self, topic, name, data, forward=True):
+        """Publish ``<topic>.<name>`` with JSON-serializable ``data``."""
+        self.seq += 1
+        event_name = f"{topic}.{name}"
+        message = format_event(f"{self.epoch}-{self.seq}", event_name, dumps(data))
+        self.buffer.append((self.seq, topic, message))
+        lagging = [subscriber for subscriber in self.subscribers
+                   if subscriber.wants(topic) and not subscriber.push(message)]
+        for subscriber in lagging:
+            # Its stream may be stuck in a blocked send: stop feeding it now,
+            # it ends the response the next time it runs
+            self.subscribers.discard(subscriber)
+            self.overflows += 1
+        self.published += 1
+        if forward and self.fanout is not None:
+            self.fanout.forward(topic, name, data)
+
+    def accepting(self):
+        return not self.closed and len(self.subscribers) < self.max_subscribers
+
+    def subscribe(self, topics=None, last_event_id=None):
+        """Register a subscriber. Returns it with the buffered messages it
+        missed, or None in place of the list when the client must reset."""
+        subscriber = Subscriber(topics, self.max_queue)
+        self.subscribers.add(subscriber)
+        if self._ticker is None or self._ticker.done():
+            self._ticker = asyncio.ensure_future(self._tick())
+        return subscriber, self._missed(subscriber, last_event_id)
+
+    def _missed(self, subscriber, last_event_id):
+        if not last_event_id:
+            return []
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch != self.epoch or not seq.isdigit() or int(seq) > self.seq:
+            return None
+        seq = int(seq)
+        oldest = self.buffer[0][0] if self.buffer else self.seq + 1
+        if seq < oldest - 1:
+            return None
+        return [message for event_seq, topic, message in self.buffer if event_seq > seq and subscriber.wants(topic)]
+
+    def unsubscribe(self, subscriber):
+        self.subscribers.discard(subscriber)
+
+    async def _tick(self):
+        # One timer for all streams instead of a wait_for per wakeup
+        while self.subscribers and not self.closed:
+            await asyncio.sleep(self.keepalive)
+            for subscriber in self.subscribers:
+                if not subscriber.queue:
+                    subscriber.keepalive_due = True
+                    subscriber.wakeup.set()
+
+    async def stream(self, topics=None, last_event_id=None):
+        """SSE body: the replay (or a reset), then live events, batched into
+        one chunk per wakeup. Subscribes on first iteration, so a response
+        that is never sent leaves nothing registered."""
+        subscriber, missed = self.subscribe(topics, last_event_id)
+        try:
+            # Tell EventSource how long to wait before reconnecting
+            yield b"retry: 2000\n\n"
+            if missed is None:
+                yield format_event(f"{self.epoch}-{self.seq}", "reset", b'{"reason":"events missed"}')
+            elif missed:
+                yield b"".join(missed)
+            while not self.closed:
+                if not subscriber.queue:
+                    subscriber.wakeup.clear()
+                    await subscriber.wakeup.wait()
+                if subscriber.overflowed:
+                    yield b": too far behind, reconnect with Last-Event-ID\n\n"
+                    return
+                chunk = b"".join(subscriber.queue)
+                subscriber.queue.clear()
+                if chunk:
+                    yield chunk
+                elif subscriber.keepalive_due:
+                    yield KEEPALIVE
+                subscriber.keepalive_due = False
+        finally:
+            self.unsubscribe(subscriber)
+
+    def close(self):
+        # Wake every stream so it can finish and let the server shut down
+        self.closed = True
+        for subscriber in self.subscribers:
+            subscriber.wakeup.set()
+        if self._ticker is not None:
+            self._ticker.cancel()
+
+    def stats(self):
+        return {
+            "subscribers": len(self.subscribers),
+            "published": self.published,
+            "received_from_workers": self.received,
+            "buffered": len(self.buffer),
+            "overflows": self.overflows,
+            "fanout": self.fanout is not None,
+        }
+
+
+def close_on_exit_signals(broker, signals=(signal.SIGINT, signal.SIGTERM)):
+    """Close ``broker`` when one of ``signals`` arrives, then run the handler
+    installed before (the server's). Returns a function restoring those
+    handlers. Does nothing off the main thread."""
+    if threading.current_thread() is not threading.main_thread():
+        return lambda: None
+    loop = asyncio.get_running_loop()
+    previous = {}
+
+    def handle(sig, frame):
+        # Signal handlers may run in the middle of the loop's own work
+        loop.call_soon_threadsafe(broker.close)
+        previous[sig](sig, frame)
+
+    for sig in signals:
+        handler = signal.getsignal(sig)
+        # Only chain onto a Python handler; leave default dispositions alone
+        if callable(handler):
+            previous[sig] = handler
+            signal.signal(sig, handle)
+
+    def restore():
+        for sig, handler in previous.items():
+            if signal.getsignal(sig) is handle:
+                signal.signal(sig, handler)
+    return restore
+
+
+class PostgresFanout:
+    """Forwards events between workers with LISTEN/NOTIFY on a dedicated
+    asyncpg connection, reconnecting with backoff if it drops."""
+
+    def __init__(self, broker, dsn, channel=EVENTS_CHANNEL):
+        self.broker = broker
+        self.dsn = dsn
+        self.channel = channel
+        self.outbox = asyncio.Queue(maxsize=EVENTS_QUEUE_SIZE)
+        self.origin = broker.epoch
+        self._task = None
+        self.dropped = 0
+
+    def forward(self, topic, name, data):
+        payload = json.dumps({"origin": self.origin, "topic": topic, "name": name, "data": data}, default=str)
+        if len(payload.encode()) > MAX_NOTIFY_BYTES:
+            # Too large for NOTIFY; other workers still learn what changed
+            payload = json.dumps({"origin": self.origin, "topic": topic, "name": name, "data": {"truncated": True}})
+        try:
+            self.outbox.put_nowait(payload)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def _on_notify(self, connection, pid, channel, payload):
+        try:
+            event = json.loads(payload)
+        except ValueError:
+            return
+        if event.get("origin") == self.origin:
+            return
+        self.broker.received += 1
+        self.broker.publish(event["topic"], event["name"], event["data"], forward=False)
+
+    async def _run(self):
+        import asyncpg
+
+        backoff = 0.5
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                await connection.add_listener(self.channel, self._on_notify)
+                backoff = 0.5
+                while True:
+                    payload = await self.outbox.get()
+                    await connection.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Event fan-out connection failed ({e}); retrying in {backoff:.1f}s")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30.0)
+            finally:
+                if connection is not None:
+                    try:
+                        await connection.close()
+                    except Exception:
+                        pass
+
+    def start(self):
+        self.broker.fanout = self
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self):
+        self.broker.fanout = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+
+def start_fanout(broker, engine):
+    """Start the configured fan-out for ``engine``'s database, if any."""
+    if EVENTS_FANOUT != "postgres" or engine.dialect.name != "postgresql":
+        return None
+    dsn = engine.url.set(drivername="postgresql").render_as_string(hide_password=False)
+    fanout = PostgresFanout(broker, dsn)
+    fanout.start()
+    return fanout
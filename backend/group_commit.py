@@ -0,0 +1,138 @@
+"""Group commit for single-row creates.
+
+With ``GROUP_COMMIT_WINDOW_MS`` > 0, concurrent inserts into the same table
+are collected for up to that many milliseconds (or ``GROUP_COMMIT_MAX_ROWS``
+rows) and written with one executemany and one commit, so a burst of
+creates pays for one fsync instead of one each. If the database rejects the
+batch, it is replayed row by row under savepoints in the same transaction:
+each caller gets its own constraint error and the other rows still commit.
+
+With the window at 0 (the default) every insert commits on its own.
+
+``on_insert(db, table, rows)``, if given, is awaited in the same transaction
+with the rows that were inserted, before the commit.
+"""
+import asyncio
+import os
+
+from sqlalchemy import insert
+from sqlalchemy.exc import DBAPIError
+
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "0"))
+GROUP_COMMIT_MAX_ROWS = int(os.getenv("GROUP_COMMIT_MAX_ROWS", "256"))
+
+
+class _Batch:
+    def __init__(self):
+        self.items = []
+        self.full = asyncio.Event()
+
+
+class GroupCommitter:
+    def __init__(self, session_factory, window_ms=GROUP_COMMIT_WINDOW_MS, max_rows=GROUP_COMMIT_MAX_ROWS,
+                 on_insert=None):
+        self.session_factory = session_factory
+        self.on_insert = on_insert
+        self.window = window_ms / 1000
+        self.max_rows = max_rows
+        self._open = {}
+        self.commits = 0
+        self.rows = 0
+        self.rejected = 0
+        self.fallbacks = 0
+
+    async def insert(self, table, row):
+        """Insert ``row`` (a dict of column values) into ``table``. Returns
+        once it is committed; raises the database error for this row only."""
+        if self.window <= 0:
+            async with self.session_factory() as db:
+                try:
+                    await db.execute(insert(table), [row])
+                    if self.on_insert is not None:
+                        await self.on_insert(db, table, [row])
+                    await db.commit()
+                except DBAPIError:
+                    self.rejected += 1
+                    raise
+            self.commits += 1
+            self.rows += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        batch = self._open.get(table.name)
+        if batch is None:
+            batch = self._open[table.name] = _Batch()
+            asyncio.ensure_future(self._run(table, batch))
+        batch.items.append((row, future))
+        if len(batch.items) >= self.max_rows:
+            # Close it now; later arrivals start a batch that flushes in parallel
+            del self._open[table.name]
+            batch.full.set()
+        return await asyncio.shield(future)
+
+    async def _run(self, table, batch):
+        if not batch.full.is_set():
+            try:
+                await asyncio.wait_for(batch.full.wait(), self.window)
+            except asyncio.TimeoutError:
+                pass
+        if self._open.get(table.name) is batch:
+            del self._open[table.name]
+
+        try:
+            errors = await self._flush(table, [row for row, _ in batch.items])
+        except Exception as e:
+            for _, future in batch.items:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), error in zip(batch.items, errors):
+            if future.done():
+                continue
+            if error is None:
+                future.set_result(None)
+            else:
+                self.rejected += 1
+                future.set_exception(error)
+
+    async def _flush(self, table, rows):
+        async with self.session_factory() as db:
+            try:
+                await db.execute(insert(table), rows)
+                if self.on_insert is not None:
+                    await self.on_insert(db, table, rows)
+                await db.commit()
+                self.commits += 1
+                self.rows += len(rows)
+                return [None] * len(rows)
+            except DBAPIError:
+                await db.rollback()
+
+            self.fallbacks += 1
+            errors = []
+            for row in rows:
+                try:
+                    async with db.begin_nested():
+                        await db.execute(insert(table), [row])
+                    errors.append(None)
+                except DBAPIError as e:
+                    errors.append(e)
+            inserted = [row for row, error in zip(rows, errors) if error is None]
+            if inserted and self.on_insert is not None:
+                await self.on_insert(db, table, inserted)
+            await db.commit()
+            self.commits += 1
+            self.rows += errors.count(None)
+            return errors
+
+    def stats(self):
+        return {
+            "enabled": self.window > 0,
+            "commits": self.commits,
+            "rows": self.rows,
+            "rows_per_commit": self.rows / self.commits if self.commits else 0.0,
+            "rejected": self.rejected,
+            "fallbacks": self.fallbacks,
+            "open_batches": len(self._open),
+        }
@@ -0,0 +1,116 @@
+import asyncio
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from passlib.context import CryptContext
+
+# Hashing pool settings
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(os.cpu_count() or 1)))
+HASH_QUEUE_SIZE = int(os.getenv("HASH_QUEUE_SIZE", str(HASH_WORKERS * 4)))
+
+_worker_context = None
+
+
+def _hash_in_worker(password, rounds):
+    # Runs inside a pool process; each process builds its context once
+    global _worker_context
+    if _worker_context is None:
+        _worker_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=rounds)
+    start = time.perf_counter()
+    hashed = _worker_context.hash(password)
+    return hashed, time.perf_counter() - start
+
+
+class HashPoolFull(Exception):
+    def __init__(self, retry_after):
+        super().__init__("Password hashing pool is saturated")
+        self.retry_after = retry_after
+
+
+class PasswordHasher:
+    """Runs bcrypt in a process pool so hashing never occupies the event loop
+    or uvicorn's threadpool. At most ``workers + queue_size`` hashes are
+    admitted at once; anything beyond that is rejected with HashPoolFull.
+    ``observe(hash_seconds, wait_seconds)`` is called after every hash."""
+
+    def __init__(self, workers=HASH_WORKERS, queue_size=HASH_QUEUE_SIZE, rounds=BCRYPT_ROUNDS, observe=None):
+        self.workers = workers
+        self.queue_size = queue_size
+        self.rounds = rounds
+        self.observe = observe
+        self._executor = None
+        self._pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.hash_seconds_total = 0.0
+        self.wait_seconds_total = 0.0
+        self.hash_seconds_max = 0.0
+
+    def _get_executor(self):
+        if self._executor is None:
+            # spawn, not fork: the parent is a threaded, event-loop process
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._executor
+
+    @property
+    def in_flight(self):
+        return self._pending
+
+    @property
+    def queue_depth(self):
+        return max(0, self._pending - self.workers)
+
+    def retry_after(self):
+        # Seconds until the current backlog should have drained
+        avg = self.hash_seconds_total / self.completed if self.completed else 0.25
+        return max(1, math.ceil((self.queue_depth + 1) * avg / self.workers))
+
+    async def hash(self, password):
+        if self._pending >= self.workers + self.queue_size:
+            self.rejected += 1
+            raise HashPoolFull(self.retry_after())
+
+        self._pending += 1
+        start = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            hashed, hash_seconds = await loop.run_in_executor(
+                self._get_executor(), _hash_in_worker, password, self.rounds
+            )
+        finally:
+            self._pending -= 1
+
+        wait_seconds = time.perf_counter() - start - hash_seconds
+        self.completed += 1
+        self.hash_seconds_total += hash_seconds
+        self.wait_seconds_total += wait_seconds
+        self.hash_seconds_max = max(self.hash_seconds_max, hash_seconds)
+        if self.observe is not None:
+            self.observe(hash_seconds, wait_seconds)
+        return hashed
+
+    def stats(self):
+        return {
+            "workers": self.workers,
+            "queue_size": self.queue_size,
+            "bcrypt_rounds": self.rounds,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "hash_seconds_avg": self.hash_seconds_total / self.completed if self.completed else 0.0,
+            "hash_seconds_max": self.hash_seconds_max,
+            "wait_seconds_avg": self.wait_seconds_total / self.completed if self.completed else 0.0,
+        }
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
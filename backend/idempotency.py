@@ -0,0 +1,323 @@
+"""Idempotency-Key support for POST endpoints.
+
+A POST carrying an ``Idempotency-Key`` header is executed at most once per
+key (scoped to the request path). The response is kept for
+``IDEMPOTENCY_TTL`` seconds and replayed verbatim, with an
+``Idempotent-Replayed: true`` header, to any retry with the same key. The
+replay never reaches the route, so it costs no bcrypt hash and no writes.
+
+* Concurrent requests with the same key in one process share a single
+  execution; with the table store, a key being executed by another worker
+  gets 409 and a Retry-After.
+* Reusing a key with a different body gets 422.
+* 5xx and 429 responses are not stored, so the client may retry them.
+
+The store is in-memory (bounded LRU with TTL, per process) by default, or
+the ``idempotency_keys`` table with ``IDEMPOTENCY_STORE=table`` so every
+worker sees every key.
+"""
+import asyncio
+import hashlib
+import json
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, insert, or_, select, update
+from sqlalchemy.exc import IntegrityError
+
+from cache import LRUCache
+from models import IdempotencyRecord
+
+IDEMPOTENCY_STORE = os.getenv("IDEMPOTENCY_STORE", "memory")
+IDEMPOTENCY_TTL = float(os.getenv("IDEMPOTENCY_TTL", "86400"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "100000"))
+IDEMPOTENCY_MAX_RESPONSE_BYTES = int(os.getenv("IDEMPOTENCY_MAX_RESPONSE_BYTES", str(1024 * 1024)))
+# A claim older than this is assumed to belong to a worker that died mid-request
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.getenv("IDEMPOTENCY_LOCK_TIMEOUT", "60"))
+MAX_KEY_LENGTH = 255
+PURGE_EVERY = 1000
+
+
+class MemoryStore:
+    def __init__(self, max_entries=IDEMPOTENCY_MAX_ENTRIES, ttl=IDEMPOTENCY_TTL):
+        self._cache = LRUCache(max_entries, ttl)
+
+    def __len__(self):
+        return len(self._cache)
+
+    async def get(self, key):
+        record = await self._cache.get(key)
+        return record if isinstance(record, dict) else None
+
+    async def claim(self, key):
+        # One process: concurrent requests are already collapsed in memory
+        return True
+
+    async def save(self, key, record):
+        await self._cache.set(key, record)
+
+    async def release(self, key):
+        pass
+
+
+class TableStore:
+    """Keys shared by all workers through the ``idempotency_keys`` table.
+    A worker claims a key by inserting its row; the primary key makes the
+    claim exclusive."""
+
+    def __init__(self, session_factory, ttl=IDEMPOTENCY_TTL):
+        self.session_factory = session_factory
+        self.ttl = timedelta(seconds=ttl)
+        self.lock_timeout = timedelta(seconds=IDEMPOTENCY_LOCK_TIMEOUT)
+        self._saves = 0
+
+    def __len__(self):
+        return 0
+
+    async def get(self, key):
+        async with self.session_factory() as db:
+            row = (await db.execute(
+                select(IdempotencyRecord.status_code, IdempotencyRecord.headers, IdempotencyRecord.body,
+                       IdempotencyRecord.fingerprint, IdempotencyRecord.created_at)
+                .where(IdempotencyRecord.key == key)
+            )).first()
+        if row is None or row.created_at < datetime.utcnow() - self.ttl:
+            return None
+        return {
+            "status": row.status_code,
+            "headers": json.loads(row.headers) if row.headers else [],
+            "body": row.body,
+            "fingerprint": row.fingerprint,
+        }
+
+    async def claim(self, key):
+        now = datetime.utcnow()
+        async with self.session_factory() as db:
+            # Take over expired responses and claims abandoned by dead workers
+            await db.execute(
+                delete(IdempotencyRecord)
+                .where(IdempotencyRecord.key == key)
+                .where(or_(IdempotencyRecord.created_at < now - self.ttl,
+                           IdempotencyRecord.status_code.is_(None)
+                           & (IdempotencyRecord.created_at < now - self.lock_timeout)))
+            )
+            try:
+                await db.execute(insert(IdempotencyRecord).values(key=key, created_at=now))
+                await db.commit()
+                return True
+            except IntegrityError:
+                await db.rollback()
+                return False
+
+    async def save(self, key, record):
+        async with self.session_factory() as db:
+            await db.execute(
+                update(IdempotencyRecord)
+                .where(IdempotencyRecord.key == key)
+                .values(status_code=record["status"], headers=json.dumps(record["headers"]), body=record["body"],
+                        fingerprint=record["fingerprint"], created_at=datetime.utcnow())
+            )
+            self._saves += 1
+            if self._saves % PURGE_EVERY == 0:
+                await db.execute(
+                    delete(IdempotencyRecord).where(IdempotencyRecord.created_at < datetime.utcnow() - self.ttl)
+                )
+            await db.commit()
+
+    async def release(self, key):
+        async with self.session_factory() as db:
+            await db.execute(
+                delete(IdempotencyRecord)
+                .where(IdempotencyRecord.key == key)
+                .where(IdempotencyRecord.status_code.is_(None))
+            )
+            await db.commit()
+
+
+def create_idempotency_store(session_factory):
+    if IDEMPOTENCY_STORE == "table":
+        return TableStore(session_factory)
+    return MemoryStore()
+
+
+def _header(scope, name):
+    for key, value in scope["headers"]:
+        if key == name:
+            return value.decode("latin-1")
+    return None
+
+
+def _request_digest(scope):
+    digest = hashlib.sha256()
+    digest.update(scope["method"].encode())
+    digest.update(scope["path"].encode())
+    digest.update(scope.get("query_string", b""))
+    return digest
+
+
+async def _send_json(send, status, content, headers=()):
+    body = json.dumps(content).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+                    *headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class Idempotency:
+    """Key store, in-flight executions and counters behind
+    IdempotencyMiddleware."""
+
+    def __init__(self, store, methods=("POST",)):
+        self.store = store
+        self.methods = methods
+        self._inflight = {}
+        self.executed = 0
+        self.replayed = 0
+        self.collapsed = 0
+        self.mismatched = 0
+        self.conflicts = 0
+
+    async def handle(self, app, scope, receive, send):
+        key = _header(scope, b"idempotency-key") if scope["method"] in self.methods else None
+        if key is None:
+            await app(scope, receive, send)
+            return
+        if not key or len(key) > MAX_KEY_LENGTH:
+            await _send_json(send, 400, {"detail": f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters"})
+            return
+
+        store_key = f"{scope['method']} {scope['path']} {key}"
+        while True:
+            inflight = self._inflight.get(store_key)
+            if inflight is not None:
+                self.collapsed += 1
+                record = await asyncio.shield(inflight)
+                if record is None:
+                    # The first execution was not stored (e.g. 5xx): try again
+                    continue
+                await self._replay(record, scope, receive, send)
+                return
+            record = await self.store.get(store_key)
+            if store_key in self._inflight:
+                continue
+            if record is not None:
+                await self._replay(record, scope, receive, send)
+                return
+            break
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[store_key] = future
+        record = None
+        try:
+            if await self.store.claim(store_key):
+                record = await self._execute(app, store_key, scope, receive, send)
+            else:
+                self.conflicts += 1
+                await _send_json(send, 409, {"detail": "A request with this Idempotency-Key is in progress"},
+                                 [(b"retry-after", b"1")])
+        finally:
+            del self._inflight[store_key]
+            future.set_result(record)
+
+    async def _execute(self, app, store_key, scope, receive, send):
+        self.executed += 1
+        digest = _request_digest(scope)
+        body_read = False
+        response = {"status": 500, "headers": [], "chunks": [], "size": 0, "storable": True}
+
+        async def hashing_receive():
+            nonlocal body_read
+            message = await receive()
+            if message["type"] == "http.request":
+                digest.update(message.get("body", b""))
+                body_read = not message.get("more_body", False)
+            return message
+
+        async def capturing_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [[k.decode("latin-1"), v.decode("latin-1")] for k, v in message["headers"]]
+            elif message["type"] == "http.response.body" and response["storable"]:
+                chunk = message.get("body", b"")
+                response["size"] += len(chunk)
+                if response["size"] > IDEMPOTENCY_MAX_RESPONSE_BYTES:
+                    response["storable"] = False
+                    response["chunks"] = []
+                else:
+                    response["chunks"].append(chunk)
+            await send(message)
+
+        try:
+            await app(scope, hashing_receive, capturing_send)
+        except BaseException:
+            await self.store.release(store_key)
+            raise
+
+        status = response["status"]
+        if not response["storable"] or status >= 500 or status == 429:
+            await self.store.release(store_key)
+            return None
+        record = {
+            "status": status,
+            "headers": response["headers"],
+            "body": b"".join(response["chunks"]),
+            # Only comparable if the route consumed the whole body
+            "fingerprint": digest.hexdigest() if body_read else None,
+        }
+        await self.store.save(store_key, record)
+        return record
+
+    async def _replay(self, record, scope, receive, send):
+        if record["status"] is None:
+            # Claimed by another worker that has not finished yet
+            self.conflicts += 1
+            await _send_json(send, 409, {"detail": "A request with this Idempotency-Key is in progress"},
+                             [(b"retry-after", b"1")])
+            return
+        if record["fingerprint"] is not None:
+            digest = _request_digest(scope)
+            while True:
+                message = await receive()
+                if message["type"] != "http.request":
+                    break
+                digest.update(message.get("body", b""))
+                if not message.get("more_body", False):
+                    break
+            if digest.hexdigest() != record["fingerprint"]:
+                self.mismatched += 1
+                await _send_json(send, 422, {"detail": "Idempotency-Key was already used with a different request"})
+                return
+
+        self.replayed += 1
+        headers = [(k.encode("latin-1"), v.encode("latin-1")) for k, v in record["headers"]]
+        headers.append((b"idempotent-replayed", b"true"))
+        await send({"type": "http.response.start", "status": record["status"], "headers": headers})
+        await send({"type": "http.response.body", "body": record["body"]})
+
+    def stats(self):
+        return {
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "collapsed": self.collapsed,
+            "mismatched": self.mismatched,
+            "conflicts": self.conflicts,
+            "in_flight": len(self._inflight),
+            "stored": len(self.store),
+        }
+
+
+class IdempotencyMiddleware:
+    """Pure ASGI middleware applying ``idempotency`` to every request."""
+
+    def __init__(self, app, idempotency):
+        self.app = app
+        self.idempotency = idempotency
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        await self.idempotency.handle(self.app, scope, receive, send)
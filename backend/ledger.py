@@ -0,0 +1,361 @@
+"""Repayment ledger and nightly interest accrual.
+
+Money movements on a loan are appended to ``ledger_entries`` and never
+changed. ``loan_balances`` holds what is still owed (principal and accrued
+interest) and is updated in the same transaction as each entry.
+
+* A repayment pays accrued interest first, then principal. It is credited
+  to the loan's lenders in proportion to their funding. The loan is paid
+  off when nothing is owed any more.
+* The accrual job charges simple daily interest on the outstanding
+  principal for every day since the loan's last accrual (or its approval).
+  The interest is kept unrounded, so fractions of a cent add up from night
+  to night instead of being dropped or rounded up each time. Amounts are
+  rounded to cents only when shown or settled.
+  - It reads approved loans in loan_id order in chunks of
+    ``ACCRUAL_CHUNK_SIZE``.
+  - It computes a chunk's interest with NumPy.
+  - It writes the chunk with one bulk insert (COPY on PostgreSQL) and one
+    batched balance upsert.
+  - Each chunk commits together with the run's checkpoint in
+    ``accrual_runs``. A crashed or interrupted run picks up after the last
+    committed loan, and a finished run is not repeated.
+
+Run the job with ``python -m ledger [--date YYYY-MM-DD]``.
+"""
+import os
+import sys
+from datetime import date, datetime
+
+import numpy as np
+from sqlalchemy import bindparam, insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import IntegrityError
+
+from aggregates import StatsDelta, apply_delta, apply_delta_async
+from bulk import insert_rows
+from models import AccrualRun, Lender, LedgerEntry, LedgerKind, Loan, LoanBalance, LoanFunding, LoanStatus
+
+ACCRUAL_CHUNK_SIZE = int(os.getenv("ACCRUAL_CHUNK_SIZE", "20000"))
+DAYS_PER_YEAR = 365
+# Balances below this are treated as settled (Float columns)
+BALANCE_EPSILON = 0.005
+
+
+class LedgerError(Exception):
+    def __init__(self, status_code, detail):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+
+class AccrualConflict(Exception):
+    """Another process advanced the same run's checkpoint."""
+
+
+def _upsert(dialect_name):
+    return sqlite_insert(LoanBalance) if dialect_name == "sqlite" else pg_insert(LoanBalance)
+
+
+def paid_off_delta(loan_amount, fundings):
+    """Aggregate changes for an approved loan that is now paid."""
+    delta = StatsDelta()
+    delta.loan_status_changed(LoanStatus.approved, LoanStatus.paid, loan_amount)
+    for lender_id, amount in fundings:
+        delta.funding_repaid(lender_id, amount)
+    return delta
+
+
+# Repayments
+
+async def _lock_balance(db, loan_id, loan_amount):
+    stmt = (select(LoanBalance.principal, LoanBalance.accrued_interest)
+            .where(LoanBalance.loan_id == loan_id).with_for_update())
+    balance = (await db.execute(stmt)).first()
+    if balance is None:
+        # First movement on this loan: the balance starts at the loan amount
+        await db.execute(_upsert(db.get_bind().dialect.name).values(
+            loan_id=loan_id, principal=loan_amount, accrued_interest=0.0).on_conflict_do_nothing())
+        balance = (await db.execute(stmt)).first()
+    return balance
+
+
+async def record_repayment(db, loan_id, amount, on_date):
+    """Apply a repayment of ``amount`` to an approved loan. The caller
+    commits. Raises LedgerError when the loan or the amount do not allow it."""
+    loan = (await db.execute(
+        select(Loan.amount, Loan.status).where(Loan.loan_id == loan_id).with_for_update())).first()
+    if loan is None:
+        raise LedgerError(404, "Loan not found")
+    if loan.status != LoanStatus.approved:
+        raise LedgerError(409, f"Loan is {loan.status.value}, not approved")
+
+    balance = await _lock_balance(db, loan_id, loan.amount)
+    owed = balance.principal + (balance.accrued_interest or 0.0)
+    if amount > owed + BALANCE_EPSILON:
+        raise LedgerError(400, f"Repayment exceeds the outstanding balance of {owed:.2f}")
+    interest = min(amount, balance.accrued_interest or 0.0)
+    principal = min(amount - interest, balance.principal)
+
+    # Compare-and-set against the values just read: without row locks
+    # (SQLite) a concurrent repayment makes this match nothing
+    updated = await db.execute(
+        update(LoanBalance)
+        .where(LoanBalance.loan_id == loan_id)
+        .where(LoanBalance.principal == balance.principal)
+        .where(LoanBalance.accrued_interest == balance.accrued_interest)
+        .values(principal=LoanBalance.principal - principal,
+                accrued_interest=LoanBalance.accrued_interest - interest)
+    )
+    if updated.rowcount != 1:
+        raise LedgerError(409, "Balance changed, retry")
+    await db.execute(insert(LedgerEntry), [{
+        "loan_id": loan_id, "entry_date": on_date, "kind": LedgerKind.repayment,
+        "amount": amount, "principal": principal, "interest": interest,
+    }])
+
+    # Lenders get their share of the repayment back as available funds
+    fundings = (await db.execute(
+        select(LoanFunding.lender_id, LoanFunding.amount).where(LoanFunding.loan_id == loan_id))).all()
+    funded = sum(share for _, share in fundings)
+    if funded > 0:
+        await db.execute(
+            update(Lender.__table__)
+            .where(Lender.lender_id == bindparam("b_lender_id"))
+            .values(available_funds=Lender.available_funds + bindparam("b_credit")),
+            [{"b_lender_id": lender_id, "b_credit": amount * share / funded} for lender_id, share in fundings],
+        )
+
+    remaining_principal = balance.principal - principal
+    remaining_interest = (balance.accrued_interest or 0.0) - interest
+    status = LoanStatus.approved
+    delta = StatsDelta()
+    if remaining_principal + remaining_interest <= BALANCE_EPSILON:
+        paid = await db.execute(
+            update(Loan).where(Loan.loan_id == loan_id).where(Loan.status == LoanStatus.approved)
+            .values(status=LoanStatus.paid))
+        if paid.rowcount != 1:
+            raise LedgerError(409, "Loan status changed, retry")
+        status = LoanStatus.paid
+        delta = paid_off_delta(loan.amount, fundings)
+    if funded > 0:
+        delta.platform["available_funds"] += amount
+    await apply_delta_async(db, delta)
+    return {
+        "loan_id": loan_id,
+        "amount": amount,
+        "principal": round(principal, 2),
+        "interest": round(interest, 2),
+        "remaining_principal": round(remaining_principal, 2),
+        "remaining_interest": round(remaining_interest, 2),
+        "status": status,
+        "lender_ids": [lender_id for lender_id, _ in fundings],
+    }
+
+
+async def pay_off(db, loan_id, on_date):
+    """Repay everything still owed on an approved loan (principal plus
+    accrued interest) as one repayment, which marks it paid."""
+    loan = (await db.execute(
+        select(Loan.amount, Loan.status).where(Loan.loan_id == loan_id).with_for_update())).first()
+    if loan is None:
+        raise LedgerError(404, "Loan not found")
+    if loan.status != LoanStatus.approved:
+        raise LedgerError(409, f"Loan is {loan.status.value}, not approved")
+    balance = await _lock_balance(db, loan_id, loan.amount)
+    owed = round(balance.principal + (balance.accrued_interest or 0.0), 2)
+    return await record_repayment(db, loan_id, owed, on_date)
+
+
+# Accrual
+
+def active_loans_statement(after_id):
+    return (
+        select(Loan.loan_id, Loan.amount, Loan.interest_rate, Loan.approval_date,
+               LoanBalance.principal, LoanBalance.accrued_interest, LoanBalance.last_accrual_date)
+        .outerjoin(LoanBalance, LoanBalance.loan_id == Loan.loan_id)
+        .where(Loan.status == LoanStatus.approved)
+        .where(Loan.loan_id > after_id)
+        .order_by(Loan.loan_id)
+    )
+
+
+def iter_active_chunks(engine, after_id, chunk_size):
+    """Approved loans after ``after_id``, ``chunk_size`` rows at a time. On
+    PostgreSQL one server-side cursor streams them on its own connection;
+    elsewhere each chunk is a keyset query, since an open SQLite read cursor
+    would block the job's own writes."""
+    if engine.dialect.name == "postgresql":
+        with engine.connect() as conn:
+            result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(
+                active_loans_statement(after_id))
+            for rows in result.partitions():
+                yield rows
+        return
+    while True:
+        with engine.connect() as conn:
+            rows = conn.execute(active_loans_statement(after_id).limit(chunk_size)).all()
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1].loan_id
+
+
+def accrue(principal, rate, since, as_of):
+    """Simple daily interest, unrounded, on ``principal`` at annual
+    percentage ``rate`` from ``since`` (datetime64[D]) up to ``as_of``."""
+    days = np.maximum((np.datetime64(as_of, "D") - since).astype(np.int64), 0)
+    return principal * rate / (100.0 * DAYS_PER_YEAR) * days, days
+
+
+def chunk_arrays(rows, as_of):
+    n = len(rows)
+    loan_ids = np.fromiter((row.loan_id for row in rows), dtype=np.int64, count=n)
+    amount = np.fromiter((row.amount or 0.0 for row in rows), dtype=np.float64, count=n)
+    has_balance = np.fromiter((row.principal is not None for row in rows), dtype=bool, count=n)
+    principal = np.where(has_balance, np.fromiter(
+        (row.principal or 0.0 for row in rows), dtype=np.float64, count=n), amount)
+    accrued = np.fromiter((row.accrued_interest or 0.0 for row in rows), dtype=np.float64, count=n)
+    rate = np.fromiter((row.interest_rate or 0.0 for row in rows), dtype=np.float64, count=n)
+    since = np.array([row.last_accrual_date or row.approval_date or as_of for row in rows], dtype="datetime64[D]")
+    interest, days = accrue(principal, rate, since, as_of)
+    return loan_ids, amount, has_balance, principal, accrued, interest, days
+
+
+class AccrualResult:
+    def __init__(self, run_date):
+        self.run_date = run_date
+        self.chunks = 0
+        self.loans = 0
+        self.entries = 0
+        self.interest = 0.0
+        self.paid_loan_ids = []
+        self.resumed_from = 0
+        self.already_done = False
+
+    def as_dict(self):
+        return {
+            "run_date": self.run_date.isoformat(),
+            "chunks": self.chunks,
+            "loans": self.loans,
+            "entries": self.entries,
+            "interest": round(self.interest, 2),
+            "paid": len(self.paid_loan_ids),
+            "resumed_from": self.resumed_from,
+            "already_done": self.already_done,
+        }
+
+
+def _start_run(db, as_of):
+    run = db.get(AccrualRun, as_of)
+    if run is None:
+        try:
+            db.add(AccrualRun(run_date=as_of, last_loan_id=0, loans_processed=0, entries_written=0,
+                              interest_total=0.0, loans_paid=0, started_at=datetime.utcnow()))
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+        run = db.get(AccrualRun, as_of)
+    return run
+
+
+def write_chunk(db, rows, as_of, expected_checkpoint):
+    """Write one chunk's entries, balances and checkpoint. Returns
+    ``(entries, interest, paid_loan_ids)``; the caller commits."""
+    run = db.execute(select(AccrualRun).where(AccrualRun.run_date == as_of).with_for_update()).scalar_one()
+    if run.last_loan_id != expected_checkpoint:
+        raise AccrualConflict()
+
+    loan_ids, amount, has_balance, principal, accrued, interest, days = chunk_arrays(rows, as_of)
+    charged = interest > 0
+    entries = [
+        {"loan_id": loan_id, "entry_date": as_of, "kind": LedgerKind.interest, "amount": value,
+         "principal": 0.0, "interest": value}
+        for loan_id, value in zip(loan_ids[charged].tolist(), interest[charged].tolist())
+    ]
+    if entries:
+        insert_rows(db, LedgerEntry.__table__, entries)
+
+    # Balances move by delta, so a repayment committed since the chunk was
+    # read is kept; new balances start at the loan amount
+    touched = (days > 0) | ~has_balance
+    if touched.any():
+        stmt = _upsert(db.get_bind().dialect.name)
+        stmt = stmt.on_conflict_do_update(index_elements=["loan_id"], set_={
+            "accrued_interest": LoanBalance.accrued_interest + stmt.excluded.accrued_interest,
+            "last_accrual_date": stmt.excluded.last_accrual_date,
+        })
+        db.execute(stmt, [
+            {"loan_id": loan_id, "principal": owed, "accrued_interest": value, "last_accrual_date": as_of}
+            for loan_id, owed, value in zip(loan_ids[touched].tolist(), principal[touched].tolist(),
+                                            interest[touched].tolist())
+        ])
+
+    settled = (principal + accrued + interest) <= BALANCE_EPSILON
+    paid_loan_ids = []
+    if settled.any():
+        amounts = dict(zip(loan_ids.tolist(), amount.tolist()))
+        for loan_id in loan_ids[settled].tolist():
+            closed = db.execute(
+                update(Loan).where(Loan.loan_id == loan_id).where(Loan.status == LoanStatus.approved)
+                .values(status=LoanStatus.paid))
+            if closed.rowcount == 1:
+                paid_loan_ids.append(loan_id)
+                fundings = db.execute(
+                    select(LoanFunding.lender_id, LoanFunding.amount).where(LoanFunding.loan_id == loan_id)).all()
+                apply_delta(db, paid_off_delta(amounts[loan_id], fundings))
+
+    total = float(interest[charged].sum())
+    run.last_loan_id = int(loan_ids[-1])
+    run.loans_processed += len(rows)
+    run.entries_written += len(entries)
+    run.interest_total += total
+    run.loans_paid += len(paid_loan_ids)
+    return len(entries), total, paid_loan_ids
+
+
+def run_accrual(session_factory, as_of=None, chunk_size=ACCRUAL_CHUNK_SIZE):
+    """Accrue interest on every approved loan up to ``as_of`` (default
+    today), resuming from the run's checkpoint."""
+    as_of = as_of or date.today()
+    result = AccrualResult(as_of)
+    with session_factory() as db:
+        engine = db.get_bind()
+        run = _start_run(db, as_of)
+        if run.finished_at is not None:
+            result.already_done = True
+            return result
+        checkpoint = result.resumed_from = run.last_loan_id
+
+    for rows in iter_active_chunks(engine, checkpoint, chunk_size):
+        with session_factory() as db:
+            entries, interest, paid_loan_ids = write_chunk(db, rows, as_of, checkpoint)
+            db.commit()
+        checkpoint = rows[-1].loan_id
+        result.chunks += 1
+        result.loans += len(rows)
+        result.entries += entries
+        result.interest += interest
+        result.paid_loan_ids.extend(paid_loan_ids)
+
+    with session_factory() as db:
+        db.execute(update(AccrualRun).where(AccrualRun.run_date == as_of).values(finished_at=datetime.utcnow()))
+        db.commit()
+    return result
+
+
+if __name__ == "__main__":
+    import argparse
+
+    from database import SessionLocal
+
+    parser = argparse.ArgumentParser(description="Accrue daily interest on approved loans")
+    parser.add_argument("--date", type=date.fromisoformat, help="accrue up to this date (default: today)")
+    parser.add_argument("--chunk-size", type=int, default=ACCRUAL_CHUNK_SIZE)
+    args = parser.parse_args()
+    try:
+        print(run_accrual(SessionLocal, args.date, args.chunk_size).as_dict())
+    except AccrualConflict:
+        print(f"Another accrual run for {args.date or date.today()} is in progress")
+        sys.exit(1)
@@ -1,81 +1,97 @@
-from fastapi import FastAPI, Depends, HTTPException
-from sqlalchemy import create_engine, Column, Integer, String, Float, Date, ForeignKey, Enum
-from sqlalchemy.orm import sessionmaker, Session, declarative_base
-from datetime import datetime
-import enum
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import date
+from typing import List, Literal, Optional
 from pydantic import BaseModel, EmailStr, validator
-from passlib.context import CryptContext
 import re
-import time
-from sqlalchemy.exc import OperationalError
+import asyncio
+from contextlib import asynccontextmanager
+from sqlalchemy import text
+from database import (engine, async_engine, SessionLocal, AsyncSessionLocal, Base, get_async_db,
+                      wait_for_database, warm_pool, add_missing_columns, missing_columns, missing_schema,
+                      pool_status)
+from models import LoanStatus, User, Lender, Loan, LedgerEntry, LoanBalance
+from hashing import PasswordHasher, HashPoolFull
+from pagination import list_rows, sorted_page
+from bulk import bulk_import
+from cache import create_entity_cache
+import metrics
+import profiling
+from matching import run_matching, MATCH_BATCH_SIZE
+from approvals import ApprovalBatcher, ApprovalError
+from group_commit import GroupCommitter
+from idempotency import Idempotency, IdempotencyMiddleware, create_idempotency_store
+import analytics
+from search import LoanSort, SortOrder, search_loans
+from serialization import FastJSONResponse, model_columns
+import aggregates
+import archive
+import ledger
+from events import EventBroker, close_on_exit_signals, start_fanout
+from admission import AdmissionController, AdmissionMiddleware
 
-# Database setup with retry mechanism
-DATABASE_URL = "postgresql://postgres:postgres@db:5432/lending"
+# Read-through cache for single-entity lookups (see cache.py)
+entity_cache = create_entity_cache()
 
-def create_db_engine():
-    retries = 5
-    while retries > 0:
-        try:
-            engine = create_engine(DATABASE_URL)
-            engine.connect()
-            return engine
-        except OperationalError:
-            print(f"Database connection failed, retrying... ({retries} attempts left)")
-            retries -= 1
-            time.sleep(5)
-    raise Exception("Failed to connect to database after multiple attempts")
-
-engine = create_db_engine()
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-# Enums
-class LoanStatus(str, enum.Enum):
-    pending = "pending"
-    approved = "approved"
-    rejected = "rejected"
-    paid = "paid"
-
-# Database models
-class User(Base):
-    __tablename__ = "users"
-    user_id = Column(Integer, primary_key=True)
-    username = Column(String(30), unique=True)
-    password = Column(String)
-    email = Column(String, unique=True)
-    phone_number = Column(String(15))
-
-class Lender(Base):
-    __tablename__ = "lenders"
-    lender_id = Column(Integer, primary_key=True)
-    name = Column(String)
-    email = Column(String, unique=True)
-    credit_score = Column(Float)
-    available_funds = Column(Float)
-    registration_date = Column(Date, default=datetime.now().date())
-
-class Loan(Base):
-    __tablename__ = "loans"
-    loan_id = Column(Integer, primary_key=True)
-    borrower_id = Column(Integer, ForeignKey("users.user_id"))
-    lender_id = Column(Integer, ForeignKey("lenders.lender_id"))
-    amount = Column(Float)
-    interest_rate = Column(Float)
-    term_months = Column(Integer)
-    purpose = Column(String)
-    status = Column(Enum(LoanStatus), default=LoanStatus.pending)
-    creation_date = Column(Date, default=datetime.now().date())
-    approval_date = Column(Date)
-
-# Create tables after connection established
-try:
-    Base.metadata.create_all(bind=engine)
-except OperationalError as e:
-    print(f"Error creating tables: {e}")
-    raise
+# Single-row creates, optionally group-committed (see group_commit.py); the
+# platform aggregates are updated in the same transaction (see aggregates.py)
+row_writer = GroupCommitter(AsyncSessionLocal, on_insert=aggregates.record_inserts_async)
+
+# Responses to POSTs sent with an Idempotency-Key (see idempotency.py)
+idempotency = Idempotency(create_idempotency_store(AsyncSessionLocal))
+
+# Approvals are settled per lender in short batches (see approvals.py)
+approval_batcher = ApprovalBatcher(AsyncSessionLocal)
+
+# Change events for GET /events (see events.py)
+event_broker = EventBroker()
+
+# Active loan book for portfolio analytics, reloaded at most once a minute
+book_snapshot = analytics.BookSnapshot(SessionLocal)
+
+# Settled loans moved out of the loans table (see archive.py)
+loan_archive = archive.ArchiveReader(SessionLocal)
+
+# Password hashing (bcrypt runs in a bounded process pool, see hashing.py)
+password_hasher = PasswordHasher(observe=metrics.observe_hash)
+
+# Opt-in profiling and query insights (see profiling.py)
+profiler = profiling.Profiler()
+
+# Per-client rate limits and load shedding (see admission.py). Routes
+# listed as expensive get a smaller budget of their own: bcrypt, bulk
+# imports, batch jobs and analytics over the whole book.
+EXPENSIVE_ROUTES = (
+    ("POST", "/users/"), ("POST", "/lenders/bulk"), ("POST", "/loans/bulk"), ("POST", "/matching/run"),
+    ("POST", "/accrual/run"), ("POST", "/archive/run"), ("POST", "/stats/reconcile"), ("GET", "/analytics/*"),
+)
+# Event streams are long-lived: rate limited, but not counted as in flight
+UNTRACKED_ROUTES = (("GET", "/events"),)
+# Probes and scrapes must keep working under overload
+EXEMPT_ROUTES = (("GET", "/health*"), ("GET", "/metrics"))
+admission = AdmissionController(async_engine, EXPENSIVE_ROUTES, UNTRACKED_ROUTES, EXEMPT_ROUTES)
+
+# Prometheus instrumentation (see metrics.py)
+metrics.instrument_engine(async_engine.sync_engine, "async")
+metrics.instrument_engine(engine, "sync")
+if profiler.insights:
+    metrics.set_query_observer(profiler.observe_query)
+metrics.register_collectors(
+    metrics.RequestCollector(),
+    metrics.PoolCollector({"async": async_engine.sync_engine, "sync": engine}),
+    metrics.StatsCollector("password_hash_pool", password_hasher.stats, counters=("completed", "rejected")),
+    metrics.StatsCollector("entity_cache", entity_cache.stats),
+    metrics.StatsCollector("loan_approvals", approval_batcher.stats),
+    metrics.StatsCollector("group_commit", row_writer.stats),
+    metrics.StatsCollector("idempotency", idempotency.stats),
+    metrics.StatsCollector("events", event_broker.stats),
+    metrics.StatsCollector("profiling", profiler.stats),
+    metrics.StatsCollector("admission", admission.stats),
+    metrics.StatsCollector("archive", loan_archive.stats),
+)
 
 # Pydantic models
 class UserCreate(BaseModel):
@@ -107,50 +123,166 @@ class LenderCreate(BaseModel):
     email: EmailStr
     credit_score: float
     available_funds: float
+    min_interest_rate: float = 0.0
 
 class LoanCreate(BaseModel):
     borrower_id: int
-    lender_id: int
+    # Leave empty to have the matching engine find lenders
+    lender_id: Optional[int] = None
     amount: float
     interest_rate: float
     term_months: int
     purpose: str
 
-# FastAPI app
-app = FastAPI()
+class RepaymentCreate(BaseModel):
+    amount: float
+    # Defaults to today
+    payment_date: Optional[date] = None
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+    @validator('amount')
+    def validate_amount(cls, v):
+        if v <= 0:
+            raise ValueError('Repayment amount must be positive')
+        return v
+
+def check_loan_rules(loan: LoanCreate):
+    if loan.amount <= 0:
+        raise ValueError("Loan amount must be positive")
+    if loan.interest_rate < 1.0 or loan.interest_rate > 30.0:
+        raise ValueError("Interest rate must be 1-30%")
+
+# Response models. Read endpoints select exactly these fields (see
+# model_columns) and encode the rows directly, so the models document the
+# API and bound what can leave the database (never the password hash).
+class UserOut(BaseModel):
+    user_id: int
+    username: Optional[str] = None
+    email: Optional[str] = None
+    phone_number: Optional[str] = None
+
+class LenderOut(BaseModel):
+    lender_id: int
+    name: Optional[str] = None
+    email: Optional[str] = None
+    credit_score: Optional[float] = None
+    available_funds: Optional[float] = None
+    min_interest_rate: Optional[float] = None
+    registration_date: Optional[date] = None
+
+class LoanOut(BaseModel):
+    loan_id: int
+    borrower_id: Optional[int] = None
+    lender_id: Optional[int] = None
+    amount: Optional[float] = None
+    interest_rate: Optional[float] = None
+    term_months: Optional[int] = None
+    purpose: Optional[str] = None
+    status: Optional[LoanStatus] = None
+    creation_date: Optional[date] = None
+    approval_date: Optional[date] = None
+
+class UserPage(BaseModel):
+    items: List[UserOut]
+    next_cursor: Optional[str] = None
+
+class LenderPage(BaseModel):
+    items: List[LenderOut]
+    next_cursor: Optional[str] = None
+
+class LoanPage(BaseModel):
+    items: List[LoanOut]
+    next_cursor: Optional[str] = None
+
+# Startup state reported by /health/ready
+READINESS_TIMEOUT = 2.0
+startup_state = {"ready": False, "connect_attempts": 0, "warm_connections": 0, "missing_schema": [],
+                 "missing_columns": []}
+
+@asynccontextmanager
+async def lifespan(app):
+    # Connect, create tables and fill the pool here rather than at import, so
+    # importing main (workers, --reload, tests, tooling) never touches the DB
+    startup_state["connect_attempts"] = await wait_for_database(async_engine)
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        added = await conn.run_sync(add_missing_columns)
+        if added:
+            print(f"Columns added to existing tables: {', '.join(added)}")
+        startup_state["missing_schema"] = await conn.run_sync(missing_schema, Base.metadata)
+        startup_state["missing_columns"] = await conn.run_sync(missing_columns, Base.metadata)
+    async with async_engine.begin() as conn:
+        if await conn.run_sync(aggregates.backfill):
+            print("Aggregate tables seeded from existing loans and lenders")
+    if startup_state["missing_schema"]:
+        print(f"Schema objects missing from the database: {', '.join(startup_state['missing_schema'])}")
+    startup_state["warm_connections"] = await warm_pool(async_engine)
+    fanout = start_fanout(event_broker, async_engine)
+    # End event streams when the server starts exiting, not after it has
+    # waited for them (see events.py)
+    restore_signals = close_on_exit_signals(event_broker)
+    startup_state["ready"] = True
+    yield
+    startup_state["ready"] = False
+    restore_signals()
+    event_broker.close()
+    if fanout is not None:
+        await fanout.stop()
+    password_hasher.shutdown()
+    await async_engine.dispose()
+    engine.dispose()
+
+# FastAPI app
+app = FastAPI(default_response_class=FastJSONResponse, lifespan=lifespan)
+# Added first so it runs inside the metrics middleware and replays are still counted
+app.add_middleware(IdempotencyMiddleware, idempotency=idempotency)
+# Inside the metrics middleware, which collects the per-request SQL statistics
+app.add_middleware(profiling.ProfilingMiddleware, profiler=profiler)
+# Rejections happen before any other work but are still counted by metrics
+app.add_middleware(AdmissionMiddleware, controller=admission)
+app.add_middleware(metrics.PrometheusMiddleware, track_statements=profiler.insights)
 
 # Routes
 
-@app.get("/users/{user_id}")
-def get_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.user_id == user_id).first()
+USER_COLUMNS = model_columns(User.__table__, UserOut)
+LENDER_COLUMNS = model_columns(Lender.__table__, LenderOut)
+LOAN_COLUMNS = model_columns(Loan.__table__, LoanOut)
+
+@app.get("/users/", response_model=UserPage)
+async def list_users(cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1),
+                     stream: bool = False, db: AsyncSession = Depends(get_async_db)):
+    return await list_rows(db, AsyncSessionLocal, USER_COLUMNS, User.user_id, cursor, limit, stream)
+
+async def load_entity(columns, key_column, entity_id):
+    async with AsyncSessionLocal() as db:
+        row = (await db.execute(select(*columns).where(key_column == entity_id))).mappings().first()
+    return dict(row) if row is not None else None
+
+@app.get("/users/{user_id}", response_model=UserOut)
+async def get_user(user_id: int):
+    db_user = await entity_cache.get_or_load(
+        "user", user_id, lambda: load_entity(USER_COLUMNS, User.user_id, user_id))
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
-    return db_user
+    return FastJSONResponse(db_user)
 
 @app.post("/users/")
-def create_user(user: UserCreate, db: Session = Depends(get_db)):
-    hashed_password = pwd_context.hash(user.password)
-    db_user = User(
-        username=user.username,
-        password=hashed_password,
-        email=user.email,
-        phone_number=user.phone_number
-    )
-    db.add(db_user)
+async def create_user(user: UserCreate):
     try:
-        db.commit()
+        hashed_password = await password_hasher.hash(user.password)
+    except HashPoolFull as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+    db_user = {
+        "username": user.username,
+        "password": hashed_password,
+        "email": user.email,
+        "phone_number": user.phone_number,
+    }
+    try:
+        await row_writer.insert(User.__table__, db_user)
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
+    event_broker.publish("user", "created", {"username": user.username})
     return {"message": "User created"}
 
 class UserUpdate(BaseModel):
@@ -159,8 +291,8 @@ class UserUpdate(BaseModel):
     phone_number: str
 
 @app.put("/users/{user_id}")
-def update_user(user_id: int, user_update: UserUpdate, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.user_id == user_id).first()
+async def update_user(user_id: int, user_update: UserUpdate, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.scalar(select(User).where(User.user_id == user_id))
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     
@@ -169,52 +301,404 @@ def update_user(user_id: int, user_update: UserUpdate, db: Session = Depends(get
     db_user.phone_number = user_update.phone_number
     
     try:
-        db.commit()
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
+    await entity_cache.invalidate("user", user_id)
+    event_broker.publish("user", "updated", {"user_id": user_id})
     return {"message": "User updated successfully"}
 
 @app.delete("/users/{user_id}")
-def delete_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = db.query(User).filter(User.user_id == user_id).first()
+async def delete_user(user_id: int, db: AsyncSession = Depends(get_async_db)):
+    db_user = await db.scalar(select(User).where(User.user_id == user_id))
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     
-    db.delete(db_user)
+    await db.delete(db_user)
     
     try:
-        db.commit()
+        await db.commit()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
+    await entity_cache.invalidate("user", user_id)
+    event_broker.publish("user", "deleted", {"user_id": user_id})
     return {"message": "User deleted successfully"}
 
+@app.get("/lenders/", response_model=LenderPage)
+async def list_lenders(cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1),
+                       stream: bool = False, db: AsyncSession = Depends(get_async_db)):
+    return await list_rows(db, AsyncSessionLocal, LENDER_COLUMNS, Lender.lender_id, cursor, limit, stream)
+
+@app.get("/lenders/{lender_id}", response_model=LenderOut)
+async def get_lender(lender_id: int):
+    db_lender = await entity_cache.get_or_load(
+        "lender", lender_id, lambda: load_entity(LENDER_COLUMNS, Lender.lender_id, lender_id))
+    if db_lender is None:
+        raise HTTPException(status_code=404, detail="Lender not found")
+    return FastJSONResponse(db_lender)
+
 @app.post("/lenders/")
-def create_lender(lender: LenderCreate, db: Session = Depends(get_db)):
-    db_lender = Lender(**lender.dict())
-    db.add(db_lender)
+async def create_lender(lender: LenderCreate):
     try:
-        db.commit()
+        await row_writer.insert(Lender.__table__, lender.dict())
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
+    event_broker.publish("lender", "created", {"name": lender.name, "available_funds": lender.available_funds})
     return {"message": "Lender created"}
 
+# Bulk imports stay on the sync engine so they can use psycopg2's COPY
+@app.post("/lenders/bulk")
+async def bulk_create_lenders(request: Request):
+    defaults = {"registration_date": date.today()}
+    report = await bulk_import(request, SessionLocal, LenderCreate, Lender.__table__, defaults=defaults,
+                               on_insert=aggregates.record_inserts)
+    if report["inserted"]:
+        event_broker.publish("lender", "imported", {"inserted": report["inserted"]})
+    return report
+
+@app.get("/loans/", response_model=LoanPage)
+async def list_loans(cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1),
+                     stream: bool = False, db: AsyncSession = Depends(get_async_db)):
+    return await list_rows(db, AsyncSessionLocal, LOAN_COLUMNS, Loan.loan_id, cursor, limit, stream)
+
+@app.get("/loans/search", response_model=LoanPage)
+async def search_loan_list(status: Optional[LoanStatus] = None, borrower_id: Optional[int] = None,
+                           lender_id: Optional[int] = None, min_amount: Optional[float] = None,
+                           max_amount: Optional[float] = None, min_rate: Optional[float] = None,
+                           max_rate: Optional[float] = None, created_from: Optional[date] = None,
+                           created_to: Optional[date] = None, sort: LoanSort = LoanSort.created,
+                           order: SortOrder = SortOrder.desc, cursor: Optional[str] = None,
+                           limit: Optional[int] = Query(None, ge=1), db: AsyncSession = Depends(get_async_db)):
+    filters = {
+        "status": status, "borrower_id": borrower_id, "lender_id": lender_id,
+        "min_amount": min_amount, "max_amount": max_amount, "min_rate": min_rate, "max_rate": max_rate,
+        "created_from": created_from, "created_to": created_to,
+    }
+    return FastJSONResponse(await search_loans(db, LOAN_COLUMNS, filters, sort, order, cursor, limit,
+                                               archive=loan_archive))
+
+async def load_loan(loan_id):
+    loan = await load_entity(LOAN_COLUMNS, Loan.loan_id, loan_id)
+    if loan is None:
+        loan = await run_in_threadpool(loan_archive.find_loan, loan_id)
+    return loan
+
+@app.get("/loans/{loan_id}", response_model=LoanOut)
+async def get_loan(loan_id: int):
+    db_loan = await entity_cache.get_or_load("loan", loan_id, lambda: load_loan(loan_id))
+    if db_loan is None:
+        raise HTTPException(status_code=404, detail="Loan not found")
+    return FastJSONResponse(db_loan)
+
 @app.post("/loans/")
-def create_loan(loan: LoanCreate, db: Session = Depends(get_db)):
-    if loan.interest_rate < 1.0 or loan.interest_rate > 30.0:
-        raise HTTPException(status_code=400, detail="Interest rate must be 1-30%")
+async def create_loan(loan: LoanCreate):
+    try:
+        check_loan_rules(loan)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    db_loan = Loan(**loan.dict())
-    db.add(db_loan)
     try:
-        db.commit()
+        await row_writer.insert(Loan.__table__, loan.dict())
     except Exception as e:
-        db.rollback()
         raise HTTPException(status_code=400, detail=str(e))
+    event_broker.publish("loan", "created", {"borrower_id": loan.borrower_id, "lender_id": loan.lender_id,
+                                             "amount": loan.amount, "status": LoanStatus.pending})
     return {"message": "Loan created"}
 
+@app.post("/loans/bulk")
+async def bulk_create_loans(request: Request):
+    defaults = {"status": LoanStatus.pending, "creation_date": date.today()}
+    report = await bulk_import(request, SessionLocal, LoanCreate, Loan.__table__, check_loan_rules, defaults,
+                               on_insert=aggregates.record_inserts)
+    if report["inserted"]:
+        event_broker.publish("loan", "imported", {"inserted": report["inserted"]})
+    return report
+
+@app.put("/loans/{loan_id}/approve")
+async def approve_loan(loan_id: int):
+    async with AsyncSessionLocal() as db:
+        db_loan = (await db.execute(
+            select(Loan.lender_id, Loan.status).where(Loan.loan_id == loan_id))).first()
+    if db_loan is None:
+        raise HTTPException(status_code=404, detail="Loan not found")
+    if db_loan.lender_id is None:
+        raise HTTPException(status_code=400, detail="Loan has no lender; run matching first")
+    if db_loan.status != LoanStatus.pending:
+        raise HTTPException(status_code=409, detail=f"Loan is already {db_loan.status.value}")
+
+    try:
+        approval = await approval_batcher.approve(db_loan.lender_id, loan_id)
+    except ApprovalError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    await entity_cache.invalidate("loan", loan_id)
+    await entity_cache.invalidate("lender", db_loan.lender_id)
+    event_broker.publish("loan", "approved", {**approval, "status": LoanStatus.approved})
+    return {"message": "Loan approved", **approval}
+
+# Pays off the outstanding balance through the ledger: a repayment entry,
+# lender credits and the status change, same as a final repayment
+@app.put("/loans/{loan_id}/pay")
+async def pay_off_loan(loan_id: int, db: AsyncSession = Depends(get_async_db)):
+    try:
+        entry = await ledger.pay_off(db, loan_id, date.today())
+        await db.commit()
+    except ledger.LedgerError as e:
+        await db.rollback()
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    lender_ids = entry.pop("lender_ids")
+    await entity_cache.invalidate("loan", loan_id)
+    for lender_id in lender_ids:
+        await entity_cache.invalidate("lender", lender_id)
+    event_broker.publish("loan", "paid", entry)
+    return {"message": "Loan paid off", **entry}
+
+# Only loans that never moved money can be deleted
+DELETABLE_STATUSES = (LoanStatus.pending, LoanStatus.rejected)
+
+@app.delete("/loans/{loan_id}")
+async def delete_loan(loan_id: int, db: AsyncSession = Depends(get_async_db)):
+    loan = (await db.execute(select(Loan.amount, Loan.status).where(Loan.loan_id == loan_id))).first()
+    if loan is None:
+        raise HTTPException(status_code=404, detail="Loan not found")
+    if loan.status not in DELETABLE_STATUSES:
+        raise HTTPException(status_code=409, detail=f"Cannot delete a loan that is {loan.status.value}")
+
+    deleted = await db.execute(delete(Loan).where(Loan.loan_id == loan_id).where(Loan.status == loan.status))
+    if deleted.rowcount != 1:
+        await db.rollback()
+        raise HTTPException(status_code=409, detail="Loan status changed, retry")
+    delta = aggregates.StatsDelta()
+    delta.loan_removed(loan.status, loan.amount)
+    await aggregates.apply_delta_async(db, delta)
+    await db.commit()
+    await entity_cache.invalidate("loan", loan_id)
+    event_broker.publish("loan", "deleted", {"loan_id": loan_id, "previous_status": loan.status})
+    return {"message": "Loan deleted successfully"}
+
+@app.post("/loans/{loan_id}/repayments")
+async def create_repayment(loan_id: int, repayment: RepaymentCreate, db: AsyncSession = Depends(get_async_db)):
+    try:
+        entry = await ledger.record_repayment(db, loan_id, repayment.amount, repayment.payment_date or date.today())
+        await db.commit()
+    except ledger.LedgerError as e:
+        await db.rollback()
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    lender_ids = entry.pop("lender_ids")
+    await entity_cache.invalidate("loan", loan_id)
+    for lender_id in lender_ids:
+        await entity_cache.invalidate("lender", lender_id)
+    event_broker.publish("loan", "paid" if entry["status"] == LoanStatus.paid else "repayment", entry)
+    return {"message": "Repayment recorded", **entry}
+
+LEDGER_COLUMNS = (LedgerEntry.entry_id, LedgerEntry.entry_date, LedgerEntry.kind, LedgerEntry.amount,
+                  LedgerEntry.principal, LedgerEntry.interest)
+
+# A loan's ledger in date order, served by ix_ledger_loan_date
+@app.get("/loans/{loan_id}/ledger")
+async def get_loan_ledger(loan_id: int, cursor: Optional[str] = None, limit: Optional[int] = Query(None, ge=1),
+                          db: AsyncSession = Depends(get_async_db)):
+    stmt = select(*LEDGER_COLUMNS).where(LedgerEntry.loan_id == loan_id)
+    page = await sorted_page(db, stmt, LedgerEntry.entry_date, LedgerEntry.entry_id, cursor, limit,
+                             parse_sort=date.fromisoformat)
+    # Entries keep fractions of a cent (see ledger.py); show cents
+    for item in page["items"]:
+        for field in ("amount", "principal", "interest"):
+            if item[field] is not None:
+                item[field] = round(item[field], 2)
+    return FastJSONResponse(page)
+
+@app.get("/loans/{loan_id}/balance")
+async def get_loan_balance(loan_id: int, db: AsyncSession = Depends(get_async_db)):
+    row = (await db.execute(
+        select(Loan.amount, Loan.status, LoanBalance.principal, LoanBalance.accrued_interest,
+               LoanBalance.last_accrual_date)
+        .outerjoin(LoanBalance, LoanBalance.loan_id == Loan.loan_id)
+        .where(Loan.loan_id == loan_id)
+    )).first()
+    if row is None:
+        raise HTTPException(status_code=404, detail="Loan not found")
+    # No balance row yet: nothing has been accrued or repaid
+    principal = row.amount if row.principal is None else row.principal
+    accrued = row.accrued_interest or 0.0
+    return {"loan_id": loan_id, "status": row.status, "principal": round(principal, 2),
+            "accrued_interest": round(accrued, 2), "outstanding": round(principal + accrued, 2), "last_accrual_date": row.last_accrual_date}
+
+# Nightly interest accrual (normally run as python -m ledger); resumes an
+# interrupted run for the same date and does nothing for a finished one
+@app.post("/accrual/run")
+async def run_interest_accrual(as_of: Optional[date] = None):
+    try:
+        result = await run_in_threadpool(ledger.run_accrual, SessionLocal, as_of)
+    except ledger.AccrualConflict:
+        raise HTTPException(status_code=409, detail="Another accrual run for this date is in progress")
+    for loan_id in result.paid_loan_ids:
+        await entity_cache.invalidate("loan", loan_id)
+    if result.entries or result.paid_loan_ids:
+        event_broker.publish("loan", "accrued", result.as_dict())
+    return result.as_dict()
+
+# Move settled loans older than the cutoff to the archive (normally run as
+# python -m archive); search and lookups keep finding them there
+@app.post("/archive/run")
+async def archive_loans(before: Optional[date] = None):
+    try:
+        result = await run_in_threadpool(archive.run_archive, SessionLocal, before)
+    except (archive.ArchiveBusy, archive.ArchiveConflict):
+        raise HTTPException(status_code=409, detail="An archiving run is in progress")
+    loan_archive.invalidate()
+    if result.loans:
+        event_broker.publish("loan", "archived", result.as_dict())
+    return result.as_dict()
+
+MATCHED_EVENT_MAX_IDS = 1000
+
+@app.post("/matching/run")
+async def match_pending_loans(batch_size: int = Query(MATCH_BATCH_SIZE, ge=1, le=100000)):
+    result = await run_in_threadpool(run_matching, SessionLocal, batch_size)
+    for loan_id in result.loan_ids:
+        await entity_cache.invalidate("loan", loan_id)
+    for lender_id in result.lender_ids:
+        await entity_cache.invalidate("lender", lender_id)
+    if result.loan_ids:
+        # One event per run; ids are capped so the event stays small
+        event_broker.publish("loan", "matched", {
+            "count": len(result.loan_ids), "loan_ids": result.loan_ids[:MATCHED_EVENT_MAX_IDS],
+            "status": LoanStatus.approved,
+        })
+    return result.as_dict()
+
+def lender_analytics(lender_id: int, as_of: date, horizon: int):
+    with SessionLocal() as db:
+        book = analytics.load_book(db, lender_id)
+    platform = analytics.compute_book(book_snapshot.get(), as_of)["outstanding"].sum()
+    summary = analytics.lender_summary(book, lender_id, as_of, float(platform), horizon)
+    summary["archived"] = loan_archive.lender_history(lender_id)
+    return summary
+
+@app.get("/analytics/lenders/{lender_id}")
+async def get_lender_analytics(lender_id: int, as_of: Optional[date] = None,
+                               horizon: int = Query(12, ge=1, le=360)):
+    lender = await entity_cache.get_or_load(
+        "lender", lender_id, lambda: load_entity(LENDER_COLUMNS, Lender.lender_id, lender_id))
+    if lender is None:
+        raise HTTPException(status_code=404, detail="Lender not found")
+    return await run_in_threadpool(lender_analytics, lender_id, as_of or date.today(), horizon)
+
+@app.get("/analytics/portfolio")
+async def get_portfolio_analytics(as_of: Optional[date] = None, top: int = Query(10, ge=1, le=1000)):
+    book = await run_in_threadpool(book_snapshot.get)
+    return await run_in_threadpool(analytics.portfolio_summary, book, as_of or date.today(), top)
+
+EVENT_TOPICS = ("user", "lender", "loan")
+
+# Server-Sent Events feed of committed changes (see events.py). EventSource
+# resends the last id it saw in Last-Event-ID when it reconnects.
+@app.get("/events")
+async def event_stream(request: Request, topics: Optional[str] = None, last_event_id: Optional[str] = None):
+    wanted = None
+    if topics:
+        wanted = frozenset(topic.strip() for topic in topics.split(",") if topic.strip())
+        unknown = wanted.difference(EVENT_TOPICS)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown topics: {', '.join(sorted(unknown))}")
+    if not event_broker.accepting():
+        raise HTTPException(status_code=503, detail="Too many event subscribers", headers={"Retry-After": "5"})
+    return StreamingResponse(
+        event_broker.stream(wanted, request.headers.get("last-event-id") or last_event_id),
+        media_type="text/event-stream",
+        # No proxy buffering or caching of the stream
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# Platform and lender totals, read from the incrementally maintained
+# aggregate tables: a handful of rows whatever the size of the book
+@app.get("/stats")
+async def platform_stats(db: AsyncSession = Depends(get_async_db)):
+    return await aggregates.read_platform_stats(db)
+
+@app.get("/lenders/{lender_id}/stats")
+async def lender_stats(lender_id: int, db: AsyncSession = Depends(get_async_db)):
+    lender = await entity_cache.get_or_load(
+        "lender", lender_id, lambda: load_entity(LENDER_COLUMNS, Lender.lender_id, lender_id))
+    if lender is None:
+        raise HTTPException(status_code=404, detail="Lender not found")
+    return await aggregates.read_lender_stats(db, lender_id)
+
+# Recompute the aggregates from scratch and report drift; fix=true corrects it
+@app.post("/stats/reconcile")
+async def reconcile_stats(fix: bool = False):
+    return await run_in_threadpool(aggregates.reconcile, SessionLocal, fix)
+
+# Diagnostics expose SQL and code paths: they don't exist without a
+# PROFILE_TOKEN and need it in X-Profile-Token (X-Profile would profile the
+# admin request itself)
+def require_profile_token(x_profile_token: Optional[str] = Header(None)):
+    if not profiling.PROFILE_TOKEN:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if x_profile_token != profiling.PROFILE_TOKEN:
+        raise HTTPException(status_code=403, detail="X-Profile-Token required")
+
+@app.get("/admin/insights", dependencies=[Depends(require_profile_token)])
+def query_insights(top: int = Query(10, ge=1, le=100), by: Literal["count", "total", "avg", "max"] = "total"):
+    return profiler.insights_report(top, by)
+
+@app.get("/admin/profiles", dependencies=[Depends(require_profile_token)])
+def list_profiles():
+    return [
+        {key: profile[key] for key in ("id", "at", "method", "path", "duration_ms", "db_queries")}
+        for profile in reversed(list(profiler.profiles.values()))
+    ]
+
+@app.get("/admin/profiles/{profile_id}", dependencies=[Depends(require_profile_token)])
+def get_profile(profile_id: str):
+    profile = profiler.profiles.get(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return profile
+
+@app.get("/cache/stats")
+def cache_stats():
+    return entity_cache.stats()
+
+@app.get("/hashing/stats")
+def hashing_stats():
+    return password_hasher.stats()
+
+@app.get("/admission/stats")
+def admission_stats():
+    return admission.stats()
+
+@app.get("/metrics")
+def prometheus_metrics():
+    return metrics.metrics_response()
+
+# Liveness: the process is up and serving; never touches the database
 @app.get("/health")
+@app.get("/health/live")
 def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy"}
+
+async def ping_database():
+    async with async_engine.connect() as conn:
+        await conn.execute(text("SELECT 1"))
+
+# Readiness: startup finished, every model column exists (a missing index
+# is only slow), the pool has room and the database answers
+@app.get("/health/ready")
+async def readiness_check():
+    pool = pool_status(async_engine)
+    checks = {"startup": startup_state["ready"], "schema": not startup_state["missing_columns"],
+              "pool": not pool["saturated"], "database": False}
+    # A saturated pool would make the ping itself queue; report it instead
+    if checks["startup"] and checks["pool"]:
+        try:
+            await asyncio.wait_for(ping_database(), READINESS_TIMEOUT)
+            checks["database"] = True
+        except Exception:
+            pass
+    ready = all(checks.values())
+    body = {"status": "ready" if ready else "unavailable", "checks": checks, "pool": pool,
+            "missing_schema": startup_state["missing_schema"]}
+    return FastJSONResponse(body, status_code=200 if ready else 503)
\ No newline at end of file
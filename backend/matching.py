@@ -0,0 +1,270 @@
+"""Loan-to-lender matching.
+
+Pending loans without a lender are funded from an in-memory book of
+lenders, FIFO by loan_id. Lenders are bucketed by rate appetite
+(``min_interest_rate``) and, within a bucket, kept in a heap ordered by
+credit score then available funds, so each allocation step only looks at
+the head of each eligible bucket. A loan larger than the best lender's
+funds is split across several lenders; a loan that cannot be fully funded
+stays pending and nothing is reserved for it.
+
+A matched loan is funded: its lenders' ``available_funds`` are debited,
+one ``loan_fundings`` row is written per contributing lender, and the loan
+moves to ``approved`` with the largest contributor as ``lender_id``. Each
+batch of loans is persisted in one transaction, which locks the lenders,
+then the loans (the order approvals use), and re-checks both before
+writing. Loans approved, assigned or deleted since they were selected make
+the batch conflict; it is rematched without them.
+
+Run as a job with ``python -m matching``.
+"""
+import heapq
+import os
+from bisect import bisect_right
+from datetime import date
+
+from sqlalchemy import bindparam, insert, select, text, update
+
+from aggregates import StatsDelta, apply_delta
+from models import PENDING_UNASSIGNED, Lender, Loan, LoanFunding, LoanStatus
+
+MATCH_BATCH_SIZE = int(os.getenv("MATCH_BATCH_SIZE", "5000"))
+MATCH_MAX_LENDERS_PER_LOAN = int(os.getenv("MATCH_MAX_LENDERS_PER_LOAN", "10"))
+# Rate appetites are bucketed to this granularity (percentage points)
+RATE_BUCKET_STEP = 0.5
+MAX_BATCH_RETRIES = 3
+
+# Funds below this are treated as exhausted (Float columns)
+EPSILON = 0.005
+
+
+class LenderBook:
+    def __init__(self, lenders):
+        """``lenders`` is an iterable of
+        ``(lender_id, credit_score, available_funds, min_interest_rate)``."""
+        self.funds = {}
+        self._buckets = {}
+        for lender_id, credit_score, available_funds, min_rate in lenders:
+            if not available_funds or available_funds < EPSILON:
+                continue
+            # Round appetite up so a bucket never admits a rate the lender refuses
+            step = -(-(min_rate or 0.0) // RATE_BUCKET_STEP) * RATE_BUCKET_STEP
+            self.funds[lender_id] = available_funds
+            self._buckets.setdefault(step, []).append((-(credit_score or 0.0), -available_funds, lender_id))
+        for heap in self._buckets.values():
+            heapq.heapify(heap)
+        self._thresholds = sorted(self._buckets)
+        self._heaps = [self._buckets[t] for t in self._thresholds]
+
+    def _best_heap(self, eligible):
+        best = None
+        for heap in self._heaps[:eligible]:
+            if heap and (best is None or heap[0] < best[0]):
+                best = heap
+        return best
+
+    def allocate(self, amount, rate, max_lenders=MATCH_MAX_LENDERS_PER_LOAN):
+        """Fund ``amount`` at ``rate`` from the best eligible lenders. Returns
+        ``[(lender_id, amount), ...]`` or None, leaving the book untouched
+        when the loan cannot be fully funded."""
+        # Nothing to fund: a matched loan needs at least one contributor
+        if amount is None or amount < EPSILON:
+            return None
+        eligible = bisect_right(self._thresholds, rate)
+        remaining = amount
+        taken = []
+        while remaining >= EPSILON and len(taken) < max_lenders:
+            heap = self._best_heap(eligible)
+            if heap is None:
+                break
+            entry = heapq.heappop(heap)
+            lender_id = entry[2]
+            share = min(remaining, self.funds[lender_id])
+            taken.append((heap, entry, lender_id, share))
+            remaining -= share
+
+        if remaining >= EPSILON:
+            for heap, entry, _, _ in taken:
+                heapq.heappush(heap, entry)
+            return None
+
+        allocation = []
+        for heap, entry, lender_id, share in taken:
+            left = self.funds[lender_id] - share
+            self.funds[lender_id] = left
+            if left >= EPSILON:
+                heapq.heappush(heap, (entry[0], -left, lender_id))
+            allocation.append((lender_id, share))
+        return allocation
+
+
+class MatchResult:
+    def __init__(self):
+        self.batches = 0
+        self.examined = 0
+        self.matched = 0
+        self.unmatched = 0
+        self.funded_amount = 0.0
+        self.conflicts = 0
+        self.loan_ids = []
+        self.lender_ids = set()
+
+    def as_dict(self):
+        return {
+            "batches": self.batches,
+            "examined": self.examined,
+            "matched": self.matched,
+            "unmatched": self.unmatched,
+            "funded_amount": round(self.funded_amount, 2),
+            "lenders_used": len(self.lender_ids),
+            "conflicts": self.conflicts,
+        }
+
+
+def load_book(db):
+    rows = db.execute(
+        select(Lender.lender_id, Lender.credit_score, Lender.available_funds, Lender.min_interest_rate)
+        .where(Lender.available_funds >= EPSILON)
+    )
+    return LenderBook(rows)
+
+
+def match_batch(book, loans, max_lenders=MATCH_MAX_LENDERS_PER_LOAN):
+    matches = []
+    for loan_id, amount, rate in loans:
+        allocation = book.allocate(amount, rate, max_lenders)
+        if allocation is not None:
+            matches.append((loan_id, allocation))
+    return matches
+
+
+class FundsConflict(Exception):
+    pass
+
+
+def persist_batch(db, matches, today):
+    """Write one batch of matches. Raises FundsConflict if a lender's funds
+    or a loan's state changed since the book was loaded."""
+    debits = {}
+    fundings = []
+    loan_updates = []
+    delta = StatsDelta()
+    for loan_id, allocation in matches:
+        lead = max(allocation, key=lambda a: a[1])[0]
+        loan_updates.append({"b_loan_id": loan_id, "b_lender_id": lead})
+        # A matched loan is fully funded, so its amount is the sum of the shares
+        delta.loan_status_changed(LoanStatus.pending, LoanStatus.approved, sum(share for _, share in allocation))
+        for lender_id, share in allocation:
+            debits[lender_id] = debits.get(lender_id, 0.0) + share
+            delta.loan_funded(lender_id, share)
+            fundings.append({"loan_id": loan_id, "lender_id": lender_id, "amount": share, "funded_date": today})
+
+    conn = db.connection()
+    sane_rowcount = conn.dialect.supports_sane_multi_rowcount
+
+    # Lock the lenders we are about to debit and check their funds
+    locked = dict(db.execute(
+        select(Lender.lender_id, Lender.available_funds)
+        .where(Lender.lender_id.in_(debits))
+        .order_by(Lender.lender_id)
+        .with_for_update()
+    ).all())
+    if any(locked.get(lender_id, 0.0) + EPSILON < amount for lender_id, amount in debits.items()):
+        raise FundsConflict()
+
+    # Then the loans: the guarded UPDATE below can't be trusted to report a
+    # miss (psycopg2 and asyncpg have no sane executemany rowcount)
+    loan_ids = [update["b_loan_id"] for update in loan_updates]
+    if len(still_pending(db, loan_ids, lock=True)) != len(loan_ids):
+        raise FundsConflict()
+
+    result = conn.execute(
+        update(Lender.__table__)
+        .where(Lender.lender_id == bindparam("b_lender_id"))
+        .where(Lender.available_funds >= bindparam("b_amount") - EPSILON)
+        .values(available_funds=Lender.available_funds - bindparam("b_amount")),
+        [{"b_lender_id": lender_id, "b_amount": amount} for lender_id, amount in debits.items()],
+    )
+    if sane_rowcount and result.rowcount != len(debits):
+        raise FundsConflict()
+
+    result = conn.execute(
+        update(Loan.__table__)
+        .where(Loan.loan_id == bindparam("b_loan_id"))
+        .where(Loan.status == LoanStatus.pending)
+        .where(Loan.lender_id.is_(None))
+        .values(lender_id=bindparam("b_lender_id"), status=LoanStatus.approved, approval_date=today),
+        loan_updates,
+    )
+    if sane_rowcount and result.rowcount != len(loan_updates):
+        raise FundsConflict()
+
+    conn.execute(insert(LoanFunding.__table__), fundings)
+    apply_delta(db, delta)
+
+
+def still_pending(db, loan_ids, lock=False):
+    stmt = select(Loan.loan_id).where(Loan.loan_id.in_(loan_ids)).where(text(PENDING_UNASSIGNED))
+    if lock:
+        stmt = stmt.order_by(Loan.loan_id).with_for_update()
+    return set(db.scalars(stmt))
+
+
+def pending_loans_statement(after_id, batch_size):
+    # Served by the partial index ix_loans_pending_unassigned
+    return (
+        select(Loan.loan_id, Loan.amount, Loan.interest_rate)
+        .where(text(PENDING_UNASSIGNED))
+        .where(Loan.loan_id > after_id)
+        .order_by(Loan.loan_id)
+        .limit(batch_size)
+    )
+
+
+def run_matching(session_factory, batch_size=MATCH_BATCH_SIZE, max_lenders=MATCH_MAX_LENDERS_PER_LOAN):
+    result = MatchResult()
+    today = date.today()
+    with session_factory() as db:
+        book = load_book(db)
+
+    after_id = 0
+    while True:
+        with session_factory() as db:
+            loans = db.execute(pending_loans_statement(after_id, batch_size)).all()
+            if not loans:
+                break
+            after_id = loans[-1].loan_id
+            result.examined += len(loans)
+
+            for attempt in range(MAX_BATCH_RETRIES):
+                matches = match_batch(book, loans, max_lenders)
+                if not matches:
+                    break
+                try:
+                    persist_batch(db, matches, today)
+                    db.commit()
+                    break
+                except FundsConflict:
+                    # Someone else moved money or loans; reload and rematch
+                    # the loans that are still waiting for a lender
+                    db.rollback()
+                    result.conflicts += 1
+                    book = load_book(db)
+                    pending = still_pending(db, [loan.loan_id for loan in loans])
+                    loans = [loan for loan in loans if loan.loan_id in pending]
+                    matches = []
+            result.batches += 1
+            result.matched += len(matches)
+            result.unmatched += len(loans) - len(matches)
+            for loan_id, allocation in matches:
+                result.loan_ids.append(loan_id)
+                for lender_id, share in allocation:
+                    result.lender_ids.add(lender_id)
+                    result.funded_amount += share
+    return result
+
+
+if __name__ == "__main__":
+    from database import SessionLocal
+
+    print(run_matching(SessionLocal).as_dict())
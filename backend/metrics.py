@@ -0,0 +1,268 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, Histogram, generate_latest
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, HistogramMetricFamily
+from sqlalchemy import event
+from starlette.responses import Response
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100, 250)
+HASH_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.2, 0.3, 0.5, 0.75, 1.0, 2.0, 5.0)
+
+
+class RequestHistogram:
+    """Lock-free histogram for values recorded on the event loop thread.
+
+    prometheus_client's Histogram takes a lock per bucket increment; these
+    request-path histograms only ever run on the loop, so plain lists and a
+    C-level bisect are enough. Buckets are made cumulative at scrape time.
+    """
+
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.bounds = tuple(buckets)
+        self._series = {}
+
+    def child(self, labels):
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.bounds) + 1), 0.0]
+        counts = series[0]
+        bounds = self.bounds
+
+        def observe(value):
+            counts[bisect_left(bounds, value)] += 1
+            series[1] += value
+
+        return observe
+
+    def metric_family(self, label_names):
+        family = HistogramMetricFamily(self.name, self.documentation, labels=label_names)
+        for labels, (counts, total) in list(self._series.items()):
+            cumulative = 0
+            buckets = []
+            for bound, count in zip(self.bounds + (float("inf"),), counts):
+                cumulative += count
+                buckets.append(("+Inf" if bound == float("inf") else str(bound), cumulative))
+            family.add_metric(list(labels), buckets, total)
+        return family
+
+
+REQUEST_DURATION = RequestHistogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", LATENCY_BUCKETS)
+DB_QUERIES = RequestHistogram(
+    "http_request_db_queries", "SQL statements executed per request", QUERY_COUNT_BUCKETS)
+DB_TIME = RequestHistogram(
+    "http_request_db_seconds", "Time spent executing SQL per request", LATENCY_BUCKETS)
+_request_counts = {}
+
+POOL_WAIT = Histogram(
+    "db_pool_checkout_wait_seconds", "Time spent waiting for a pooled connection",
+    ["engine"], buckets=LATENCY_BUCKETS,
+)
+HASH_DURATION = Histogram(
+    "password_hash_seconds", "bcrypt hashing time inside the worker process",
+    buckets=HASH_BUCKETS,
+)
+HASH_QUEUE_WAIT = Histogram(
+    "password_hash_queue_wait_seconds", "Time a hash request waited for a worker",
+    buckets=HASH_BUCKETS,
+)
+
+class RequestDBStats:
+    """SQL executed on behalf of the request being served. Shared by
+    reference with any threadpool work the request spawns. ``statements``
+    counts executions per SQL string when statement tracking is on."""
+
+    __slots__ = ("queries", "seconds", "statements")
+
+    def __init__(self, track_statements=False):
+        self.queries = 0
+        self.seconds = 0.0
+        self.statements = {} if track_statements else None
+
+
+_request_db_stats = ContextVar("request_db_stats", default=None)
+# Called as (statement, parameters, executemany, seconds) after every
+# statement, inside requests or not (see profiling.py)
+_query_observer = None
+
+
+def current_db_stats():
+    return _request_db_stats.get()
+
+
+def set_query_observer(observer):
+    global _query_observer
+    _query_observer = observer
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute
+    conn = context.connection
+    if conn is not None and conn.info.get("query_start"):
+        conn.info["query_start"].pop()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    stats = _request_db_stats.get()
+    if stats is not None:
+        stats.queries += 1
+        stats.seconds += elapsed
+        if stats.statements is not None:
+            stats.statements[statement] = stats.statements.get(statement, 0) + 1
+    if _query_observer is not None:
+        _query_observer(statement, parameters, executemany, elapsed)
+
+
+def instrument_engine(engine, name):
+    """Count statements per request and time pool checkouts for ``engine``
+    (a sync Engine; pass ``async_engine.sync_engine`` for async engines)."""
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+    # The pool has no "checkout started" event, so time the blocking get itself
+    pool = engine.pool
+    do_get = pool._do_get
+    observe = POOL_WAIT.labels(name).observe
+
+    def timed_do_get():
+        start = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            observe(time.perf_counter() - start)
+
+    pool._do_get = timed_do_get
+
+
+def observe_hash(hash_seconds, wait_seconds):
+    HASH_DURATION.observe(hash_seconds)
+    HASH_QUEUE_WAIT.observe(wait_seconds)
+
+
+class RequestCollector:
+    """Exports the request-path counters and histograms."""
+
+    def collect(self):
+        requests = CounterMetricFamily(
+            "http_requests", "HTTP requests by route template and status",
+            labels=["method", "handler", "status_code"])
+        for (method, handler, status), count in list(_request_counts.items()):
+            requests.add_metric([method, handler, str(status)], count[0])
+        yield requests
+        for histogram in (REQUEST_DURATION, DB_QUERIES, DB_TIME):
+            yield histogram.metric_family(["method", "handler"])
+
+
+class PoolCollector:
+    """Exports connection pool occupancy at scrape time."""
+
+    def __init__(self, engines):
+        self.engines = engines
+
+    def collect(self):
+        gauges = {
+            "size": GaugeMetricFamily("db_pool_size", "Configured pool size", labels=["engine"]),
+            "checkedout": GaugeMetricFamily("db_pool_checked_out", "Connections in use", labels=["engine"]),
+            "overflow": GaugeMetricFamily("db_pool_overflow", "Connections beyond pool size", labels=["engine"]),
+            "checkedin": GaugeMetricFamily("db_pool_checked_in", "Idle pooled connections", labels=["engine"]),
+        }
+        for name, engine in self.engines.items():
+            pool = engine.pool
+            for attr, gauge in gauges.items():
+                method = getattr(pool, attr, None)
+                if method is not None:
+                    gauge.add_metric([name], method())
+        return list(gauges.values())
+
+
+class StatsCollector:
+    """Exports every numeric field of ``stats_fn()`` as a ``<prefix>_<field>``
+    gauge, or as a ``<prefix>_<field>_total`` counter for the fields named
+    in ``counters``, so rate() can be applied to them."""
+
+    def __init__(self, prefix, stats_fn, counters=()):
+        self.prefix = prefix
+        self.stats_fn = stats_fn
+        self.counters = frozenset(counters)
+
+    def collect(self):
+        for key, value in self.stats_fn().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                family = CounterMetricFamily if key in self.counters else GaugeMetricFamily
+                metric = family(f"{self.prefix}_{key}", f"{self.prefix} {key.replace('_', ' ')}")
+                metric.add_metric([], value)
+                yield metric
+
+
+class PrometheusMiddleware:
+    """Pure ASGI middleware recording request count, latency and per-request
+    SQL statistics, labelled by route template rather than raw path."""
+
+    def __init__(self, app, track_statements=False):
+        self.app = app
+        self.track_statements = track_statements
+        self._children = {}
+
+    def _observers(self, method, handler, status):
+        key = (method, handler, status)
+        children = self._children.get(key)
+        if children is None:
+            labels = (method, handler)
+            children = (
+                _request_counts.setdefault(key, [0]),
+                REQUEST_DURATION.child(labels),
+                DB_QUERIES.child(labels),
+                DB_TIME.child(labels),
+            )
+            self._children[key] = children
+        return children
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        stats = RequestDBStats(self.track_statements)
+        token = _request_db_stats.set(stats)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            _request_db_stats.reset(token)
+            route = scope.get("route")
+            handler = route.path if route is not None else "unmatched"
+            count, observe_latency, observe_queries, observe_db_time = self._observers(
+                scope["method"], handler, status)
+            count[0] += 1
+            observe_latency(elapsed)
+            observe_queries(stats.queries)
+            observe_db_time(stats.seconds)
+
+
+def register_collectors(*collectors):
+    for collector in collectors:
+        REGISTRY.register(collector)
+
+
+def metrics_response():
+    return Response(generate_latest(REGISTRY), media_type=CONTENT_TYPE_LATEST)
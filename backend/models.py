@@ -0,0 +1,165 @@
+from sqlalchemy import (Column, Integer, BigInteger, String, Float, Date, DateTime, ForeignKey, Enum, Index, LargeBinary,
+                        Text, text)
+from datetime import datetime
+import enum
+
+from database import Base
+
+# Enums
+class LoanStatus(str, enum.Enum):
+    pending = "pending"
+    approved = "approved"
+    rejected = "rejected"
+    paid = "paid"
+
+class LedgerKind(str, enum.Enum):
+    interest = "interest"
+    repayment = "repayment"
+
+# Predicate of the partial index on unassigned pending loans. Queries that
+# should use the index repeat it verbatim: a bound parameter (status = ?)
+# does not let the planner prove the index applies.
+PENDING_UNASSIGNED = "status = 'pending' AND lender_id IS NULL"
+
+# Database models
+class User(Base):
+    __tablename__ = "users"
+    user_id = Column(Integer, primary_key=True)
+    username = Column(String(30), unique=True)
+    password = Column(String)
+    email = Column(String, unique=True)
+    phone_number = Column(String(15))
+
+class Lender(Base):
+    __tablename__ = "lenders"
+    lender_id = Column(Integer, primary_key=True)
+    name = Column(String)
+    email = Column(String, unique=True)
+    credit_score = Column(Float)
+    available_funds = Column(Float)
+    # Lowest interest rate (%) this lender will fund; used by the matching engine
+    min_interest_rate = Column(Float, default=0.0)
+    registration_date = Column(Date, default=datetime.now().date())
+
+class Loan(Base):
+    __tablename__ = "loans"
+    loan_id = Column(Integer, primary_key=True)
+    borrower_id = Column(Integer, ForeignKey("users.user_id"))
+    lender_id = Column(Integer, ForeignKey("lenders.lender_id"))
+    amount = Column(Float)
+    interest_rate = Column(Float)
+    term_months = Column(Integer)
+    purpose = Column(String)
+    status = Column(Enum(LoanStatus), default=LoanStatus.pending)
+    creation_date = Column(Date, default=datetime.now().date())
+    approval_date = Column(Date)
+
+    # Composite indexes end in (creation_date, loan_id) so filtered searches can
+    # walk them in keyset order without a sort (see /loans/search)
+    __table_args__ = (
+        # Unassigned loans are left out: "lender_id = ?" still implies the
+        # predicate, and the matching scan below is not tempted by this index
+        Index("ix_loans_lender_status_created", "lender_id", "status", "creation_date", "loan_id",
+              postgresql_where=text("lender_id IS NOT NULL"), sqlite_where=text("lender_id IS NOT NULL")),
+        Index("ix_loans_borrower_created", "borrower_id", "creation_date", "loan_id"),
+        Index("ix_loans_status_created", "status", "creation_date", "loan_id"),
+        # Small partial index for the matching engine's scan of unassigned pending loans
+        Index("ix_loans_pending_unassigned", "loan_id",
+              postgresql_where=text(PENDING_UNASSIGNED), sqlite_where=text(PENDING_UNASSIGNED)),
+    )
+
+class LoanFunding(Base):
+    # One row per lender contributing to a loan; matched loans may be split
+    __tablename__ = "loan_fundings"
+    funding_id = Column(Integer, primary_key=True)
+    loan_id = Column(Integer, ForeignKey("loans.loan_id"), index=True)
+    lender_id = Column(Integer, ForeignKey("lenders.lender_id"), index=True)
+    amount = Column(Float)
+    funded_date = Column(Date)
+
+class PlatformStat(Base):
+    # Platform-wide running totals (see aggregates.py). Each metric is split
+    # over STATS_STRIPES rows so concurrent writers rarely touch the same row;
+    # the value is the sum over stripes.
+    __tablename__ = "platform_stats"
+    stripe = Column(Integer, primary_key=True)
+    metric = Column(String(40), primary_key=True)
+    value = Column(Float, default=0.0)
+
+class LenderStat(Base):
+    # Per-lender running totals, maintained with the lender's funding writes
+    __tablename__ = "lender_stats"
+    lender_id = Column(Integer, primary_key=True)
+    funded_loans = Column(Integer, default=0)
+    funded_amount = Column(Float, default=0.0)
+    outstanding = Column(Float, default=0.0)
+
+class LedgerEntry(Base):
+    # Append-only money movements on a loan (see ledger.py). Rows are never
+    # updated or deleted; there is no foreign key so nightly bulk inserts
+    # don't pay for a lookup per row. The id is 64-bit: one accrual entry per
+    # active loan per day adds up.
+    __tablename__ = "ledger_entries"
+    entry_id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    loan_id = Column(Integer, nullable=False)
+    entry_date = Column(Date, nullable=False)
+    kind = Column(Enum(LedgerKind), nullable=False)
+    amount = Column(Float, nullable=False)
+    principal = Column(Float, default=0.0)
+    interest = Column(Float, default=0.0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        # A loan's history in date order, and the day's entries for reports
+        Index("ix_ledger_loan_date", "loan_id", "entry_date", "entry_id"),
+        Index("ix_ledger_date", "entry_date"),
+        # At most one interest accrual per loan and day, even if a job is rerun
+        Index("ux_ledger_interest_loan_date", "loan_id", "entry_date", unique=True,
+              postgresql_where=text("kind = 'interest'"), sqlite_where=text("kind = 'interest'")),
+    )
+
+class LoanBalance(Base):
+    # What is still owed on an approved loan, kept in step with the ledger
+    __tablename__ = "loan_balances"
+    loan_id = Column(Integer, primary_key=True)
+    principal = Column(Float, nullable=False)
+    accrued_interest = Column(Float, default=0.0)
+    last_accrual_date = Column(Date)
+
+class AccrualRun(Base):
+    # Checkpoint of the nightly accrual job: loans up to last_loan_id are done
+    __tablename__ = "accrual_runs"
+    run_date = Column(Date, primary_key=True)
+    last_loan_id = Column(Integer, default=0)
+    loans_processed = Column(Integer, default=0)
+    entries_written = Column(Integer, default=0)
+    interest_total = Column(Float, default=0.0)
+    loans_paid = Column(Integer, default=0)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+
+class IdempotencyRecord(Base):
+    # Stored responses for the table-backed Idempotency-Key store; a row with
+    # no status_code is a request still being executed by some worker
+    __tablename__ = "idempotency_keys"
+    key = Column(String(320), primary_key=True)
+    fingerprint = Column(String(64))
+    status_code = Column(Integer)
+    headers = Column(Text)
+    body = Column(LargeBinary)
+    created_at = Column(DateTime, index=True)
+
+class ArchivePart(Base):
+    # One immutable set of column files holding archived loans (see
+    # archive.py). The row is inserted in the transaction that deletes the
+    # loans, so a database snapshot always agrees with the archive it lists.
+    __tablename__ = "archive_parts"
+    part_id = Column(Integer, primary_key=True)
+    # Month of the loans' creation_date, YYYY-MM
+    partition = Column(String(7), nullable=False, index=True)
+    loans = Column(Integer, nullable=False)
+    fundings = Column(Integer, nullable=False)
+    min_loan_id = Column(Integer)
+    max_loan_id = Column(Integer)
+    size_bytes = Column(BigInteger)
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,124 @@
+import base64
+import binascii
+import json
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, tuple_
+
+from serialization import FastJSONResponse, dumps
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+STREAM_BATCH_SIZE = 1000
+
+
+def encode_cursor(last_key):
+    payload = dumps({"after": last_key})
+    return base64.urlsafe_b64encode(payload).decode()
+
+
+def decode_cursor(token):
+    try:
+        return json.loads(base64.urlsafe_b64decode(token.encode()))["after"]
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
+def _keyset_select(columns, key_column, cursor):
+    stmt = select(*columns).order_by(key_column)
+    if cursor:
+        stmt = stmt.where(key_column > decode_cursor(cursor))
+    return stmt
+
+
+async def keyset_page(db, columns, key_column, cursor=None, limit=None):
+    """One page of rows ordered by ``key_column``, fetched with
+    ``WHERE key > :after LIMIT n`` so every page costs the same no matter how
+    deep the client has paged."""
+    limit = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    stmt = _keyset_select(columns, key_column, cursor).limit(limit + 1)
+    rows = (await db.execute(stmt)).all()
+
+    items = [dict(row._mapping) for row in rows[:limit]]
+    next_cursor = encode_cursor(items[-1][key_column.key]) if len(rows) > limit else None
+    return {"items": items, "next_cursor": next_cursor}
+
+
+async def sorted_page(db, stmt, sort_column, key_column, cursor=None, limit=None, descending=False,
+                      parse_sort=None):
+    """Keyset page of ``stmt`` ordered by ``(sort_column, key_column)``. The
+    cursor carries both values of the last row and the next page starts with
+    a row-value comparison, so an index on ``(..., sort_column, key_column)``
+    serves any depth. ``parse_sort`` turns the JSON cursor value back into a
+    bind value (e.g. ``date.fromisoformat``)."""
+    limit = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    same_key = sort_column is key_column
+    if same_key:
+        order = (key_column.desc(),) if descending else (key_column,)
+    else:
+        order = (sort_column.desc(), key_column.desc()) if descending else (sort_column, key_column)
+    stmt = stmt.order_by(*order)
+
+    if cursor:
+        after = decode_cursor(cursor)
+        try:
+            sort_value, key = after
+            if parse_sort is not None:
+                sort_value = parse_sort(sort_value)
+        except (TypeError, ValueError):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        if same_key:
+            stmt = stmt.where(key_column < key if descending else key_column > key)
+        else:
+            boundary = tuple_(sort_column, key_column)
+            stmt = stmt.where(boundary < (sort_value, key) if descending else boundary > (sort_value, key))
+
+    rows = (await db.execute(stmt.limit(limit + 1))).all()
+    items = [dict(row._mapping) for row in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor([last[sort_column.key], last[key_column.key]])
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def ndjson_stream(session_factory, columns, key_column, cursor=None, limit=None):
+    """Stream rows as NDJSON from a server-side cursor. The last line is
+    always ``{"next_cursor": ...}``; it is null once the table is exhausted."""
+    stmt = _keyset_select(columns, key_column, cursor)
+    if limit:
+        stmt = stmt.limit(limit + 1)
+    stmt = stmt.execution_options(yield_per=STREAM_BATCH_SIZE)
+
+    async def generate():
+        sent = 0
+        last_key = None
+        more = False
+        async with session_factory() as session:
+            result = await session.stream(stmt)
+            async for partition in result.partitions():
+                lines = []
+                for row in partition:
+                    if limit and sent == limit:
+                        more = True
+                        break
+                    item = dict(row._mapping)
+                    last_key = item[key_column.key]
+                    lines.append(dumps(item))
+                    sent += 1
+                if lines:
+                    yield b"\n".join(lines) + b"\n"
+                if more:
+                    break
+            await result.close()
+        next_cursor = encode_cursor(last_key) if more else None
+        yield dumps({"next_cursor": next_cursor}) + b"\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+
+async def list_rows(db, session_factory, columns, key_column, cursor=None, limit=None, stream=False):
+    if stream:
+        return ndjson_stream(session_factory, columns, key_column, cursor, limit)
+    return FastJSONResponse(await keyset_page(db, columns, key_column, cursor, limit))
@@ -0,0 +1,140 @@
+"""Seeds a database with users, lenders and loans for the perf suite.
+
+Rows are generated from a fixed random seed, so a given scale always
+produces the same data, and inserted in chunks with executemany. Ids start
+at 1 on an empty database, which is what the request mixes assume. Approved
+and paid loans get a funding row from their lender, and the aggregate
+tables are backfilled at the end.
+
+Run from backend/:
+
+    python -m perf.datagen --scale medium
+    python -m perf.datagen --users 500 --lenders 2000 --loans 250000
+
+Uses DATABASE_URL (SQLite or PostgreSQL); the tables must be empty.
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from passlib.context import CryptContext
+from sqlalchemy import func, insert, select
+
+import aggregates
+from database import Base, SessionLocal, engine
+from models import Lender, Loan, LoanFunding, LoanStatus, User
+
+CHUNK_SIZE = 50_000
+HISTORY_DAYS = 2 * 365
+# Every seeded user shares one password; hashing it per row would dominate
+PASSWORD = "Perf-Pass-123"
+PURPOSES = ("car", "home", "education", "business", "medical", "travel", "debt consolidation")
+STATUSES = (LoanStatus.pending, LoanStatus.approved, LoanStatus.rejected, LoanStatus.paid)
+STATUS_WEIGHTS = (3, 4, 1, 2)
+
+SCALES = {
+    "tiny": {"users": 50, "lenders": 50, "loans": 1_000},
+    "small": {"users": 1_000, "lenders": 500, "loans": 20_000},
+    "medium": {"users": 10_000, "lenders": 2_000, "loans": 200_000},
+    "large": {"users": 100_000, "lenders": 10_000, "loans": 1_000_000},
+}
+
+
+def _chunks(count, make):
+    for start in range(0, count, CHUNK_SIZE):
+        yield [make(n) for n in range(start, min(start + CHUNK_SIZE, count))]
+
+
+def seed(users, lenders, loans, random_seed=1):
+    """Inserts the rows and returns the counts, for the mix's id ranges."""
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        if db.scalar(select(func.count()).select_from(Loan)) or db.scalar(select(func.count()).select_from(User)):
+            raise SystemExit("perf.datagen needs an empty database")
+
+    rng = random.Random(random_seed)
+    today = date.today()
+    first = today - timedelta(days=HISTORY_DAYS)
+    password = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4).hash(PASSWORD)
+
+    with SessionLocal() as db:
+        for rows in _chunks(users, lambda n: {
+            "username": f"perfuser{n:07d}", "password": password, "email": f"perfuser{n}@example.com",
+            "phone_number": f"+1555{n:07d}",
+        }):
+            db.execute(insert(User.__table__), rows)
+        for rows in _chunks(lenders, lambda n: {
+            "name": f"Perf Lender {n}", "email": f"perflender{n}@example.com",
+            "credit_score": float(rng.randrange(550, 850)), "available_funds": float(rng.randrange(10_000, 1_000_000)),
+            "min_interest_rate": float(rng.choice((0, 3, 5, 8))), "registration_date": first,
+        }):
+            db.execute(insert(Lender.__table__), rows)
+        db.commit()
+
+    def loan(n):
+        status = rng.choices(STATUSES, weights=STATUS_WEIGHTS)[0]
+        created = first + timedelta(days=n * HISTORY_DAYS // max(loans, 1))
+        return {
+            "borrower_id": rng.randrange(users) + 1,
+            "lender_id": None if status == LoanStatus.pending and rng.random() < 0.5 else rng.randrange(lenders) + 1,
+            "amount": float(rng.randrange(500, 50_000)), "interest_rate": round(rng.uniform(3, 25), 2),
+            "term_months": rng.choice((12, 24, 36, 60)), "purpose": rng.choice(PURPOSES), "status": status,
+            "creation_date": created,
+            "approval_date": created if status in (LoanStatus.approved, LoanStatus.paid) else None,
+        }
+
+    next_id = 1
+    for rows in _chunks(loans, loan):
+        with SessionLocal() as db:
+            db.execute(insert(Loan.__table__), rows)
+            fundings = [
+                {"loan_id": loan_id, "lender_id": row["lender_id"], "amount": row["amount"],
+                 "funded_date": row["approval_date"]}
+                for loan_id, row in enumerate(rows, next_id)
+                if row["status"] in (LoanStatus.approved, LoanStatus.paid)
+            ]
+            if fundings:
+                db.execute(insert(LoanFunding.__table__), fundings)
+            db.commit()
+        next_id += len(rows)
+
+    with engine.begin() as conn:
+        aggregates.backfill(conn)
+    return {"users": users, "lenders": lenders, "loans": loans}
+
+
+def id_pools(db):
+    """Ids the mixes draw from for state-changing requests: pending loans
+    with a lender (approvable) and approved loans (repayable)."""
+    return {
+        "pending_loan": list(db.scalars(
+            select(Loan.loan_id).where(Loan.status == LoanStatus.pending).where(Loan.lender_id.isnot(None))
+            .order_by(Loan.loan_id))),
+        "approved_loan": list(db.scalars(
+            select(Loan.loan_id).where(Loan.status == LoanStatus.approved).order_by(Loan.loan_id))),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--lenders", type=int)
+    parser.add_argument("--loans", type=int)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    counts = dict(SCALES[args.scale])
+    for name in counts:
+        if getattr(args, name) is not None:
+            counts[name] = getattr(args, name)
+    start = time.perf_counter()
+    seed(random_seed=args.seed, **counts)
+    elapsed = time.perf_counter() - start
+    print(f"seeded {counts['users']:,} users, {counts['lenders']:,} lenders and {counts['loans']:,} loans "
+          f"in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""In-process ASGI driver, and the closed loop shared with the HTTP load generator.
+
+The ASGI driver runs main.app in this process through httpx's
+ASGITransport: no sockets and no server, so it measures the application
+(routing, middleware, validation, SQL, serialization) and is the most
+repeatable way to compare two versions of main.py. Use perf.loadgen for
+numbers that include uvicorn and the network stack.
+"""
+import asyncio
+import time
+
+import httpx
+
+from perf.mix import RequestFactory
+from perf.report import Results, db_query_totals
+
+REQUEST_TIMEOUT = 60
+
+
+async def drive(client, factory, results, start_at, end_at):
+    """One closed-loop worker: sends the next request when the previous one
+    returns. Requests started before ``start_at`` (warm-up) aren't recorded."""
+    while True:
+        now = time.time()
+        if now >= end_at:
+            return
+        route, method, url, kwargs = factory.next()
+        began = time.perf_counter()
+        try:
+            status = (await client.request(method, url, **kwargs)).status_code
+        except httpx.HTTPError:
+            status = "error"
+        if now >= start_at:
+            results.record(route, time.perf_counter() - began, status)
+
+
+async def scrape_db_queries(client):
+    response = await client.get("/metrics")
+    response.raise_for_status()
+    return db_query_totals(response.text)
+
+
+async def run_asgi(entries, counts, run_token, concurrency, warmup, duration, pools=None):
+    """Returns ``(results, elapsed, db_before, db_after)``."""
+    import main
+
+    results = Results()
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://perf", timeout=REQUEST_TIMEOUT) as client:
+            start_at = time.time() + warmup
+            end_at = start_at + duration
+            workers = asyncio.gather(*(
+                drive(client, RequestFactory(entries, counts, run_token, worker=i, random_seed=i, pools=pools,
+                                             workers=concurrency),
+                      results, start_at, end_at)
+                for i in range(concurrency)
+            ))
+            await asyncio.sleep(max(0.0, start_at - time.time()))
+            db_before = await scrape_db_queries(client)
+            await workers
+            db_after = await scrape_db_queries(client)
+    return results, duration, db_before, db_after
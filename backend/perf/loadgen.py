@@ -0,0 +1,121 @@
+"""Multi-process HTTP load generator.
+
+Starts uvicorn in a subprocess (or targets ``--url``) and drives it from
+``processes`` worker processes, each running ``concurrency / processes``
+closed-loop connections with httpx, so the client isn't limited to one
+core. Workers warm up together, record only the measured window, and send
+their results back to the parent, which scrapes /metrics at both ends of
+the window for the SQL statement counts.
+
+The server runs a single uvicorn worker so /metrics covers every request;
+against a multi-worker ``--url`` the SQL counts are only the scraped
+worker's.
+"""
+import asyncio
+import os
+import socket
+import subprocess
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+import httpx
+
+from perf.driver import REQUEST_TIMEOUT, drive
+from perf.mix import RequestFactory
+from perf.report import Results, db_query_totals
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Time allowed for the worker processes to start before the warm-up begins
+SPAWN_SECONDS = 3.0
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port, env=None):
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning",
+         "--no-access-log"],
+        cwd=BACKEND_DIR, env=dict(os.environ, **(env or {})),
+    )
+
+
+def wait_ready(base_url, server=None, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if server is not None and server.poll() is not None:
+            raise RuntimeError(f"server exited with {server.returncode}")
+        try:
+            if httpx.get(f"{base_url}/health/ready").status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError("server did not become ready")
+
+
+def scrape_db_queries(base_url):
+    response = httpx.get(f"{base_url}/metrics", timeout=REQUEST_TIMEOUT)
+    response.raise_for_status()
+    return db_query_totals(response.text)
+
+
+async def _worker_loop(base_url, entries, counts, pools, run_token, first_worker, connections, workers, begin_at,
+                       start_at, end_at):
+    results = Results()
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=REQUEST_TIMEOUT) as client:
+        await asyncio.sleep(max(0.0, begin_at - time.time()))
+        await asyncio.gather(*(
+            drive(client, RequestFactory(entries, counts, run_token, worker=first_worker + i,
+                                         random_seed=first_worker + i, pools=pools, workers=workers),
+                  results, start_at, end_at)
+            for i in range(connections)
+        ))
+    return results
+
+
+def _worker(args):
+    return asyncio.run(_worker_loop(*args))
+
+
+def run_http(entries, counts, run_token, concurrency, warmup, duration, processes, url=None, server_env=None,
+             pools=None):
+    """Returns ``(results, elapsed, db_before, db_after)``."""
+    server = None
+    base_url = url
+    if base_url is None:
+        port = free_port()
+        base_url = f"http://127.0.0.1:{port}"
+        server = start_server(port, server_env)
+    try:
+        wait_ready(base_url, server)
+        processes = max(1, min(processes, concurrency))
+        begin_at = time.time() + SPAWN_SECONDS
+        start_at = begin_at + warmup
+        end_at = start_at + duration
+        jobs = []
+        first_worker = 0
+        for index in range(processes):
+            connections = concurrency // processes + (1 if index < concurrency % processes else 0)
+            jobs.append((base_url, entries, counts, pools, run_token, first_worker, connections, concurrency,
+                         begin_at, start_at, end_at))
+            first_worker += connections
+        with ProcessPoolExecutor(processes, mp_context=get_context("spawn")) as pool:
+            futures = [pool.submit(_worker, job) for job in jobs]
+            time.sleep(max(0.0, start_at - time.time()))
+            db_before = scrape_db_queries(base_url)
+            results = Results()
+            for future in futures:
+                results.merge(future.result())
+        db_after = scrape_db_queries(base_url)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+    return results, duration, db_before, db_after
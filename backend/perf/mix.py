@@ -0,0 +1,125 @@
+"""Request mixes: JSONL files describing the traffic to replay.
+
+Each line is one request template::
+
+    {"method": "GET", "path": "/lenders/{lender_id}", "weight": 30}
+    {"method": "GET", "path": "/loans/search", "params": {"status": "pending", "lender_id": "{lender_id}"}}
+    {"method": "POST", "path": "/loans/", "json": {"borrower_id": "{user_id}", "amount": 5000, ...}}
+
+``path`` should be the route template as declared in main.py, so the report
+can match it to the server's per-route SQL counts. Placeholders in the
+path, params, json and headers are filled per request:
+
+* ``{user_id}``, ``{lender_id}``, ``{loan_id}``: uniform over the seeded
+  ids;
+* ``{pending_loan_id}``: a seeded pending loan that has a lender, so it
+  can be approved. Each is handed out once per run (the workers split
+  the pool), then draws fall back to random ones;
+* ``{approved_loan_id}``: a seeded approved loan, for repayments;
+* ``{n}``: a counter unique within the run, and ``{run}``: a token unique
+  to the run, for fields that must not collide (usernames, emails).
+
+A string that is exactly one placeholder becomes the raw value, so
+``"{lender_id}"`` in a JSON body is sent as an integer. ``"fill"`` draws a
+placeholder from another source while the path stays the route template:
+``{"path": "/loans/{loan_id}/approve", "fill": {"loan_id": "pending_loan_id"}}``.
+
+When any line has a ``weight``, requests are drawn at random in proportion
+to the weights (lines without one weigh 1). Otherwise the file is a
+recorded sequence and is replayed in order, looping.
+"""
+import itertools
+import json
+import os
+import random
+import re
+from collections import deque
+
+MIXES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mixes")
+_PLACEHOLDER = re.compile(r"\{(\w+)\}")
+
+
+def mix_path(name):
+    # A bare name refers to a file shipped in perf/mixes
+    if os.path.exists(name):
+        return name
+    return os.path.join(MIXES_DIR, name if name.endswith(".jsonl") else f"{name}.jsonl")
+
+
+def load_mix(name):
+    entries = []
+    with open(mix_path(name)) as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            entry = json.loads(line)
+            if "path" not in entry:
+                raise ValueError(f"{name}:{number}: request has no path")
+            entry["method"] = entry.get("method", "GET").upper()
+            entry["route"] = f"{entry['method']} {entry['path']}"
+            entries.append(entry)
+    if not entries:
+        raise ValueError(f"{name}: empty mix")
+    return entries
+
+
+def _fill(value, values):
+    if isinstance(value, str):
+        whole = _PLACEHOLDER.fullmatch(value)
+        if whole:
+            return values[whole.group(1)]()
+        return _PLACEHOLDER.sub(lambda m: str(values[m.group(1)]()), value)
+    if isinstance(value, dict):
+        return {key: _fill(item, values) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_fill(item, values) for item in value]
+    return value
+
+
+class RequestFactory:
+    """Turns a mix into concrete requests: ``(route, method, url, kwargs)``.
+
+    ``worker`` (out of ``workers``) keeps ``{n}`` unique and splits the
+    one-shot id pools when several connections or processes share a run.
+    ``pools`` are the id lists from perf.datagen.id_pools.
+    """
+
+    def __init__(self, entries, counts, run_token, worker=0, random_seed=None, pools=None, workers=1):
+        self.entries = entries
+        self.rng = random.Random(random_seed)
+        self.counter = itertools.count(worker * 10_000_000)
+        pools = pools or {}
+        pending = list(pools.get("pending_loan", ()))
+        approved = list(pools.get("approved_loan", ()))
+        self._pending_left = deque(pending[worker::workers])
+        weighted = any("weight" in entry for entry in entries)
+        self.weights = list(itertools.accumulate(entry.get("weight", 1) for entry in entries)) if weighted else None
+        self.sequence = None if weighted else itertools.cycle(entries)
+        rng = self.rng
+        self.values = {
+            "user_id": lambda: rng.randint(1, counts["users"]),
+            "lender_id": lambda: rng.randint(1, counts["lenders"]),
+            "loan_id": lambda: rng.randint(1, counts["loans"]),
+            "pending_loan_id": lambda: self._pending_left.popleft() if self._pending_left else (
+                rng.choice(pending) if pending else rng.randint(1, counts["loans"])),
+            "approved_loan_id": lambda: rng.choice(approved) if approved else rng.randint(1, counts["loans"]),
+            "n": lambda: next(self.counter),
+            "run": lambda: run_token,
+        }
+
+    def next(self):
+        if self.sequence is not None:
+            entry = next(self.sequence)
+        else:
+            entry = self.rng.choices(self.entries, cum_weights=self.weights)[0]
+        values = self.values
+        if "fill" in entry:
+            values = dict(values, **{name: values[source] for name, source in entry["fill"].items()})
+        kwargs = {}
+        for field in ("params", "json", "headers"):
+            if field in entry:
+                kwargs[field] = _fill(entry[field], values)
+        if "headers" in kwargs:
+            kwargs["headers"] = {key: str(value) for key, value in kwargs["headers"].items()}
+        return entry["route"], entry["method"], _fill(entry["path"], values), kwargs
@@ -0,0 +1,260 @@
+"""Run results, reports, baselines and regression comparison.
+
+Drivers record client-side latency and status per route (the mix's
+``"METHOD /template"``). SQL statements per request come from the server:
+``http_request_db_queries`` is scraped from /metrics before and after the
+measured window and the difference is divided by the request count, per
+route template.
+
+Baselines are reports saved as JSON in perf/baselines. ``compare`` flags a
+route as regressed when:
+
+* its p50 or p99 grew by more than the tolerance and by at least
+  ``MIN_LATENCY_DELTA_MS``, so sub-millisecond noise on cheap routes
+  doesn't count (p99 only with ``MIN_TAIL_SAMPLES`` requests on both
+  sides; below that it is just the slowest few);
+* it runs more SQL statements per request;
+* its error rate (5xx and transport errors) rose by more than
+  ``MAX_ERROR_RATE_DELTA``, or the share of any status class (2xx, 4xx,
+  ...) moved by more than ``MAX_STATUS_SHARE_DELTA``: a route that starts
+  failing fast must not pass as faster.
+
+The run regresses when total throughput drops by more than the tolerance
+or its overall error rate rises.
+"""
+import json
+import math
+import os
+import platform
+from collections import Counter, defaultdict
+
+from prometheus_client.parser import text_string_to_metric_families
+
+BASELINES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baselines")
+DEFAULT_TOLERANCE = 0.2
+MIN_LATENCY_DELTA_MS = 1.0
+MIN_TAIL_SAMPLES = 200
+# Fractional statements can come from routes with cache hits or retries
+MAX_STATEMENTS_DELTA = 0.5
+MAX_ERROR_RATE_DELTA = 0.01
+MAX_STATUS_SHARE_DELTA = 0.05
+
+
+class Results:
+    """Client-side measurements of one driver (or one load process)."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+
+    def record(self, route, seconds, status):
+        self.latencies[route].append(seconds)
+        self.statuses[route][status] += 1
+
+    def merge(self, other):
+        for route, values in other.latencies.items():
+            self.latencies[route].extend(values)
+        for route, counts in other.statuses.items():
+            self.statuses[route].update(counts)
+
+    def __getstate__(self):
+        return {"latencies": dict(self.latencies), "statuses": dict(self.statuses)}
+
+    def __setstate__(self, state):
+        self.latencies = defaultdict(list, state["latencies"])
+        self.statuses = defaultdict(Counter, state["statuses"])
+
+
+def db_query_totals(metrics_text):
+    """``{"METHOD /template": (statements, requests)}`` from a /metrics scrape."""
+    totals = defaultdict(lambda: [0.0, 0.0])
+    for family in text_string_to_metric_families(metrics_text):
+        if family.name != "http_request_db_queries":
+            continue
+        for sample in family.samples:
+            route = f"{sample.labels['method']} {sample.labels['handler']}"
+            if sample.name.endswith("_sum"):
+                totals[route][0] += sample.value
+            elif sample.name.endswith("_count"):
+                totals[route][1] += sample.value
+    return {route: tuple(value) for route, value in totals.items()}
+
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return float("nan")
+    return sorted_values[max(0, min(len(sorted_values) - 1, math.ceil(q * len(sorted_values)) - 1))]
+
+
+def environment(**settings):
+    return {"python": platform.python_version(), "machine": platform.machine(), "system": platform.system(),
+            "cpus": os.cpu_count(), **settings}
+
+
+def summarize(results, elapsed, db_before, db_after, meta):
+    routes = {}
+    total = errors = 0
+    statements = requests_seen = 0.0
+    for route in sorted(results.latencies):
+        values = sorted(results.latencies[route])
+        statuses = results.statuses[route]
+        failed = sum(count for status, count in statuses.items() if status == "error" or int(status) >= 500)
+        before = db_before.get(route, (0.0, 0.0))
+        after = db_after.get(route, (0.0, 0.0))
+        served = after[1] - before[1]
+        per_request = round((after[0] - before[0]) / served, 2) if served else None
+        if served:
+            statements += after[0] - before[0]
+            requests_seen += served
+        routes[route] = {
+            "count": len(values),
+            "rps": round(len(values) / elapsed, 1),
+            "p50_ms": round(percentile(values, 0.50) * 1000, 3),
+            "p95_ms": round(percentile(values, 0.95) * 1000, 3),
+            "p99_ms": round(percentile(values, 0.99) * 1000, 3),
+            "max_ms": round(values[-1] * 1000, 3),
+            "mean_ms": round(sum(values) / len(values) * 1000, 3),
+            "statuses": {str(status): count for status, count in sorted(statuses.items(), key=str)},
+            "errors": failed,
+            "db_statements": per_request,
+        }
+        total += len(values)
+        errors += failed
+    everything = sorted(value for values in results.latencies.values() for value in values)
+    return {
+        "meta": meta,
+        "elapsed_s": round(elapsed, 2),
+        "requests": total,
+        "throughput_rps": round(total / elapsed, 1),
+        "errors": errors,
+        "p50_ms": round(percentile(everything, 0.50) * 1000, 3),
+        "p95_ms": round(percentile(everything, 0.95) * 1000, 3),
+        "p99_ms": round(percentile(everything, 0.99) * 1000, 3),
+        "db_statements_per_request": round(statements / requests_seen, 2) if requests_seen else None,
+        "routes": routes,
+    }
+
+
+def _statements(value):
+    return "-" if value is None else f"{value:.2f}"
+
+
+def print_report(report):
+    meta = report["meta"]
+    print(f"\n{meta['driver']} driver, mix {meta['mix']}, {meta['dialect']}, scale {meta['scale']}, "
+          f"concurrency {meta['concurrency']}, {report['elapsed_s']}s")
+    print(f"{report['requests']:,} requests, {report['throughput_rps']:,.1f} req/s, {report['errors']} errors, "
+          f"p50 {report['p50_ms']:.2f} p95 {report['p95_ms']:.2f} p99 {report['p99_ms']:.2f} ms, "
+          f"{_statements(report['db_statements_per_request'])} SQL statements/request\n")
+    print(f"{'route':<44} {'count':>8} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'sql/req':>8}  statuses")
+    for route, row in report["routes"].items():
+        print(f"{route:<44} {row['count']:>8,} {row['rps']:>8.1f} {row['p50_ms']:>8.2f} {row['p95_ms']:>8.2f} "
+              f"{row['p99_ms']:>8.2f} {_statements(row['db_statements']):>8}  "
+              f"{' '.join(f'{status}:{count}' for status, count in row['statuses'].items())}")
+
+
+def baseline_path(name):
+    if name.endswith(".json") or os.sep in name:
+        return name
+    return os.path.join(BASELINES_DIR, f"{name}.json")
+
+
+def save_baseline(report, name):
+    path = baseline_path(name)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+        f.write("\n")
+    return path
+
+
+def load_baseline(name):
+    with open(baseline_path(name)) as f:
+        return json.load(f)
+
+
+def _latency_regressed(old, new, tolerance):
+    return new > old * (1 + tolerance) and new - old >= MIN_LATENCY_DELTA_MS
+
+
+def _error_rate(row):
+    return row["errors"] / row["count"] if row["count"] else 0.0
+
+
+def _status_shares(row):
+    shares = {}
+    for status, count in row["statuses"].items():
+        group = status if status == "error" else f"{status[0]}xx"
+        shares[group] = shares.get(group, 0.0) + count / row["count"]
+    return shares
+
+
+def _status_flags(before, after):
+    flags = []
+    old, new = _error_rate(before), _error_rate(after)
+    if new > old + MAX_ERROR_RATE_DELTA:
+        flags.append(f"error rate {old:.1%} -> {new:.1%}")
+    old_shares, new_shares = _status_shares(before), _status_shares(after)
+    moved = [
+        f"{group} {old_shares.get(group, 0.0):.0%} -> {new_shares.get(group, 0.0):.0%}"
+        for group in sorted(set(old_shares) | set(new_shares))
+        if abs(new_shares.get(group, 0.0) - old_shares.get(group, 0.0)) > MAX_STATUS_SHARE_DELTA
+    ]
+    if moved:
+        flags.append(f"status mix {', '.join(moved)}")
+    return flags
+
+
+def compare(baseline, report, tolerance=DEFAULT_TOLERANCE):
+    """Prints the comparison and returns the list of regressions."""
+    regressions = []
+    mismatched = [
+        f"{key}: {baseline['meta'].get(key)} -> {report['meta'].get(key)}"
+        for key in ("driver", "mix", "dialect", "scale", "concurrency", "processes", "cpus")
+        if baseline["meta"].get(key) != report["meta"].get(key)
+    ]
+    if mismatched:
+        print(f"\nwarning: runs differ in {', '.join(mismatched)}")
+
+    old, new = baseline["throughput_rps"], report["throughput_rps"]
+    if old:
+        print(f"\nthroughput {old:,.1f} -> {new:,.1f} req/s ({(new / old - 1) * 100:+.1f}%)")
+        if new < old * (1 - tolerance):
+            regressions.append(f"throughput {old:,.1f} -> {new:,.1f} req/s")
+    old_errors = baseline["errors"] / baseline["requests"] if baseline["requests"] else 0.0
+    new_errors = report["errors"] / report["requests"] if report["requests"] else 0.0
+    print(f"error rate {old_errors:.2%} -> {new_errors:.2%}")
+    if new_errors > old_errors + MAX_ERROR_RATE_DELTA:
+        regressions.append(f"error rate {old_errors:.2%} -> {new_errors:.2%}")
+
+    print(f"\n{'route':<44} {'p50 before':>10} {'after':>8} {'p99 before':>10} {'after':>8} "
+          f"{'sql before':>10} {'after':>6} {'err before':>10} {'after':>6}")
+    for route in sorted(set(baseline["routes"]) | set(report["routes"])):
+        before, after = baseline["routes"].get(route), report["routes"].get(route)
+        if before is None or after is None:
+            print(f"{route:<44} {'only in ' + ('current run' if before is None else 'baseline'):>30}")
+            continue
+        flags = []
+        fields = ["p50_ms"]
+        if min(before["count"], after["count"]) >= MIN_TAIL_SAMPLES:
+            fields.append("p99_ms")
+        for field in fields:
+            if _latency_regressed(before[field], after[field], tolerance):
+                flags.append(f"{field[:3]} {before[field]:.2f} -> {after[field]:.2f} ms")
+        if (before["db_statements"] is not None and after["db_statements"] is not None
+                and after["db_statements"] > before["db_statements"] + MAX_STATEMENTS_DELTA):
+            flags.append(f"SQL statements {before['db_statements']:.2f} -> {after['db_statements']:.2f}")
+        flags.extend(_status_flags(before, after))
+        print(f"{route:<44} {before['p50_ms']:>10.2f} {after['p50_ms']:>8.2f} {before['p99_ms']:>10.2f} "
+              f"{after['p99_ms']:>8.2f} {_statements(before['db_statements']):>10} "
+              f"{_statements(after['db_statements']):>6} {_error_rate(before):>10.1%} {_error_rate(after):>6.1%}"
+              f"{'  REGRESSED' if flags else ''}")
+        regressions.extend(f"{route}: {flag}" for flag in flags)
+
+    if regressions:
+        print(f"\n{len(regressions)} regression(s) beyond {tolerance:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+    else:
+        print(f"\nno regressions beyond {tolerance:.0%}")
+    return regressions
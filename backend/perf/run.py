@@ -0,0 +1,112 @@
+"""End-to-end performance run: seed, replay a request mix, report, compare.
+
+Seeds a database at the chosen scale (perf.datagen), replays a JSONL mix
+(perf/mixes, see perf.mix) for a warm-up and a measured window, and
+reports throughput, p50/p95/p99 per route and SQL statements per request.
+
+* ``--driver asgi`` (default) runs main.app in-process (perf.driver);
+  ``--driver http`` starts uvicorn and drives it from several processes
+  (perf.loadgen), or targets a running server with ``--url``.
+* ``--save-baseline NAME`` writes the report to perf/baselines/NAME.json;
+  ``--compare NAME`` checks the run against it and exits with status 1 on
+  a regression (see perf.report for the rules).
+
+Run from backend/, e.g. before and after a change to main.py:
+
+    python -m perf.run --mix read_heavy --scale small --save-baseline read_heavy-sqlite
+    python -m perf.run --mix read_heavy --scale small --compare read_heavy-sqlite
+    python -m perf.run --driver http --processes 4 --concurrency 64 --mix mixed
+
+Without DATABASE_URL it uses a fresh SQLite file; point DATABASE_URL at a
+local PostgreSQL to run there (the tables must be empty, or pass --reset to
+drop them first, or --no-seed to reuse data seeded at the same --scale).
+Admission control is off unless ADMISSION_CONTROL is set, so rate limits
+don't cap the numbers.
+
+Needs the dev requirements (httpx drives the app): pip install -r
+requirements-dev.txt.
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import uuid
+
+if "DATABASE_URL" not in os.environ:
+    os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(), "perf.db")
+os.environ.setdefault("ADMISSION_CONTROL", "0")
+
+from database import Base, SessionLocal, engine  # noqa: E402
+from perf import datagen, report  # noqa: E402
+from perf.mix import load_mix  # noqa: E402
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--driver", choices=("asgi", "http"), default="asgi")
+    parser.add_argument("--mix", default="read_heavy", help="name in perf/mixes or a path to a JSONL file")
+    parser.add_argument("--scale", choices=sorted(datagen.SCALES), default="small")
+    parser.add_argument("--duration", type=float, default=20.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="unrecorded seconds before measuring")
+    parser.add_argument("--concurrency", type=int, default=16, help="closed-loop connections in total")
+    parser.add_argument("--processes", type=int, default=max(1, min(4, os.cpu_count() or 1)),
+                        help="load generator processes (http driver)")
+    parser.add_argument("--url", help="target a running server instead of starting one (http driver)")
+    parser.add_argument("--no-seed", action="store_true", help="reuse data already seeded at --scale")
+    parser.add_argument("--reset", action="store_true", help="drop and recreate the tables before seeding")
+    parser.add_argument("--save-baseline", metavar="NAME")
+    parser.add_argument("--compare", metavar="NAME", help="baseline to compare against")
+    parser.add_argument("--tolerance", type=float, default=report.DEFAULT_TOLERANCE)
+    parser.add_argument("--output", help="also write the report JSON here")
+    args = parser.parse_args()
+
+    entries = load_mix(args.mix)
+    counts = datagen.SCALES[args.scale]
+    if args.url is None and not args.no_seed:
+        if args.reset:
+            Base.metadata.drop_all(bind=engine)
+        print(f"seeding scale {args.scale}: {counts['users']:,} users, {counts['lenders']:,} lenders, "
+              f"{counts['loans']:,} loans ...")
+        datagen.seed(**counts)
+    pools = {}
+    if args.url is None:
+        with SessionLocal() as db:
+            pools = datagen.id_pools(db)
+    engine.dispose()
+
+    run_token = uuid.uuid4().hex[:8]
+    print(f"replaying {args.mix} ({len(entries)} request types) with {args.concurrency} connections: "
+          f"{args.warmup:g}s warm-up, {args.duration:g}s measured")
+    if args.driver == "asgi":
+        from perf.driver import run_asgi
+        results, elapsed, db_before, db_after = asyncio.run(
+            run_asgi(entries, counts, run_token, args.concurrency, args.warmup, args.duration, pools))
+        processes = 1
+    else:
+        from perf.loadgen import run_http
+        processes = args.processes
+        results, elapsed, db_before, db_after = run_http(
+            entries, counts, run_token, args.concurrency, args.warmup, args.duration, processes, args.url,
+            pools=pools)
+
+    meta = report.environment(
+        driver=args.driver, mix=os.path.splitext(os.path.basename(args.mix))[0], scale=args.scale,
+        dialect=engine.dialect.name, concurrency=args.concurrency, processes=processes,
+        duration=args.duration,
+    )
+    current = report.summarize(results, elapsed, db_before, db_after, meta)
+    report.print_report(current)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(current, f, indent=2, sort_keys=True)
+    if args.save_baseline:
+        print(f"\nbaseline saved to {report.save_baseline(current, args.save_baseline)}")
+    if args.compare:
+        if report.compare(report.load_baseline(args.compare), current, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""Opt-in request profiling, slow-query log and rolling top-K reports.
+
+Profiling:
+- A request is profiled with cProfile if it is sampled
+  (``PROFILE_SAMPLE_RATE``, 0 by default).
+- It is also profiled if it carries ``X-Profile: <PROFILE_TOKEN>``; with no
+  token configured, the header is ignored.
+- The response gets ``Server-Timing`` and ``X-Profile-Id`` headers. The
+  call tree is kept in memory for ``GET /admin/profiles/{id}``, and a
+  one-line summary is printed.
+- One request is profiled at a time. cProfile follows the event-loop
+  thread, so the tree can include other requests' coroutines. Threadpool
+  work is not included.
+
+Query insights (``QUERY_INSIGHTS``, off by default):
+- Every statement's time goes into a rolling window keyed by normalized
+  SQL. Literals are replaced by ``?`` and IN lists are collapsed.
+- A statement slower than ``SLOW_QUERY_MS`` is logged with its parameter
+  types, never their values.
+- A request that runs the same SELECT ``N_PLUS_ONE_THRESHOLD`` or more
+  times is reported as a likely N+1.
+- Route latencies go into the same kind of rolling window.
+
+``GET /admin/insights`` reports the top routes and statements over the
+last ``INSIGHTS_WINDOW`` seconds. The /admin endpoints answer 404 unless
+``PROFILE_TOKEN`` is set, and then require it in ``X-Profile-Token``.
+
+With sampling off and no token, the profiling check is two comparisons per
+request. With insights off as well, the middleware passes requests straight
+through and the SQL hooks only count and time statements, as before.
+"""
+import cProfile
+import hmac
+import os
+import pstats
+import random
+import re
+import time
+import uuid
+from collections import deque
+from datetime import datetime
+from functools import lru_cache
+
+import metrics
+
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "50"))
+PROFILE_TREE_DEPTH = int(os.getenv("PROFILE_TREE_DEPTH", "12"))
+QUERY_INSIGHTS = os.getenv("QUERY_INSIGHTS", "0").lower() in ("1", "true", "yes")
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "250"))
+SLOW_QUERY_KEEP = int(os.getenv("SLOW_QUERY_KEEP", "200"))
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "10"))
+INSIGHTS_WINDOW = float(os.getenv("INSIGHTS_WINDOW", "300"))
+# Call-tree branches below this share of the request are left out
+TREE_MIN_FRACTION = 0.01
+TREE_MAX_CHILDREN = 8
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"(?<![\w$])-?\d+(?:\.\d+)?\b")
+_PLACEHOLDER_LIST = re.compile(r"\((?:\s*(?:\?|%s|%\(\w+\)s|\$\d+|:\w+)\s*,)+\s*(?:\?|%s|%\(\w+\)s|\$\d+|:\w+)\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+@lru_cache(maxsize=4096)
+def normalize_sql(statement):
+    """SQL with literals replaced by ``?`` and placeholder lists collapsed,
+    so statements differing only in values (or IN-list length) match."""
+    statement = _STRING_LITERAL.sub("?", statement)
+    statement = _NUMBER_LITERAL.sub("?", statement)
+    statement = _PLACEHOLDER_LIST.sub("(...)", statement)
+    return _WHITESPACE.sub(" ", statement).strip()
+
+
+def redact_parameters(parameters, executemany):
+    """Parameter types only; values never reach the log."""
+    if executemany:
+        rows = list(parameters) if not isinstance(parameters, (list, tuple)) else parameters
+        return {"rows": len(rows), "first": redact_parameters(rows[0], False) if rows else None}
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return type(parameters).__name__
+
+
+class RollingWindow:
+    """Per-key count, total and max over the last ``window`` seconds, kept
+    in ``slots`` time slices so old data ages out without timestamps per
+    event. Recorded from the loop and from threadpool threads without a
+    lock: a rare lost increment is fine for diagnostics."""
+
+    def __init__(self, window=INSIGHTS_WINDOW, slots=10):
+        self.window = window
+        self.slot_seconds = window / slots
+        self.slots = deque(maxlen=slots)
+
+    def record(self, key, value):
+        index = int(time.monotonic() // self.slot_seconds)
+        if not self.slots or self.slots[-1][0] != index:
+            self.slots.append((index, {}))
+        entries = self.slots[-1][1]
+        entry = entries.get(key)
+        if entry is None:
+            entries[key] = [1, value, value]
+        else:
+            entry[0] += 1
+            entry[1] += value
+            if value > entry[2]:
+                entry[2] = value
+
+    def merged(self):
+        oldest = int(time.monotonic() // self.slot_seconds) - self.slots.maxlen + 1
+        merged = {}
+        for index, entries in list(self.slots):
+            if index < oldest:
+                continue
+            for key, (count, total, peak) in list(entries.items()):
+                entry = merged.get(key)
+                if entry is None:
+                    merged[key] = [count, total, peak]
+                else:
+                    entry[0] += count
+                    entry[1] += total
+                    entry[2] = max(entry[2], peak)
+        return merged
+
+    def top(self, k, by="total"):
+        """The ``k`` keys with the highest ``by`` (count, total, avg or max),
+        as ``(key, count, total, avg, max)``."""
+        rows = [(key, count, total, total / count, peak) for key, (count, total, peak) in self.merged().items()]
+        column = ("count", "total", "avg", "max").index(by) + 1
+        rows.sort(key=lambda row: row[column], reverse=True)
+        return rows[:k]
+
+
+def _timings(rows):
+    return [
+        {"key": key, "count": count, "total_ms": round(total * 1000, 3), "avg_ms": round(avg * 1000, 3),
+         "max_ms": round(peak * 1000, 3)}
+        for key, count, total, avg, peak in rows
+    ]
+
+
+def _function_name(func):
+    filename, line, name = func
+    if filename == "~":
+        return name
+    return f"{os.path.basename(filename)}:{line}({name})"
+
+
+def call_tree(profile, total_seconds, max_depth=PROFILE_TREE_DEPTH):
+    """Call tree from cProfile caller edges, pruned to the branches that
+    account for at least TREE_MIN_FRACTION of ``total_seconds``."""
+    stats = pstats.Stats(profile).stats
+    children = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, (calls, _, _, cumulative) in callers.items():
+            children.setdefault(caller, []).append((cumulative, calls, func))
+    threshold = total_seconds * TREE_MIN_FRACTION
+    # Frames already running when profiling started (the middleware, the
+    # event loop) are never entered, so what they called has no caller, or
+    # callers that only explain later coroutine resumptions. Roots are the
+    # functions with time left over after their recorded callers.
+    roots = []
+    for func, (_, calls, _, cumulative, callers) in stats.items():
+        unattributed = cumulative - sum(edge[3] for edge in callers.values())
+        if unattributed >= threshold:
+            roots.append((unattributed, calls, func))
+
+    def node(func, calls, cumulative, path, depth):
+        entry = {"function": _function_name(func), "calls": calls, "cumulative_ms": round(cumulative * 1000, 3),
+                 "own_ms": round(stats[func][2] * 1000, 3)}
+        if depth < max_depth:
+            branches = sorted(children.get(func, ()), reverse=True)
+            entry["children"] = [
+                node(child, child_calls, child_cumulative, path | {child}, depth + 1)
+                for child_cumulative, child_calls, child in branches[:TREE_MAX_CHILDREN]
+                if child_cumulative >= threshold and child not in path
+            ]
+        return entry
+
+    tree = [node(func, calls, cumulative, {func}, 0) for cumulative, calls, func in sorted(roots, reverse=True)]
+    hottest = sorted(stats.items(), key=lambda item: item[1][2], reverse=True)[:15]
+    return tree, [
+        {"function": _function_name(func), "calls": entry[1], "own_ms": round(entry[2] * 1000, 3),
+         "cumulative_ms": round(entry[3] * 1000, 3)}
+        for func, entry in hottest
+    ]
+
+
+class Profiler:
+    def __init__(self, sample_rate=PROFILE_SAMPLE_RATE, token=PROFILE_TOKEN, insights=QUERY_INSIGHTS):
+        self.sample_rate = sample_rate
+        self.token = token.encode()
+        self.insights = insights
+        self.routes = RollingWindow()
+        self.statements = RollingWindow()
+        self.n_plus_one = RollingWindow()
+        self.slow_queries = deque(maxlen=SLOW_QUERY_KEEP)
+        self.profiles = {}
+        self._profile_order = deque()
+        self._active = False
+        self.profiled = 0
+        self.skipped = 0
+
+    # Triggering
+
+    def wants_profile(self, scope):
+        if self.token:
+            for key, value in scope["headers"]:
+                if key == b"x-profile":
+                    return hmac.compare_digest(value, self.token)
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self):
+        """A started cProfile.Profile, or None if one is already running."""
+        if self._active:
+            self.skipped += 1
+            return None
+        self._active = True
+        profile = cProfile.Profile()
+        profile.enable()
+        return profile
+
+    def finish(self, profile, scope, elapsed, db_stats):
+        profile.disable()
+        self._active = False
+        self.profiled += 1
+        tree, hottest = call_tree(profile, elapsed)
+        profile_id = uuid.uuid4().hex[:16]
+        summary = {
+            "id": profile_id,
+            "at": datetime.utcnow().isoformat(),
+            "method": scope["method"],
+            "path": scope["path"],
+            "duration_ms": round(elapsed * 1000, 3),
+            "db_queries": db_stats.queries if db_stats is not None else None,
+            "db_ms": round(db_stats.seconds * 1000, 3) if db_stats is not None else None,
+            "hottest": hottest,
+            "call_tree": tree,
+        }
+        self.profiles[profile_id] = summary
+        self._profile_order.append(profile_id)
+        while len(self._profile_order) > PROFILE_KEEP:
+            self.profiles.pop(self._profile_order.popleft(), None)
+        top = hottest[0]["function"] if hottest else "-"
+        print(f"Profiled {scope['method']} {scope['path']}: {summary['duration_ms']:.1f} ms, "
+              f"{summary['db_queries']} queries, hottest {top} (profile {profile_id})")
+        return summary
+
+    # Query insights
+
+    def observe_query(self, statement, parameters, executemany, seconds):
+        normalized = normalize_sql(statement)
+        self.statements.record(normalized, seconds)
+        if seconds * 1000 >= SLOW_QUERY_MS:
+            entry = {"at": datetime.utcnow().isoformat(), "ms": round(seconds * 1000, 3), "statement": normalized,
+                     "parameters": redact_parameters(parameters, executemany)}
+            self.slow_queries.append(entry)
+            print(f"Slow query ({entry['ms']:.0f} ms): {normalized} params={entry['parameters']}")
+
+    def request_finished(self, route_key, seconds, db_stats):
+        self.routes.record(route_key, seconds)
+        if db_stats is None or not db_stats.statements:
+            return
+        for statement, count in db_stats.statements.items():
+            if count >= N_PLUS_ONE_THRESHOLD:
+                normalized = normalize_sql(statement)
+                if normalized[:6].upper() == "SELECT":
+                    self.n_plus_one.record(f"{route_key} | {normalized}", count)
+                    print(f"Possible N+1 in {route_key}: {count} executions of {normalized}")
+
+    def insights_report(self, k=10, by="total"):
+        n_plus_one = []
+        # This window records executions per request rather than seconds
+        for key, requests, _, avg, peak in self.n_plus_one.top(k, by="count"):
+            route, statement = key.split(" | ", 1)
+            n_plus_one.append({"route": route, "statement": statement, "requests": requests,
+                               "avg_executions": round(avg, 1), "max_executions": peak})
+        return {
+            "window_seconds": self.routes.window,
+            "routes": _timings(self.routes.top(k, by)),
+            "statements": _timings(self.statements.top(k, by)),
+            "n_plus_one": n_plus_one,
+            "slow_queries": list(self.slow_queries)[-k:][::-1],
+        }
+
+    def stats(self):
+        return {
+            "insights": self.insights,
+            "sample_rate": self.sample_rate,
+            "profiled": self.profiled,
+            "skipped": self.skipped,
+            "slow_queries": len(self.slow_queries),
+            "profiles_kept": len(self.profiles),
+        }
+
+
+class ProfilingMiddleware:
+    """Pure ASGI middleware; must run inside PrometheusMiddleware so the
+    request's SQL statistics are visible."""
+
+    def __init__(self, app, profiler):
+        self.app = app
+        self.profiler = profiler
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        profiler = self.profiler
+        profile = profiler.start() if profiler.wants_profile(scope) else None
+        if profile is None and not profiler.insights:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        db_stats = metrics.current_db_stats()
+
+        async def profiled_send(message):
+            nonlocal profile
+            if message["type"] == "http.response.start" and profile is not None:
+                elapsed = time.perf_counter() - start
+                summary = profiler.finish(profile, scope, elapsed, db_stats)
+                profile = None
+                timing = f"app;dur={summary['duration_ms']}"
+                if db_stats is not None:
+                    timing += f', db;dur={summary["db_ms"]};desc="{db_stats.queries} queries"'
+                message = dict(message, headers=[*message.get("headers", []),
+                                                 (b"server-timing", timing.encode()),
+                                                 (b"x-profile-id", summary["id"].encode())])
+            await send(message)
+
+        try:
+            await self.app(scope, receive, profiled_send)
+        finally:
+            if profile is not None:
+                # No response was started (e.g. the app raised)
+                profiler.finish(profile, scope, time.perf_counter() - start, db_stats)
+            if profiler.insights:
+                route = scope.get("route")
+                handler = route.path if route is not None else "unmatched"
+                profiler.request_finished(f"{scope['method']} {handler}", time.perf_counter() - start, db_stats)
@@ -0,0 +1,94 @@
+"""Filterable loan search.
+
+Every filter is optional and combined with AND. Results are keyset-paginated
+on ``(sort column, loan_id)``. The composite indexes declared on ``Loan``
+put the equality filters (lender, status, borrower) first and
+``(creation_date, loan_id)`` last, so the common "pending loans for lender X,
+newest first" query reads the index in order and stops after one page.
+
+With an archive reader (see archive.py), archived loans matching the
+filters are merged in: both sides return a page after the same cursor and
+the merged page is cut to the limit, so cursors work across the two.
+"""
+import enum
+from datetime import date
+
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+
+from models import Loan
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, encode_cursor, sorted_page
+
+
+class LoanSort(str, enum.Enum):
+    created = "created"
+    amount = "amount"
+    interest_rate = "interest_rate"
+    loan_id = "loan_id"
+
+
+class SortOrder(str, enum.Enum):
+    asc = "asc"
+    desc = "desc"
+
+
+# Sort key -> (column, parser for the value stored in the cursor)
+SORT_COLUMNS = {
+    LoanSort.created: (Loan.creation_date, date.fromisoformat),
+    LoanSort.amount: (Loan.amount, float),
+    LoanSort.interest_rate: (Loan.interest_rate, float),
+    LoanSort.loan_id: (Loan.loan_id, int),
+}
+
+
+def loan_search_statement(columns, status=None, borrower_id=None, lender_id=None, min_amount=None,
+                          max_amount=None, min_rate=None, max_rate=None, created_from=None, created_to=None):
+    stmt = select(*columns)
+    if status is not None:
+        stmt = stmt.where(Loan.status == status)
+    if borrower_id is not None:
+        stmt = stmt.where(Loan.borrower_id == borrower_id)
+    if lender_id is not None:
+        stmt = stmt.where(Loan.lender_id == lender_id)
+    if min_amount is not None:
+        stmt = stmt.where(Loan.amount >= min_amount)
+    if max_amount is not None:
+        stmt = stmt.where(Loan.amount <= max_amount)
+    if min_rate is not None:
+        stmt = stmt.where(Loan.interest_rate >= min_rate)
+    if max_rate is not None:
+        stmt = stmt.where(Loan.interest_rate <= max_rate)
+    if created_from is not None:
+        stmt = stmt.where(Loan.creation_date >= created_from)
+    if created_to is not None:
+        stmt = stmt.where(Loan.creation_date <= created_to)
+    return stmt
+
+
+async def search_loans(db, columns, filters, sort=LoanSort.created, order=SortOrder.desc, cursor=None,
+                       limit=None, archive=None):
+    sort_column, parse_sort = SORT_COLUMNS[sort]
+    descending = order == SortOrder.desc
+    stmt = loan_search_statement(columns, **filters)
+    page = await sorted_page(db, stmt, sort_column, Loan.loan_id, cursor, limit, descending=descending,
+                             parse_sort=parse_sort)
+    if archive is None:
+        return page
+
+    # sorted_page has already rejected a malformed cursor
+    after = None
+    if cursor:
+        sort_value, key = decode_cursor(cursor)
+        after = (parse_sort(sort_value), key)
+    limit = min(limit or DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE)
+    archived = await run_in_threadpool(archive.search, filters, sort.value, descending, after, limit)
+    if not archived:
+        return page
+
+    sort_key = sort_column.key
+    items = page["items"] + archived
+    items.sort(key=lambda item: (item[sort_key], item["loan_id"]), reverse=descending)
+    more = page["next_cursor"] is not None or len(items) > limit
+    items = items[:limit]
+    next_cursor = encode_cursor([items[-1][sort_key], items[-1]["loan_id"]]) if more else None
+    return {"items": items, "next_cursor": next_cursor}
@@ -0,0 +1,58 @@
+"""JSON encoding for API responses.
+
+Rows leave the database as plain column values (ints, floats, strings,
+dates, enums), so they can go straight to orjson without FastAPI's
+``jsonable_encoder`` walk or a per-row Pydantic validation. orjson is
+optional; without it the stdlib encoder produces the same documents.
+"""
+import json
+from datetime import date, datetime
+from enum import Enum
+
+from fastapi.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
+
+
+def _default(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    # NumPy scalars from the analytics module
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SERIALIZE_NUMPY
+
+    def dumps(content):
+        """Encode ``content`` to JSON bytes."""
+        return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS)
+
+    loads = orjson.loads
+else:
+    def dumps(content):
+        """Encode ``content`` to JSON bytes."""
+        return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode()
+
+    loads = json.loads
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when it is installed."""
+
+    def render(self, content):
+        return dumps(content)
+
+
+def model_columns(table, model):
+    """Columns of ``table`` named by the fields of response ``model``, in
+    field order, so list queries select exactly what the model exposes."""
+    fields = getattr(model, "model_fields", None) or model.__fields__
+    return tuple(table.columns[name] for name in fields)
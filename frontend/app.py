@@ -1,7 +1,7 @@
 import streamlit as st
-import requests
 
-BACKEND_URL = "http://backend:8000"  # Update this if your backend runs on a different URL
+import backend_client
+from backend_client import BackendError
 
 def main():
     st.title("Peer-to-Peer Lending Platform")
@@ -14,17 +14,20 @@ def main():
     ]
     choice = st.sidebar.selectbox("Menu", menu)
 
-    if choice == "User Operations":
-        user_operations()
+    try:
+        if choice == "User Operations":
+            user_operations()
 
-    elif choice == "Lender Operations":
-        lender_operations()
+        elif choice == "Lender Operations":
+            lender_operations()
 
-    elif choice == "Loan Operations":
-        loan_operations()
+        elif choice == "Loan Operations":
+            loan_operations()
 
-    elif choice == "View All Data":
-        view_all_data()
+        elif choice == "View All Data":
+            view_all_data()
+    except BackendError as e:
+        st.error(str(e))
 
 def user_operations():
     st.header("User Operations")
@@ -41,8 +44,8 @@ def user_operations():
             email = st.text_input("Email")
             phone = st.text_input("Phone Number")
             if st.form_submit_button("Register"):
-                response = requests.post(
-                    f"{BACKEND_URL}/users/",
+                response = backend_client.post(
+                    "/users/",
                     json={
                         "username": username,
                         "password": password,
@@ -59,24 +62,24 @@ def user_operations():
     elif user_choice == "View User":
         user_id = st.number_input("Enter User ID", min_value=1)
         if st.button("View User"):
-            response = requests.get(f"{BACKEND_URL}/users/{user_id}")
-            if response.status_code == 200:
-                st.json(response.json())
+            status, body = backend_client.get(f"/users/{user_id}")
+            if status == 200:
+                st.json(body)
             else:
-                st.error(f"Failed to fetch user: {response.text}")
+                st.error(f"Failed to fetch user: {body}")
 
     elif user_choice == "Update User":
         user_id = st.number_input("Enter User ID to Update", min_value=1)
         
         # First fetch existing user data
         if st.button("Load User Data"):
-            response = requests.get(f"{BACKEND_URL}/users/{user_id}")
-            if response.status_code == 200:
-                user_data = response.json()
+            status, body = backend_client.fetch(f"/users/{user_id}")
+            if status == 200:
+                user_data = body
                 st.session_state.user_data = user_data
                 st.success("User data loaded!")
             else:
-                st.error(f"Failed to load user: {response.text}")
+                st.error(f"Failed to load user: {body}")
         
         if 'user_data' in st.session_state:
             with st.form("update_user_form"):
@@ -91,8 +94,8 @@ def user_operations():
                         "phone_number": phone
                     }
                     
-                    response = requests.put(
-                        f"{BACKEND_URL}/users/{user_id}",
+                    response = backend_client.put(
+                        f"/users/{user_id}",
                         json=update_data
                     )
                     if response.status_code == 200:
@@ -105,7 +108,7 @@ def user_operations():
     elif user_choice == "Delete User":
         user_id = st.number_input("Enter User ID to Delete", min_value=1)
         if st.button("Delete User"):
-            response = requests.delete(f"{BACKEND_URL}/users/{user_id}")
+            response = backend_client.delete(f"/users/{user_id}")
             if response.status_code == 200:
                 st.success("User deleted successfully!")
             else:
@@ -125,8 +128,8 @@ def lender_operations():
             credit_score = st.number_input("Credit Score", min_value=0.0, max_value=1000.0)
             available_funds = st.number_input("Available Funds", min_value=0.0)
             if st.form_submit_button("Register"):
-                response = requests.post(
-                    f"{BACKEND_URL}/lenders/",
+                response = backend_client.post(
+                    "/lenders/",
                     json={
                         "name": name,
                         "email": email,
@@ -143,23 +146,23 @@ def lender_operations():
     elif lender_choice == "View Lender":
         lender_id = st.number_input("Enter Lender ID", min_value=1)
         if st.button("View Lender"):
-            response = requests.get(f"{BACKEND_URL}/lenders/{lender_id}")
-            if response.status_code == 200:
-                st.json(response.json())
+            status, body = backend_client.get(f"/lenders/{lender_id}")
+            if status == 200:
+                st.json(body)
             else:
-                st.error(f"Failed to fetch lender: {response.text}")
+                st.error(f"Failed to fetch lender: {body}")
 
     elif lender_choice == "Update Lender":
         lender_id = st.number_input("Enter Lender ID to Update", min_value=1)
         
         if st.button("Load Lender Data"):
-            response = requests.get(f"{BACKEND_URL}/lenders/{lender_id}")
-            if response.status_code == 200:
-                lender_data = response.json()
+            status, body = backend_client.fetch(f"/lenders/{lender_id}")
+            if status == 200:
+                lender_data = body
                 st.session_state.lender_data = lender_data
                 st.success("Lender data loaded!")
             else:
-                st.error(f"Failed to load lender: {response.text}")
+                st.error(f"Failed to load lender: {body}")
         
         if 'lender_data' in st.session_state:
             with st.form("update_lender_form"):
@@ -178,8 +181,8 @@ def lender_operations():
                         "available_funds": available_funds
                     }
                     
-                    response = requests.put(
-                        f"{BACKEND_URL}/lenders/{lender_id}",
+                    response = backend_client.put(
+                        f"/lenders/{lender_id}",
                         json=update_data
                     )
                     if response.status_code == 200:
@@ -192,7 +195,7 @@ def lender_operations():
     elif lender_choice == "Delete Lender":
         lender_id = st.number_input("Enter Lender ID to Delete", min_value=1)
         if st.button("Delete Lender"):
-            response = requests.delete(f"{BACKEND_URL}/lenders/{lender_id}")
+            response = backend_client.delete(f"/lenders/{lender_id}")
             if response.status_code == 200:
                 st.success("Lender deleted successfully!")
             else:
@@ -214,8 +217,8 @@ def loan_operations():
             term_months = st.number_input("Term (months)", min_value=1)
             purpose = st.text_input("Purpose")
             if st.form_submit_button("Create"):
-                response = requests.post(
-                    f"{BACKEND_URL}/loans/",
+                response = backend_client.post(
+                    "/loans/",
                     json={
                         "borrower_id": borrower_id,
                         "lender_id": lender_id,
@@ -235,23 +238,23 @@ def loan_operations():
     elif loan_choice == "View Loan":
         loan_id = st.number_input("Enter Loan ID", min_value=1)
         if st.button("View Loan"):
-            response = requests.get(f"{BACKEND_URL}/loans/{loan_id}")
-            if response.status_code == 200:
-                st.json(response.json())
+            status, body = backend_client.get(f"/loans/{loan_id}")
+            if status == 200:
+                st.json(body)
             else:
-                st.error(f"Failed to fetch loan: {response.text}")
+                st.error(f"Failed to fetch loan: {body}")
 
     elif loan_choice == "Update Loan":
         loan_id = st.number_input("Enter Loan ID to Update", min_value=1)
         
         if st.button("Load Loan Data"):
-            response = requests.get(f"{BACKEND_URL}/loans/{loan_id}")
-            if response.status_code == 200:
-                loan_data = response.json()
+            status, body = backend_client.fetch(f"/loans/{loan_id}")
+            if status == 200:
+                loan_data = body
                 st.session_state.loan_data = loan_data
                 st.success("Loan data loaded!")
             else:
-                st.error(f"Failed to load loan: {response.text}")
+                st.error(f"Failed to load loan: {body}")
         
         if 'loan_data' in st.session_state:
             with st.form("update_loan_form"):
@@ -282,8 +285,8 @@ def loan_operations():
                         "status": status
                     }
                     
-                    response = requests.put(
-                        f"{BACKEND_URL}/loans/{loan_id}",
+                    response = backend_client.put(
+                        f"/loans/{loan_id}",
                         json=update_data
                     )
                     if response.status_code == 200:
@@ -296,7 +299,7 @@ def loan_operations():
     elif loan_choice == "Delete Loan":
         loan_id = st.number_input("Enter Loan ID to Delete", min_value=1)
         if st.button("Delete Loan"):
-            response = requests.delete(f"{BACKEND_URL}/loans/{loan_id}")
+            response = backend_client.delete(f"/loans/{loan_id}")
             if response.status_code == 200:
                 st.success("Loan deleted successfully!")
             else:
@@ -305,8 +308,8 @@ def loan_operations():
     elif loan_choice == "Approve Loan":
         loan_id = st.number_input("Enter Loan ID to Approve", min_value=1)
         if st.button("Approve Loan"):
-            response = requests.put(
-                f"{BACKEND_URL}/loans/{loan_id}/approve"
+            response = backend_client.put(
+                f"/loans/{loan_id}/approve"
             )
             if response.status_code == 200:
                 st.success("Loan approved successfully!")
@@ -316,30 +319,36 @@ def loan_operations():
 
 def view_all_data():
     st.header("View All Data")
-    
-    if st.button("View All Users"):
-        response = requests.get(f"{BACKEND_URL}/users/")
-        if response.status_code == 200:
-            st.subheader("All Users")
-            st.write(response.json())
-        else:
-            st.error(f"Failed to fetch users: {response.text}")
+    table = st.selectbox("Table", ["users", "lenders", "loans"])
+    page_size = st.selectbox("Rows per page", [25, 50, 100, 500], index=1)
+    filters = {}
+    if table == "loans":
+        status_col, lender_col = st.columns(2)
+        filters["status"] = status_col.selectbox("Status", ["", "pending", "approved", "rejected", "paid"])
+        filters["lender_id"] = lender_col.number_input("Lender ID (0 for any)", min_value=0) or None
+
+    # Pages are fetched one at a time with the backend's keyset cursors; the
+    # cursors of pages already visited are kept for "Previous"
+    query = (table, page_size, tuple(sorted(filters.items())))
+    if st.session_state.get("browse_query") != query:
+        st.session_state.browse_query = query
+        st.session_state.browse_cursors = [None]
+    cursors = st.session_state.browse_cursors
 
-    if st.button("View All Lenders"):
-        response = requests.get(f"{BACKEND_URL}/lenders/")
-        if response.status_code == 200:
-            st.subheader("All Lenders")
-            st.write(response.json())
-        else:
-            st.error(f"Failed to fetch lenders: {response.text}")
+    status, body = backend_client.get_page(table, cursors[-1], page_size, **filters)
+    if status != 200:
+        st.error(f"Failed to fetch {table}: {body}")
+        return
+    st.dataframe(body["items"], use_container_width=True)
 
-    if st.button("View All Loans"):
-        response = requests.get(f"{BACKEND_URL}/loans/")
-        if response.status_code == 200:
-            st.subheader("All Loans")
-            st.write(response.json())
-        else:
-            st.error(f"Failed to fetch loans: {response.text}")
+    previous_col, page_col, next_col = st.columns([1, 2, 1])
+    if previous_col.button("Previous", disabled=len(cursors) == 1):
+        cursors.pop()
+        st.rerun()
+    page_col.write(f"Page {len(cursors)}")
+    if next_col.button("Next", disabled=body["next_cursor"] is None):
+        cursors.append(body["next_cursor"])
+        st.rerun()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
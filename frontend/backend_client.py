@@ -0,0 +1,151 @@
+"""Shared HTTP client for the Streamlit app.
+
+All calls go through one pooled ``requests.Session`` per Streamlit process
+(keep-alive, timeouts, retries with backoff). Reads are cached with
+``st.cache_data`` for ``READ_CACHE_TTL`` seconds and the cache is cleared
+after every successful write made from this app; writes by other clients
+show up once the TTL expires. Only 2xx responses are cached, and ``fetch``
+bypasses the cache for reads that must be current (edit forms).
+
+Retries cover connection errors and 429/502/503/504, honouring the
+backend's Retry-After (capped at ``MAX_RETRY_AFTER`` so the UI never hangs
+for long). POSTs are retried too: each one carries a fresh Idempotency-Key,
+so the backend replays the stored response instead of running it twice.
+
+Every request carries ``BACKEND_API_KEY`` (when set) as ``X-API-Key``, so
+the backend's admission control rate limits the app, which speaks for all
+its users, on a budget of its own instead of its container's IP.
+"""
+import os
+import uuid
+
+import requests
+import streamlit as st
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+BACKEND_URL = os.getenv("BACKEND_URL", "http://backend:8000")
+CONNECT_TIMEOUT = float(os.getenv("BACKEND_CONNECT_TIMEOUT", "3"))
+READ_TIMEOUT = float(os.getenv("BACKEND_READ_TIMEOUT", "30"))
+POOL_SIZE = int(os.getenv("BACKEND_POOL_SIZE", "10"))
+RETRIES = int(os.getenv("BACKEND_RETRIES", "3"))
+BACKOFF_FACTOR = float(os.getenv("BACKEND_BACKOFF", "0.3"))
+MAX_RETRY_AFTER = float(os.getenv("BACKEND_MAX_RETRY_AFTER", "5"))
+READ_CACHE_TTL = float(os.getenv("READ_CACHE_TTL", "30"))
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "50"))
+BACKEND_API_KEY = os.getenv("BACKEND_API_KEY", "")
+
+RETRY_STATUSES = (429, 502, 503, 504)
+
+
+class BackendError(Exception):
+    """The backend could not be reached (after retries)."""
+
+
+class CappedRetry(Retry):
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        return None if retry_after is None else min(retry_after, MAX_RETRY_AFTER)
+
+
+def create_session():
+    retry = CappedRetry(
+        total=RETRIES, backoff_factor=BACKOFF_FACTOR, status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset({"GET", "HEAD", "PUT", "DELETE", "POST"}),
+        respect_retry_after_header=True, raise_on_status=False,
+    )
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    if BACKEND_API_KEY:
+        session.headers["X-API-Key"] = BACKEND_API_KEY
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+# One session per process, shared by every browser session and rerun
+session = st.cache_resource(create_session)
+
+
+def request(method, path, **kwargs):
+    try:
+        return session().request(method, f"{BACKEND_URL}{path}", timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                                 **kwargs)
+    except requests.RequestException as e:
+        raise BackendError(f"Backend unavailable: {e}") from e
+
+
+# Reads
+
+class _NotCached(Exception):
+    # Raised out of the cached function so st.cache_data doesn't keep it
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.body = body
+
+
+def fetch(path, params=None):
+    """Uncached GET; returns ``(status_code, body)`` with the JSON body, or
+    the text when the response isn't JSON."""
+    response = request("GET", path, params=params)
+    try:
+        body = response.json()
+    except ValueError:
+        body = response.text
+    return response.status_code, body
+
+
+@st.cache_data(ttl=READ_CACHE_TTL, show_spinner=False)
+def _cached_fetch(path, params):
+    status_code, body = fetch(path, params)
+    if not 200 <= status_code < 300:
+        raise _NotCached(status_code, body)
+    return status_code, body
+
+
+def get(path, params=None):
+    """Like ``fetch``, but successful responses are cached. Errors (404, a
+    503 that outlasted the retries) are returned without being cached."""
+    try:
+        return _cached_fetch(path, params)
+    except _NotCached as e:
+        return e.status_code, e.body
+
+
+def get_page(resource, cursor=None, limit=PAGE_SIZE, **filters):
+    """One keyset page of ``/{resource}/`` (or ``/loans/search`` with filters);
+    returns ``(status_code, body)`` like ``get``."""
+    path = f"/{resource}/"
+    params = {"limit": limit}
+    if cursor:
+        params["cursor"] = cursor
+    filters = {name: value for name, value in filters.items() if value not in (None, "")}
+    if filters:
+        path = f"/{resource}/search"
+        params.update(filters)
+    return get(path, params)
+
+
+def invalidate():
+    _cached_fetch.clear()
+
+
+# Writes
+
+def _write(method, path, **kwargs):
+    response = request(method, path, **kwargs)
+    if response.status_code < 400:
+        invalidate()
+    return response
+
+
+def post(path, json=None):
+    return _write("POST", path, json=json, headers={"Idempotency-Key": str(uuid.uuid4())})
+
+
+def put(path, json=None):
+    return _write("PUT", path, json=json)
+
+
+def delete(path):
+    return _write("DELETE", path)